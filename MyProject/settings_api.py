@@ -0,0 +1,24 @@
+"""
+Settings of processes that serve only the JSON API, e.g.
+
+    DJANGO_SETTINGS_MODULE=MyProject.settings_api gunicorn MyProject.wsgi
+
+The API authenticates with tokens and renders no templates, so it does without
+the admin, sessions, messages and static files, their middleware and the HTML
+views, and its workers start and answer their first request sooner.
+"""
+
+from MyProject.settings import *
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'Pymodoro',
+)
+
+MIDDLEWARE_CLASSES = (
+    'Pymodoro.instrumentation.PerformanceMiddleware',
+    'django.middleware.common.CommonMiddleware',
+)
+
+ROOT_URLCONF = 'MyProject.urls_api'
@@ -0,0 +1,6 @@
+from django.conf.urls import patterns, include, url
+
+# The URLs of MyProject.settings_api: the API alone, under the same paths and names as in MyProject.urls.
+urlpatterns = patterns('',
+    url(r'^pymodoro/api/', include('Pymodoro.api_urls', namespace="Pymodoro")),
+)
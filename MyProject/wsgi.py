@@ -10,5 +10,11 @@ https://docs.djangoproject.com/en/dev/howto/deployment/wsgi/
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "MyProject.settings")
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+if 'django.contrib.staticfiles' in settings.INSTALLED_APPS:
+    # The collected static files are served before the request reaches Django.
+    from Pymodoro.assets import StaticFilesApplication
+    application = StaticFilesApplication(application)
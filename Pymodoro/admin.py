@@ -1,11 +1,128 @@
 from django.contrib import admin
-from Pymodoro.models import Pomodoro
+from django.db import DatabaseError, connections
+from Pymodoro import search
+from Pymodoro.models import ApiToken, Break, Job, Membership, Pomodoro, PomodoroQuerySet, PomodoroSession, Tag, Team, day_bounds
+
+# Below this many rows the changelist counts them exactly.
+ESTIMATE_THRESHOLD = 10000
+
+
+def estimated_count(model, using):
+    """
+    Returns the database statistics' estimate of the rows in a model's table, or None.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+    elif connection.vendor == 'sqlite':
+        # Filled in by ANALYZE, the first number is the number of rows.
+        sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+    else:
+        return None
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    return int(float(str(row[0]).split()[0]))
+
+
+class EstimatedCountQuerySet(PomodoroQuerySet):
+
+    def count(self):
+        # The unfiltered changelist of a big table shows an estimate instead of a COUNT(*) scan.
+        if not self.query.where and self._result_cache is None:
+            estimate = estimated_count(self.model, self.db)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+        return super(EstimatedCountQuerySet, self).count()
+
 
 class PomodoroAdmin(admin.ModelAdmin):
-    fields = ['user', 'end_time', 'tag']
-    list_display = ('id', 'user', 'tag', 'init_time', 'end_time', 'is_from_today')
+    fields = ['user', 'end_time', 'duration', 'tag']
+    list_display = ('id', 'user', 'tag', 'start_time', 'end_time', 'is_from_today')
     list_filter = ['end_time']
-    search_fields = ['tag']
-    date_hierarchy = 'end_time'
+    list_select_related = ('user', 'tag')
+    raw_id_fields = ['tag']
+    # Used without the tag search index, see get_search_results.
+    search_fields = ['^tag__name']
+
+    def get_queryset(self, request):
+        # The default manager's query, filters and database, counted by estimate.
+        queryset = super(PomodoroAdmin, self).get_queryset(request)
+        queryset = EstimatedCountQuerySet(self.model, query=queryset.query, using=queryset._db)
+        # Whether a pomodoro is from today is computed by the database, as a range on end_time.
+        qn = connections[queryset.db].ops.quote_name
+        column = '%s.%s' % (qn(Pomodoro._meta.db_table), qn('end_time'))
+        return queryset.extra(select={'ended_today': '%s >= %%s AND %s < %%s' % (column, column)},
+                              select_params=day_bounds())
+
+    def get_search_results(self, request, queryset, search_term):
+        # Pomodoros whose tag has words starting with those searched, found in the tag search index.
+        found = search.tag_ids_sql(connections[queryset.db], search_term)
+        if found is None:
+            return super(PomodoroAdmin, self).get_search_results(request, queryset, search_term)
+        sql, params = found
+        qn = connections[queryset.db].ops.quote_name
+        return queryset.extra(where=['%s.%s IN (%s)' % (qn(Pomodoro._meta.db_table), qn('tag_id'), sql)],
+                              params=params), False
+
+    def is_from_today(self, obj):
+        return bool(obj.ended_today)
+    is_from_today.admin_order_field = 'end_time'
+    is_from_today.boolean = True
+    is_from_today.short_description = 'is from today?'
+
+admin.site.register(Pomodoro, PomodoroAdmin)
+
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'name')
+    list_select_related = ('user',)
+    search_fields = ['name']
+
+admin.site.register(Tag, TagAdmin)
+
+class BreakAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'start_time', 'end_time')
+    list_filter = ['kind']
+    list_select_related = ('user',)
+
+admin.site.register(Break, BreakAdmin)
+
+class PomodoroSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'tag', 'start_time', 'duration', 'status')
+    list_filter = ['status']
+    list_select_related = ('user',)
+
+admin.site.register(PomodoroSession, PomodoroSessionAdmin)
+
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'created')
+    list_select_related = ('user',)
+    raw_id_fields = ['user']
+
+admin.site.register(ApiToken, ApiTokenAdmin)
+
+class MembershipInline(admin.TabularInline):
+    model = Membership
+    raw_id_fields = ['user']
+    extra = 1
+
+class TeamAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name')
+    search_fields = ['name']
+    inlines = [MembershipInline]
+
+admin.site.register(Team, TeamAdmin)
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'run_at', 'attempts')
+    list_filter = ['status']
 
-admin.site.register(Pomodoro, PomodoroAdmin)
\ No newline at end of file
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,279 @@
+"""
+JSON API for the mobile and desktop clients.
+
+Requests authenticate with an 'Authorization: Token <key>' header instead of
+the session cookie and CSRF token of the HTML views; the key is handed out by
+the token endpoint. Pomodoros are returned with their id, tag name and end
+time only, and every GET answers with an ETag made of the user's data version
+so unchanged resources cost a 304 without a body. The sync endpoint exchanges
+only the changes after a client's cursor, see Pymodoro.sync.
+"""
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_http_methods
+from django.views.decorators.vary import vary_on_headers
+
+from functools import wraps
+import datetime, json
+
+from Pymodoro import caching, leaderboards, search, stats, sync, transfer
+from Pymodoro.models import ApiToken, Pomodoro, Tag, Team, local_today
+from Pymodoro.pagination import keyset_page
+from Pymodoro.routers import reads_from_replica
+from Pymodoro.shortcuts import json_response, parse_day
+
+# Most pomodoros a batch request can store, and most a list request can return.
+BATCH_LIMIT = 1000
+PAGE_LIMIT = 500
+
+
+def token_user(request):
+    # The user of the 'Authorization: Token <key>' header, or None.
+    parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(parts) != 2 or parts[0] != 'Token':
+        return None
+    token = ApiToken.objects.select_related('user').filter(key=parts[1]).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+def api_view(view):
+    """
+    Lets only requests with a valid token through, as their token's user.
+    """
+    @csrf_exempt
+    @vary_on_headers('Authorization')
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user = token_user(request)
+        if user is None:
+            return json_response({'error': 'A valid API token is required.'}, status=401)
+        request.user = user
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def user_etag(request, *args, **kwargs):
+    # The day is part of it because stats like streaks move on with the date alone.
+    return '%d-%d-%s' % (request.user.id, caching.data_version(request.user.id), local_today().isoformat())
+
+
+def read_json(request):
+    try:
+        return json.loads(force_text(request.body))
+    except ValueError:
+        raise ValueError('The body is not JSON.')
+
+
+def pomodoro_data(pomodoro):
+    return {'id': pomodoro.id, 'tag': pomodoro.tag.name, 'start_time': pomodoro.start_time.isoformat(),
+            'end_time': pomodoro.end_time.isoformat(), 'minutes': pomodoro.duration}
+
+
+def cleaned_pomodoro(data):
+    # The tag name, end time and minutes of a JSON object, the end time being now by default.
+    if not isinstance(data, dict):
+        raise ValueError('A pomodoro must be a JSON object with a tag.')
+    return transfer.clean_pomodoro(data.get('tag'), data.get('end_time') or timezone.now().isoformat(),
+                                   data.get('minutes'))
+
+
+@require_http_methods(['POST'])
+@csrf_exempt
+def token(request):
+    # Trades a username and password for the user's token, once per client.
+    user = authenticate(username=request.POST.get('username'), password=request.POST.get('password'))
+    if user is None or not user.is_active:
+        return json_response({'error': 'Wrong username or password.'}, status=401)
+    return json_response({'token': ApiToken.objects.for_user(user).key})
+
+
+@require_http_methods(['GET', 'HEAD', 'POST'])
+@api_view
+def pomodoros(request):
+    if request.method == 'POST':
+        return create_pomodoro(request)
+    return pomodoro_list(request)
+
+
+@reads_from_replica
+@condition(etag_func=user_etag)
+def pomodoro_list(request):
+    """
+    A page of the user's pomodoros from newest to oldest, of one tag if ?tag= is given.
+    """
+    pomodoros = Pomodoro.objects.for_user(request.user).select_related('tag')
+    name = request.GET.get('tag')
+    if name is not None:
+        # Resolved first, so the page uses the (tag, end_time) index.
+        pomodoros = pomodoros.filter(tag=Tag.objects.filter(user=request.user, name=name).first())
+    try:
+        size = min(int(request.GET.get('limit', getattr(settings, 'POMODORO_PAGE_SIZE', 50))), PAGE_LIMIT)
+        page = keyset_page(pomodoros, max(size, 1), after=request.GET.get('after'), before=request.GET.get('before'))
+    except ValueError:
+        return json_response({'error': 'Not a valid limit or cursor.'}, status=400)
+    return json_response({'pomodoros': [pomodoro_data(p) for p in page],
+                          'next': page.next_cursor, 'previous': page.previous_cursor})
+
+
+def create_pomodoro(request):
+    try:
+        name, end_time, minutes = cleaned_pomodoro(read_json(request))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    with transaction.atomic():
+        if Pomodoro.objects.taken(request.user.id, end_time - datetime.timedelta(minutes=minutes), end_time):
+            return json_response({'error': 'It overlaps a stored pomodoro.'}, status=409)
+        pomodoro = Pomodoro.objects.create(user=request.user, tag=Tag.objects.named(request.user, name),
+                                           end_time=end_time, duration=minutes)
+    return json_response(pomodoro_data(pomodoro), status=201)
+
+
+@require_http_methods(['POST'])
+@api_view
+def batch(request):
+    """
+    Stores the completed pomodoros a client queued, {"pomodoros": [...]}, all or nothing,
+    refusing with a 409 a batch with one that overlaps a stored pomodoro or another one.
+    """
+    try:
+        items = read_json(request)
+        items = items.get('pomodoros') if isinstance(items, dict) else None
+        if not isinstance(items, list):
+            raise ValueError('The body must be a JSON object with a list of pomodoros.')
+        if len(items) > BATCH_LIMIT:
+            raise ValueError('At most %d pomodoros can be sent at once.' % BATCH_LIMIT)
+        rows = []
+        for number, item in enumerate(items, 1):
+            try:
+                rows.append(cleaned_pomodoro(item))
+            except ValueError as e:
+                raise ValueError('Pomodoro %d: %s' % (number, e))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    try:
+        imported = transfer.import_pomodoros(request.user, rows)
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=409)
+    return json_response({'imported': imported}, status=201)
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_view
+@reads_from_replica
+@condition(etag_func=user_etag)
+def pomodoro_detail(request, pk):
+    pomodoro = Pomodoro.objects.for_user(request.user).select_related('tag').filter(pk=pk).first()
+    if pomodoro is None:
+        return json_response({'error': 'Not found.'}, status=404)
+    return json_response(pomodoro_data(pomodoro))
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_view
+@reads_from_replica
+@condition(etag_func=user_etag)
+def tags(request):
+    # The tags with pomodoros, most used first.
+    return json_response({'tags': [{'name': row['tag'], 'count': row['count'], 'minutes': row['minutes']}
+                                   for row in stats.tag_breakdown(request.user)]})
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_view
+@reads_from_replica
+@condition(etag_func=user_etag)
+def search_tags(request):
+    # Tags are created and counted as pomodoros are saved, which changes the data version of the ETag.
+    return json_response({'tags': search.search_tags(request.user, request.GET.get('q', ''),
+                                                     getattr(settings, 'POMODORO_SEARCH_SIZE', 10))})
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_view
+@reads_from_replica
+@condition(etag_func=user_etag)
+def statistics(request, kind):
+    try:
+        since, until = parse_day(request.GET.get('since')), parse_day(request.GET.get('until'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    return json_response({'kind': kind, 'results': stats.results(request.user, kind, since, until)})
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_view
+def teams(request):
+    return json_response({'teams': [{'id': team.id, 'name': team.name}
+                                    for team in Team.objects.filter(membership__user=request.user).order_by('name')]})
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_view
+def leaderboard(request, pk, period):
+    # No ETag, the other members change it.
+    team = Team.objects.filter(pk=pk, membership__user=request.user).first()
+    if team is None:
+        return json_response({'error': 'Not found.'}, status=404)
+    try:
+        day = parse_day(request.GET.get('day'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    size = getattr(settings, 'POMODORO_LEADERBOARD_SIZE', 10)
+    return json_response(leaderboards.leaderboard(team, request.user, period, size, day))
+
+
+def cleaned_change(data):
+    # The (operation, id, base seq, tag name, end time, minutes) of a JSON object.
+    if not isinstance(data, dict) or data.get('op') not in sync.OPERATIONS:
+        raise ValueError('A change must be a JSON object with an op among %s.' % ', '.join(sync.OPERATIONS))
+    operation = data['op']
+    try:
+        pk = None if operation == sync.CREATE else int(data['id'])
+        base_seq = int(data.get('base_seq') or 0)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Updates and deletes need the id of the pomodoro, and a numeric base_seq.')
+    name, end_time, minutes = cleaned_pomodoro(data) if operation != sync.DELETE else (None, None, None)
+    return operation, pk, base_seq, name, end_time, minutes
+
+
+@require_http_methods(['GET', 'POST'])
+@api_view
+def sync_changes(request):
+    """
+    The changes after ?cursor=. A POST of {"cursor": ..., "changes": [...]} applies the
+    client's changes first and answers with their results too.
+    """
+    try:
+        if request.method == 'POST':
+            data = read_json(request)
+            if not isinstance(data, dict) or not isinstance(data.get('changes'), list):
+                raise ValueError('The body must be a JSON object with a list of changes.')
+            if len(data['changes']) > BATCH_LIMIT:
+                raise ValueError('At most %d changes can be sent at once.' % BATCH_LIMIT)
+            changes = []
+            for number, change in enumerate(data['changes'], 1):
+                try:
+                    changes.append(cleaned_change(change))
+                except ValueError as e:
+                    raise ValueError('Change %d: %s' % (number, e))
+            cursor = data.get('cursor') or 0
+        else:
+            changes = []
+            cursor = request.GET.get('cursor') or 0
+        cursor = int(cursor)
+        limit = min(int(request.GET.get('limit', sync.SYNC_PAGE_SIZE)), sync.SYNC_PAGE_SIZE)
+    except (TypeError, ValueError) as e:
+        return json_response({'error': str(e)}, status=400)
+    results = sync.apply_changes(request.user, changes) if changes else []
+    delta = sync.changes_since(request.user, cursor, max(limit, 1))
+    delta['saved'] = [dict(pomodoro_data(p), seq=p.seq) for p in delta['saved']]
+    if request.method == 'POST':
+        delta['results'] = [{'result': result, 'id': pk} for result, pk in results]
+    return json_response(delta)
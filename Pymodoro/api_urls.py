@@ -0,0 +1,17 @@
+# coding=utf-8
+
+from django.conf.urls import patterns, url
+
+# Included under api/ by Pymodoro.urls, and alone by the API-only MyProject.urls_api.
+urlpatterns = patterns('Pymodoro.api',
+    url(r'^token/$', 'token', name='api_token'),
+    url(r'^pomodoros/$', 'pomodoros', name='api_pomodoros'),
+    url(r'^pomodoros/batch/$', 'batch', name='api_batch'),
+    url(r'^pomodoros/(?P<pk>\d+)/$', 'pomodoro_detail', name='api_pomodoro'),
+    url(r'^tags/$', 'tags', name='api_tags'),
+    url(r'^tags/search/$', 'search_tags', name='api_search'),
+    url(r'^teams/$', 'teams', name='api_teams'),
+    url(r'^teams/(?P<pk>\d+)/leaderboard/(?P<period>day|week)/$', 'leaderboard', name='api_leaderboard'),
+    url(r'^sync/$', 'sync_changes', name='api_sync'),
+    url(r'^stats/(?P<kind>day|week|month|tags|hours|streaks)/$', 'statistics', name='api_stats'),
+)
@@ -0,0 +1,196 @@
+"""
+Static files with hashed names, minified and precompressed, served for a year.
+
+``manage.py collectstatic`` with ManifestStaticFilesStorage minifies the
+collected stylesheets, then copies the static files to STATIC_ROOT under names
+with a hash of their content, as Django's CachedStaticFilesStorage does, writes
+gzip and, with the brotli package installed, brotli copies of the text files
+next to them, and lists the hashed names in the staticfiles.json manifest.
+``{% static %}`` links the hashed names from the manifest, so a changed file
+gets a new URL and the old one can be cached for good. StaticFilesApplication
+serves them in front of Django, picking the precompressed copy the browser
+accepts. The images are committed already recompressed, collectstatic copies
+them as they are.
+"""
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import CachedFilesMixin, CachedStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.utils.six.moves.urllib.parse import unquote, urlsplit
+
+from io import BytesIO
+from wsgiref.util import FileWrapper
+import gzip, json, mimetypes, os, posixpath, re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'staticfiles.json'
+# Files worth compressing, the images are compressed already.
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.ico', '.map')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# The files without a hash in their name may change under the same URL.
+REVALIDATE = 'public, max-age=60'
+
+CSS_STRING = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+
+
+def minify_css(text):
+    """
+    Drops the comments and the whitespace a stylesheet does not need, leaving its strings alone.
+    """
+    parts = CSS_STRING.split(CSS_COMMENT.sub('', text))
+    for i in range(0, len(parts), 2):
+        part = re.sub(r'\s+', ' ', parts[i])
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', part)
+        parts[i] = re.sub(r':\s+', ':', part).replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def gzipped(data):
+    # No file name or time in the header, the same file always compresses to the same bytes.
+    compressed = BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=compressed, compresslevel=9, mtime=0) as output:
+        output.write(data)
+    return compressed.getvalue()
+
+
+def encoders():
+    # The (suffix, function) of every precompressed copy written, the best first.
+    return ([('.br', brotli.compress)] if brotli is not None else []) + [('.gz', gzipped)]
+
+
+def read_manifest(root):
+    # {name: hashed name} of the files collected to root, empty before collectstatic ran.
+    try:
+        with open(os.path.join(root, MANIFEST_NAME)) as manifest:
+            return json.load(manifest).get('paths', {})
+    except (IOError, ValueError):
+        return {}
+
+
+class ManifestStaticFilesStorage(CachedStaticFilesStorage):
+    """
+    Hashed names read from the manifest instead of the cache, see the module documentation.
+    Files missing from the manifest, or all of them in DEBUG, keep their name.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ManifestStaticFilesStorage, self).__init__(*args, **kwargs)
+        self.hashed_files = read_manifest(self.location) if self.location else {}
+
+    def url(self, name, force=False):
+        if force:
+            # Only while collecting, to find the hashed names of the files a stylesheet links.
+            return super(ManifestStaticFilesStorage, self).url(name, force)
+        hashed_name = None if settings.DEBUG else self.hashed_files.get(name)
+        return super(CachedFilesMixin, self).url(hashed_name or name)
+
+    def replace(self, name, data):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(data))
+
+    def minify(self, name):
+        # Minifies a collected stylesheet in place.
+        with self.open(name) as collected:
+            data = collected.read()
+        minified = minify_css(data.decode(settings.FILE_CHARSET)).encode(settings.FILE_CHARSET)
+        if len(minified) < len(data):
+            self.replace(name, minified)
+
+    def compress(self, name):
+        # Writes the compressed copies of a hashed file worth compressing.
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+            return
+        with self.open(name) as hashed:
+            data = hashed.read()
+        for suffix, compress in encoders():
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                self.replace(name + suffix, compressed)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        # The stylesheets are hashed from their minified collected copy, so their names follow what is served.
+        paths = paths.copy()
+        for name in paths:
+            if os.path.splitext(name)[1].lower() == '.css':
+                self.minify(name)
+                paths[name] = (self, name)
+        hashed_files = {}
+        for name, hashed_name, processed in super(ManifestStaticFilesStorage, self).post_process(paths, **options):
+            if hashed_name is not None:
+                hashed_files[name.replace('\\', '/')] = hashed_name
+                if processed:
+                    self.compress(hashed_name)
+            yield name, hashed_name, processed
+        self.hashed_files = hashed_files
+        self.replace(MANIFEST_NAME, json.dumps({'paths': hashed_files, 'version': '1'}, indent=1,
+                                               sort_keys=True).encode('utf-8'))
+
+
+def accepted_encodings(header):
+    # The content codings of an Accept-Encoding header, but those refused with q=0.
+    codings = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        try:
+            quality = float(params.split('=', 1)[1]) if '=' in params else 1.0
+        except ValueError:
+            quality = 1.0
+        if coding.strip() and quality > 0:
+            codings.add(coding.strip().lower())
+    return codings
+
+
+class StaticFilesApplication(object):
+    """
+    WSGI middleware answering the GET and HEAD requests under STATIC_URL from STATIC_ROOT,
+    and passing the rest on to the application. The hashed files of the manifest are cached
+    for a year without revalidation; the manifest is read when the process starts.
+    """
+
+    def __init__(self, application, root=None):
+        self.application = application
+        self.prefix = urlsplit(settings.STATIC_URL or '').path
+        self.root = root or settings.STATIC_ROOT
+        self.immutable = set(read_manifest(self.root).values()) if self.root else set()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if (not self.root or not self.prefix or not path.startswith(self.prefix) or
+                environ.get('REQUEST_METHOD') not in ('GET', 'HEAD')):
+            return self.application(environ, start_response)
+        name = posixpath.normpath(unquote(path[len(self.prefix):])).lstrip('/')
+        filename = os.path.join(self.root, *name.split('/'))
+        if name.startswith('..') or name == '.' or not os.path.isfile(filename):
+            start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+            return [b'Not found.']
+        content_type, encoding = mimetypes.guess_type(name)
+        headers = [('Content-Type', content_type or 'application/octet-stream'),
+                   ('Cache-Control', IMMUTABLE if name in self.immutable else REVALIDATE)]
+        variants = [(suffix, coding) for suffix, coding in (('.br', 'br'), ('.gz', 'gzip'))
+                    if os.path.isfile(filename + suffix)]
+        if variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+            accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+            for suffix, coding in variants:
+                if coding in accepted:
+                    filename += suffix
+                    headers.append(('Content-Encoding', coding))
+                    break
+        stat = os.stat(filename)
+        etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        headers.append(('ETag', etag))
+        if etag in environ.get('HTTP_IF_NONE_MATCH', ''):
+            start_response('304 NOT MODIFIED', headers)
+            return []
+        start_response('200 OK', headers + [('Content-Length', str(stat.st_size))])
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return environ.get('wsgi.file_wrapper', FileWrapper)(open(filename, 'rb'), 8192)
@@ -0,0 +1,542 @@
+"""
+Benchmark scenarios for the Pymodoro request paths.
+
+Every scenario runs against a throwaway test database, see the ``benchmark``
+management command. The suite scenario measures the main request paths at
+once and writes them to a JSON results file that ``benchmark_compare`` checks
+against another run.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.functional import empty
+
+from io import BytesIO
+import datetime, gzip, json, platform, posixpath, random, re, resource, shutil, tempfile, time
+
+import django
+
+from Pymodoro import assets, leaderboards, loadtest, rollups, search, startup, transfer
+from Pymodoro.models import (Membership, Pomodoro, PomodoroSession, Tag, Team, TeamScore, day_bounds, default_minutes,
+                             local_today, pomodoro_length, week_start)
+from Pymodoro.pagination import encode_cursor
+
+BENCH_PASSWORD = 'bench'
+SEED_BATCH_SIZE = 10000
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def timed(func, repeat):
+    """
+    Calls func() repeat times and returns the median wall time in milliseconds.
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    return median(timings)
+
+
+def peak_rss_kb():
+    """
+    Returns the peak resident set size of this process in kilobytes.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def rss_kb():
+    """
+    Returns the current resident set size of this process in kilobytes, or None where /proc is missing.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def measure(func, repeat):
+    """
+    Calls func() repeat times and returns its p50 and p99 wall times in milliseconds and
+    the most queries a call made.
+    """
+    timings, queries = [], 0
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.time()
+            func()
+            timings.append((time.time() - start) * 1000)
+        queries = max(queries, len(captured))
+    return {'p50_ms': round(loadtest.percentile(timings, 0.5), 2),
+            'p99_ms': round(loadtest.percentile(timings, 0.99), 2), 'queries': queries}
+
+
+def create_bench_user(username='bench_user'):
+    return User.objects.create_user(username=username, password=BENCH_PASSWORD)
+
+
+def logged_client(user):
+    client = Client()
+    client.login(username=user.username, password=BENCH_PASSWORD)
+    return client
+
+
+def user_tags(user, count):
+    return [Tag.objects.named(user, 'tag%d' % i) for i in range(count)]
+
+
+def grow_pomodoros(target, users, days=5 * 365, rnd=None):
+    """
+    Adds pomodoros spread over the past days among users until the table has target rows.
+    """
+    rnd = rnd or random.Random(0)
+    now = timezone.now()
+    tags = dict((user, user_tags(user, 50)) for user in users)
+    missing = target - Pomodoro.objects.count()
+    while missing > 0:
+        batch = []
+        for i in range(min(missing, SEED_BATCH_SIZE)):
+            end_time = now - datetime.timedelta(days=rnd.randint(1, days), minutes=rnd.randint(0, 24 * 60))
+            user = rnd.choice(users)
+            batch.append(Pomodoro(user=user, tag=rnd.choice(tags[user]), end_time=end_time))
+        Pomodoro.objects.bulk_create(batch, batch_size=500)
+        missing -= len(batch)
+
+
+def bench_index(out, sizes, repeat, **options):
+    """
+    Index view latency while the table grows; it should stay flat.
+    """
+    user = create_bench_user()
+    others = [create_bench_user('bench_other_%d' % i) for i in range(100)]
+    tag = Tag.objects.named(user, 'today')
+    for i in range(10):
+        Pomodoro.objects.create(user=user, tag=tag, end_time=timezone.now())
+    client = logged_client(user)
+    url = reverse('Pymodoro:index')
+    out.write('%12s %12s' % ('rows', 'index ms'))
+    for size in sizes:
+        grow_pomodoros(size, others)
+        out.write('%12d %12.2f' % (size, timed(lambda: client.get(url), repeat)))
+
+
+def bench_start(out, sizes, repeat, **options):
+    """
+    Starts one pomodoro per user and keeps them all running in this single process.
+    """
+    out.write('%12s %12s %14s %14s' % ('running', 'start ms', 'requests/s', 'complete s'))
+    for size in sizes:
+        clients = [logged_client(create_bench_user('bench_start_%d_%d' % (size, i))) for i in range(size)]
+        url = reverse('Pymodoro:index')
+        start = time.time()
+        timings = []
+        for client in clients:
+            request_start = time.time()
+            client.post(url, {'tag': 'bench'})
+            timings.append((time.time() - request_start) * 1000)
+        elapsed = time.time() - start
+        assert PomodoroSession.objects.running().count() == size
+        now = timezone.now()
+        PomodoroSession.objects.running().update(start_time=now - pomodoro_length(), end_time=now)
+        complete_start = time.time()
+        PomodoroSession.objects.complete_due()
+        out.write('%12d %12.2f %14.1f %14.2f' % (size, median(timings), size / elapsed, time.time() - complete_start))
+
+
+def bench_stream(out, sizes, repeat, **options):
+    """
+    Polls the timer events of every running pomodoro once, as browsers do every
+    POMODORO_STATUS_SECONDS; the responses end at once, nothing is pushed. Reports the
+    connections left open in this process, the memory it gained per running pomodoro, and
+    the polls per second that many running pomodoros send and that one worker answers.
+    """
+    user = create_bench_user('bench_stream')
+    client = logged_client(user)
+    interval = getattr(settings, 'POMODORO_STATUS_SECONDS', 15)
+    out.write('%12s %12s %12s %12s %14s %14s' % ('running', 'poll ms', 'open conns', 'KB/running', 'polls/s sent',
+                                                 'polls/s served'))
+    for size in sizes:
+        PomodoroSession.objects.bulk_create([PomodoroSession(user=user, tag='bench', start_time=timezone.now())
+                                             for i in range(size)], batch_size=500)
+        timings, open_responses, before = [], 0, rss_kb()
+        for pk in PomodoroSession.objects.running(user).values_list('id', flat=True):
+            start = time.time()
+            response = client.get(reverse('Pymodoro:session_events', args=(pk,)))
+            timings.append((time.time() - start) * 1000)
+            open_responses += response.streaming
+        after = rss_kb()
+        per_running = float(after - before) / size if before is not None and after is not None else float('nan')
+        out.write('%12d %12.2f %12d %12.2f %14.1f %14.1f' % (size, median(timings), open_responses, per_running,
+                                                            float(size) / interval, 1000 / median(timings)))
+        PomodoroSession.objects.running(user).update(status=PomodoroSession.ABANDONED)
+
+
+def bench_tag(out, sizes, repeat, **options):
+    """
+    Tag page latency at the start and in the middle of a growing tag history; both should stay flat.
+    """
+    user = create_bench_user()
+    client = logged_client(user)
+    tag = Tag.objects.named(user, 'deep')
+    url = reverse('Pymodoro:tag', args=('deep',))
+    now = timezone.now()
+    out.write('%12s %12s %12s' % ('rows', 'first ms', 'middle ms'))
+    for size in sizes:
+        missing = size - Pomodoro.objects.filter(user=user).count()
+        while missing > 0:
+            batch = [Pomodoro(user=user, tag=tag, end_time=now - datetime.timedelta(minutes=30 * (size - missing + i)))
+                     for i in range(min(missing, SEED_BATCH_SIZE))]
+            Pomodoro.objects.bulk_create(batch, batch_size=500)
+            missing -= len(batch)
+        middle = Pomodoro.objects.filter(user=user).order_by('-end_time', '-id')[size // 2]
+        out.write('%12d %12.2f %12.2f' % (size, timed(lambda: client.get(url), repeat),
+                                          timed(lambda: client.get(url, {'after': encode_cursor(middle)}), repeat)))
+
+
+def bench_import(out, sizes, repeat, **options):
+    """
+    Rows per minute of a bulk import in order and shuffled, compared with saving the same rows
+    one by one; a shuffled file should not be slower as the history grows.
+    """
+    now = timezone.now()
+    out.write('%12s %16s %16s %16s' % ('rows', 'bulk rows/min', 'shuffled rows/min', 'save rows/min'))
+    for size in sizes:
+        rates = []
+        for label in ('sorted', 'shuffled'):
+            user = create_bench_user('bench_import_%s_%d' % (label, size))
+            rows = [['tag%d' % (i % 50), (now - datetime.timedelta(minutes=30 * i)).isoformat(), default_minutes()]
+                    for i in range(size)]
+            if label == 'shuffled':
+                random.Random(0).shuffle(rows)
+            lines = [transfer.csv_line(transfer.FIELDS)] + [transfer.csv_line(row) for row in rows]
+            start = time.time()
+            transfer.import_lines(user, lines)
+            rates.append(size / (time.time() - start) * 60)
+        # Row by row saves are only timed on a sample, they would take too long.
+        sample = min(size, 5000)
+        tags = user_tags(user, 50)
+        start = time.time()
+        for i in range(sample):
+            Pomodoro(user=user, tag=tags[i % 50], end_time=now - datetime.timedelta(minutes=30 * i)).save()
+        out.write('%12d %16.0f %16.0f %16.0f' % ((size,) + tuple(rates) + (sample / (time.time() - start) * 60,)))
+
+
+def bench_stats(out, sizes, repeat, budget, **options):
+    """
+    Latency of every statistics endpoint for users with five years of history, against the budget.
+    """
+    rnd = random.Random(0)
+    now = timezone.now()
+    out.write('%12s %10s %12s' % ('rows', 'stats', 'ms'))
+    for size in sizes:
+        user = create_bench_user('bench_stats_%d' % size)
+        client = logged_client(user)
+        tags = user_tags(user, 31)
+        missing = size
+        while missing > 0:
+            batch = [Pomodoro(user=user, tag=rnd.choice(tags),
+                              end_time=now - datetime.timedelta(minutes=rnd.randint(0, 5 * 365 * 24 * 60)))
+                     for i in range(min(missing, SEED_BATCH_SIZE))]
+            Pomodoro.objects.bulk_create(batch, batch_size=500)
+            missing -= len(batch)
+        rollups.rebuild([user])
+        for kind in ('day', 'week', 'month', 'tags', 'hours', 'streaks'):
+            url = reverse('Pymodoro:stats', args=(kind,))
+            ms = timed(lambda: client.get(url), repeat)
+            out.write('%12d %10s %12.2f%s' % (size, kind, ms, '  OVER BUDGET' if ms > budget else ''))
+
+
+def bench_autocomplete(out, sizes, repeat, **options):
+    """
+    Tag autocomplete latency while the user's distinct tags grow; it should stay flat.
+    """
+    rnd = random.Random(0)
+    user = create_bench_user()
+    client = logged_client(user)
+    url = reverse('Pymodoro:tag_autocomplete')
+    out.write('%12s %12s' % ('tags', 'suggest ms'))
+    for size in sizes:
+        missing = size - Tag.objects.filter(user=user).count()
+        while missing > 0:
+            first = size - missing
+            Tag.objects.bulk_create([Tag(user=user, name='tag %06d' % i)
+                                     for i in range(first, first + min(missing, SEED_BATCH_SIZE))], batch_size=500)
+            missing -= min(missing, SEED_BATCH_SIZE)
+        prefix = 'tag %03d' % rnd.randint(0, max(size // 1000 - 1, 0))
+        out.write('%12d %12.2f' % (size, timed(lambda: client.get(url, {'q': prefix}), repeat)))
+
+
+def bench_search(out, sizes, repeat, budget, **options):
+    """
+    Latency of a prefix and of a fuzzy tag search of one user while the tags of all users
+    grow, a thousand each, against the budget; the searches do not read the pomodoros.
+    """
+    rnd = random.Random(0)
+    words = [u'deep', u'work', u'reading', u'email', u'thesis', u'caf\xe9', u'review', u'planning', u'\xe9criture']
+    out.write('%12s %12s %12s' % ('tags', 'prefix ms', 'fuzzy ms'))
+    users = []
+    for size in sizes:
+        while len(users) * 1000 < size:
+            user = User.objects.create(username='bench_search_%d' % len(users), password='!')
+            Tag.objects.bulk_create([Tag(user=user, name=u'%s %s %d' % (rnd.choice(words), rnd.choice(words), i))
+                                     for i in range(1000)], batch_size=500)
+            users.append(user)
+        # Bulk created tags send no signals.
+        search.rebuild()
+        user = users[len(users) // 2]
+        prefix = timed(lambda: search.search_tags(user, u'Rev PLA'), repeat)
+        fuzzy = timed(lambda: search.search_tags(user, u'thesys'), repeat)
+        out.write('%12d %12.2f %12.2f%s' % (size, prefix, fuzzy, '  OVER BUDGET' if max(prefix, fuzzy) > budget else ''))
+
+
+# Milliseconds a leaderboard read may take, whatever the size of the team.
+LEADERBOARD_BUDGET_MS = 1.0
+
+
+def bench_leaderboard(out, sizes, repeat, **options):
+    """
+    Top ten, and rank of a middle and of the last ranked member, in teams of growing size,
+    from the scores and with a GROUP BY on the pomodoros of the week; reads from the scores
+    over LEADERBOARD_BUDGET_MS are flagged.
+    """
+    rnd = random.Random(0)
+    now = timezone.now()
+    week = day_bounds(week_start(local_today()))[0]
+    out.write('%12s %12s %12s %12s %12s %14s' % ('members', 'top ms', 'rank ms', 'last rank ms', 'save ms',
+                                                'group by ms'))
+    for size in sizes:
+        team = Team.objects.create(name='bench_%d' % size)
+        User.objects.bulk_create([User(username='bench_%d_%d' % (size, i), password='!') for i in range(size)],
+                                 batch_size=500)
+        members = list(User.objects.filter(username__startswith='bench_%d_' % size))
+        tags = dict((user.id, Tag.objects.named(user, 'bench')) for user in members)
+        batch = []
+        for user in members:
+            for i in range(rnd.randint(0, 20)):
+                end_time = week + datetime.timedelta(seconds=rnd.randint(0, int((now - week).total_seconds())))
+                batch.append(Pomodoro(user=user, tag=tags[user.id], end_time=end_time))
+        Pomodoro.objects.bulk_create(batch, batch_size=500)
+        rollups.rebuild(members)
+        # Joined in bulk, the scores are then computed once for the team.
+        Membership.objects.bulk_create([Membership(team=team, user=user) for user in members], batch_size=500)
+        leaderboards.rebuild([team])
+        member = members[size // 2]
+        # The member with the fewest pomodoros, ranked below nearly the whole team.
+        last = TeamScore.objects.filter(team=team, period=TeamScore.WEEK, start=week_start(local_today()),
+                                        count__gt=0).order_by('count')[0].user
+        in_week = Pomodoro.objects.filter(user__membership__team=team, end_time__gte=week)
+        grouped = lambda: list(in_week.values('user').annotate(count=Count('id')).order_by('-count')[:10])
+        save = lambda: Pomodoro.objects.create(user=member, tag=tags[member.id], end_time=now)
+        reads = (timed(lambda: leaderboards.top(team, TeamScore.WEEK), repeat),
+                 timed(lambda: leaderboards.rank(team, member, TeamScore.WEEK), repeat),
+                 timed(lambda: leaderboards.rank(team, last, TeamScore.WEEK), repeat))
+        out.write('%12d %12.3f %12.3f %12.3f %12.3f %14.3f%s' % ((size,) + reads + (
+            timed(save, repeat), timed(grouped, repeat), '  OVER BUDGET' if max(reads) > LEADERBOARD_BUDGET_MS else '')))
+
+
+# Settings module and path of the first request of every process profiled by the startup scenario.
+STARTUP_PROFILES = (
+    ('MyProject.settings', '/pymodoro/'),
+    ('MyProject.settings', '/pymodoro/api/tags/'),
+    ('MyProject.settings_api', '/pymodoro/api/tags/'),
+)
+
+
+def startup_times(settings_module, path, repeat):
+    """
+    The median milliseconds until the models are loaded and the first response is sent,
+    and the modules imported, of repeat new processes; with the slowest imports of the last.
+    """
+    runs = [startup.run(settings_module, path) for i in range(max(repeat, 1))]
+    return {
+        'models_ms': median([run['models_ms'] for run in runs]),
+        'first_response_ms': median([run['first_response_ms'] for run in runs]),
+        'modules': runs[-1]['modules'],
+    }, runs[-1]['imports']
+
+
+def bench_startup(out, sizes, repeat, **options):
+    """
+    Time to the first response of a new process with the full settings and with the
+    API-only ones, and the imports that took longest; the requests do not query the database.
+    """
+    out.write('%-24s %-22s %10s %18s %8s' % ('settings', 'path', 'models ms', 'first response ms', 'modules'))
+    slowest = []
+    for settings_module, path in STARTUP_PROFILES:
+        times, imports = startup_times(settings_module, path, repeat)
+        out.write('%-24s %-22s %10.1f %18.1f %8d' % (settings_module, path, times['models_ms'],
+                                                     times['first_response_ms'], times['modules']))
+        slowest.append((settings_module, path, imports))
+    for settings_module, path, imports in slowest:
+        out.write('\nSlowest imports, %s %s:' % (settings_module, path))
+        for name, ms in imports[:10]:
+            out.write('%10.2f ms  %s' % (ms, name))
+
+
+def wsgi_get(application, path, **headers):
+    # The status, headers and body of a GET sent straight to a WSGI application.
+    response = {}
+    environ = dict({'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+                    'SERVER_PORT': '80', 'HTTP_HOST': 'testserver', 'REMOTE_ADDR': '127.0.0.1',
+                    'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(), 'wsgi.errors': BytesIO(),
+                    'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': False,
+                    'wsgi.run_once': False}, **headers)
+    body = b''.join(application(environ, lambda status, headers, *args: response.update(
+        status=status, headers=dict(headers))))
+    return response['status'], response['headers'], body
+
+
+def page_load(application, path, cache):
+    """
+    Loads a page and the static files it links like a browser with the given cache, {url:
+    (headers, links)}: files cached as immutable are not asked for, the others are
+    revalidated. Returns the requests sent and the bytes received.
+    """
+    status, headers, body = wsgi_get(application, path, HTTP_ACCEPT_ENCODING='gzip, br')
+    requests, received = 1, len(body)
+    pending = re.findall(r'(?:href|src)="(%s[^"]+)"' % re.escape(settings.STATIC_URL), body.decode('utf-8'))
+    while pending:
+        url = pending.pop()
+        headers, links = cache.get(url, ({}, []))
+        if 'immutable' in headers.get('Cache-Control', ''):
+            continue
+        conditional = {'HTTP_IF_NONE_MATCH': headers['ETag']} if 'ETag' in headers else {}
+        status, headers, body = wsgi_get(application, url, HTTP_ACCEPT_ENCODING='gzip, br', **conditional)
+        requests += 1
+        received += len(body)
+        if status.startswith('200'):
+            if headers.get('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=BytesIO(body)).read()
+            links = [posixpath.normpath(posixpath.join(posixpath.dirname(url), link))
+                     for link in re.findall(r'url\(["\']?([^"\')]+)', body.decode('utf-8'))] if url.endswith('.css') else []
+            cache[url] = (headers, links)
+        pending += links
+    return requests, received
+
+
+def bench_assets(out, sizes, repeat, **options):
+    """
+    Requests and bytes of a first and a repeat visit of the index page with the static files
+    collected as they are, and through the hashed, minified and compressed pipeline.
+    """
+    out.write('%-10s %16s %14s %16s %14s' % ('files', 'first requests', 'first bytes', 'repeat requests',
+                                             'repeat bytes'))
+    for label, storage in (('plain', 'django.contrib.staticfiles.storage.StaticFilesStorage'),
+                           ('pipeline', 'Pymodoro.assets.ManifestStaticFilesStorage')):
+        root = tempfile.mkdtemp()
+        try:
+            with override_settings(STATIC_ROOT=root, STATICFILES_STORAGE=storage, DEBUG=False):
+                staticfiles_storage._wrapped = empty
+                call_command('collectstatic', interactive=False, verbosity=0)
+                staticfiles_storage._wrapped = empty
+                application = assets.StaticFilesApplication(WSGIHandler())
+                cache = {}
+                first = page_load(application, reverse('Pymodoro:index'), cache)
+                again = page_load(application, reverse('Pymodoro:index'), cache)
+            out.write('%-10s %16d %14d %16d %14d' % ((label,) + first + again))
+        finally:
+            staticfiles_storage._wrapped = empty
+            shutil.rmtree(root)
+
+
+def seed_users(users, pomodoros, tags=20, days=365, rnd=None):
+    """
+    Creates users bench_0 to bench_<users - 1> with pomodoros each, spread over the past
+    days among tags, plus five today, and their rollups. Returns the users.
+    """
+    rnd = rnd or random.Random(0)
+    now = timezone.now()
+    seeded = []
+    for i in range(users):
+        user = create_bench_user('bench_%d' % i)
+        tags_of_user = user_tags(user, tags)
+        missing = pomodoros
+        while missing > 0:
+            batch = [Pomodoro(user=user, tag=rnd.choice(tags_of_user),
+                              end_time=now - datetime.timedelta(minutes=rnd.randint(30, days * 24 * 60)))
+                     for n in range(min(missing, SEED_BATCH_SIZE))]
+            Pomodoro.objects.bulk_create(batch, batch_size=500)
+            missing -= len(batch)
+        Pomodoro.objects.bulk_create([Pomodoro(user=user, tag=tags_of_user[0], end_time=now) for n in range(5)])
+        seeded.append(user)
+    rollups.rebuild(seeded)
+    return seeded
+
+
+def bench_suite(out, sizes, repeat, users, pomodoros, concurrency, requests, output, **options):
+    """
+    Latency percentiles and queries of the main request paths, then throughput under
+    concurrent load through the WSGI application, written to the output JSON file.
+    """
+    rnd = random.Random(0)
+    out.write('Seeding %d users with %d pomodoros each.' % (users, pomodoros))
+    seeded = seed_users(users, pomodoros, rnd=rnd)
+    user = seeded[0]
+    client = logged_client(user)
+    pomodoro = Pomodoro.objects.for_user(user).order_by('-end_time')[pomodoros // 2]
+    paths = {
+        'views.index': reverse('Pymodoro:index'),
+        'views.tag': reverse('Pymodoro:tag', args=('tag0',)),
+        'views.detail': reverse('Pymodoro:detail', args=(pomodoro.id,)),
+    }
+    results = {'manager.are_from_today': measure(lambda: list(Pomodoro.objects.are_from_today(user)), repeat)}
+    for name, path in sorted(paths.items()):
+        results[name] = measure(lambda: client.get(path), repeat)
+    server = loadtest.serve(WSGIHandler())
+    try:
+        headers = {'Cookie': '%s=%s' % (settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)}
+        results['load'] = loadtest.drive(server, sorted(paths.values()), headers, concurrency, requests)
+    finally:
+        server.shutdown()
+    results['process'] = {'peak_rss_kb': peak_rss_kb()}
+    results['startup'] = startup_times('MyProject.settings', reverse('Pymodoro:index'), 5)[0]
+    for name, metrics in sorted(results.items()):
+        out.write('%-24s %s' % (name, ', '.join('%s %s' % item for item in sorted(metrics.items()))))
+    with open(output, 'w') as results_file:
+        json.dump({
+            'meta': {'users': users, 'pomodoros': pomodoros, 'repeat': repeat, 'concurrency': concurrency,
+                     'requests': requests, 'database': connection.vendor, 'python': platform.python_version(),
+                     'django': django.get_version(), 'time': timezone.now().isoformat()},
+            'results': results,
+        }, results_file, indent=2, sort_keys=True)
+    out.write('Results written to %s.' % output)
+
+
+SCENARIOS = {
+    'assets': bench_assets,
+    'autocomplete': bench_autocomplete,
+    'import': bench_import,
+    'index': bench_index,
+    'leaderboard': bench_leaderboard,
+    'search': bench_search,
+    'start': bench_start,
+    'startup': bench_startup,
+    'stats': bench_stats,
+    'suite': bench_suite,
+    'tag': bench_tag,
+    'stream': bench_stream,
+}
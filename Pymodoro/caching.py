@@ -0,0 +1,89 @@
+"""
+Per-user cache of today's pomodoros and of their rendered list.
+
+Entries are keyed by user, local day and data version and expire at the local
+midnight, so a new day starts with fresh entries. The data version, which the
+API ETags are made of too, is the number of the user's last change in the
+database: every process agrees on it, and a write moves it only once
+committed, so an entry computed before the commit is left under the old
+version instead of being served after it. The cache is the POMODORO_CACHE
+alias of CACHES.
+"""
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils import timezone
+
+from Pymodoro.instrumentation import cache_access
+from Pymodoro.models import ChangeSequence, Pomodoro, day_bounds, local_today
+
+HITS_KEY = 'pymodoro:cache:hits'
+MISSES_KEY = 'pymodoro:cache:misses'
+
+_cache = None
+
+
+def pomodoro_cache():
+    global _cache
+    if _cache is None:
+        _cache = get_cache(getattr(settings, 'POMODORO_CACHE', 'default'))
+    return _cache
+
+
+def today_key(user_id, day, version, part):
+    return 'pymodoro:today:%d:%s:%d:%s' % (user_id, day.isoformat(), version, part)
+
+
+def data_version(user_id):
+    """
+    Returns a number that grows whenever a pomodoro of the user is saved or deleted.
+    """
+    # The change log numbers every save and delete, see Pymodoro.models.record_changes.
+    return ChangeSequence.objects.filter(user_id=user_id).values_list('last_seq', flat=True).first() or 0
+
+
+def count(key):
+    cache = pomodoro_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def cached_today(user, part, compute, version=None):
+    """
+    Returns the cached part of the user's today, computing it on a miss. The version must be
+    read before anything compute() uses, so the value is at least as new as its version.
+    """
+    cache = pomodoro_cache()
+    if version is None:
+        version = data_version(user.id)
+    key = today_key(user.id, local_today(), version, part)
+    value = cache.get(key)
+    cache_access(value is not None)
+    if value is not None:
+        count(HITS_KEY)
+        return value
+    count(MISSES_KEY)
+    value = compute()
+    timeout = int((day_bounds()[1] - timezone.now()).total_seconds()) + 1
+    cache.set(key, value, timeout)
+    return value
+
+
+def today_list(user, version=None):
+    return cached_today(user, 'list', lambda: list(Pomodoro.objects.are_from_today(user)), version)
+
+
+def today_fragment(user, render, version=None):
+    return cached_today(user, 'fragment', render, version)
+
+
+def stats():
+    hits, misses = [pomodoro_cache().get(key) or 0 for key in (HITS_KEY, MISSES_KEY)]
+    return {'hits': hits, 'misses': misses, 'ratio': float(hits) / (hits + misses) if hits + misses else 0.0}
+
+
+def reset_stats():
+    pomodoro_cache().delete_many([HITS_KEY, MISSES_KEY])
+
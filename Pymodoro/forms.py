@@ -1,5 +1,13 @@
 from django import forms
 
+from Pymodoro.models import MIN_MINUTES, max_minutes
+
 
 class StartForm(forms.Form):
-    tag = forms.CharField(max_length=200, error_messages={'required': '*',})
\ No newline at end of file
+    tag = forms.CharField(max_length=200, error_messages={'required': '*',},
+                          widget=forms.TextInput(attrs={'list': 'tag-suggestions', 'autocomplete': 'off'}))
+    # Blank for the POMODORO_MINUTES and POMODORO_BREAK_MINUTES defaults.
+    minutes = forms.IntegerField(min_value=MIN_MINUTES, max_value=max_minutes(), required=False,
+                                 widget=forms.NumberInput(attrs={'placeholder': 'minutes'}))
+    break_minutes = forms.IntegerField(min_value=MIN_MINUTES, max_value=max_minutes(), required=False,
+                                       widget=forms.NumberInput(attrs={'placeholder': 'break'}))
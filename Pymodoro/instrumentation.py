@@ -0,0 +1,248 @@
+"""
+Request timings cheap enough to keep on in production.
+
+PerformanceMiddleware follows a sample of the requests, the
+POMODORO_METRICS_SAMPLE_RATE fraction of them (1% by default), with a probe
+that adds up their database queries and time, template rendering time and
+cache hits. It adds them to in-process histograms per view, which
+render_metrics() writes in the Prometheus text format, and as a Server-Timing
+header to the responses to staff or to requests with the POMODORO_METRICS_TOKEN
+bearer token, or to everybody with POMODORO_SERVER_TIMING. The client address
+is not trusted, behind a reverse proxy every request comes from it. Requests
+that are not sampled only pay for a thread-local lookup per query and template.
+
+The histograms are kept in each process and start empty with it: a scrape
+through the load balancer reads whichever worker answers, so have Prometheus
+scrape every worker on its own address and add them up.
+"""
+
+from django.conf import settings
+from django.db.backends import BaseDatabaseWrapper
+from django.template.base import Template
+from django.utils.crypto import constant_time_compare
+
+from contextlib import contextmanager
+import bisect, random, threading, time
+
+DEFAULT_SAMPLE_RATE = 0.01
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+HISTOGRAMS = (
+    ('pymodoro_request_duration_seconds', 'Wall time of the sampled requests.', TIME_BUCKETS),
+    ('pymodoro_db_duration_seconds', 'Time in database queries of the sampled requests.', TIME_BUCKETS),
+    ('pymodoro_db_queries', 'Database queries of the sampled requests.', QUERY_BUCKETS),
+    ('pymodoro_template_duration_seconds', 'Template rendering time of the sampled requests.', TIME_BUCKETS),
+)
+CACHE_COUNTER = 'pymodoro_cache_requests_total'
+
+_local = threading.local()
+_lock = threading.Lock()
+# {(metric, view): [observations per bucket..., observations above them, sum]}
+_histograms = {}
+# {(view, 'hit' or 'miss'): count}
+_cache_requests = {}
+_installed = False
+
+
+class Probe(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.spans = []
+
+    def server_timing(self, total):
+        metrics = ['total;dur=%.1f' % (total * 1000),
+                   'db;dur=%.1f;desc="%d queries"' % (self.db_time * 1000, self.queries),
+                   'tpl;dur=%.1f' % (self.template_time * 1000),
+                   'cache;desc="%d hits, %d misses"' % (self.cache_hits, self.cache_misses)]
+        return ', '.join(metrics + ['%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in self.spans])
+
+
+def current_probe():
+    return getattr(_local, 'probe', None)
+
+
+class TimedCursor(object):
+    # Adds the queries of a cursor to a probe.
+
+    def __init__(self, cursor, probe):
+        self.cursor = cursor
+        self.probe = probe
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.probe.db_time += time.time() - start
+            self.probe.queries += 1
+
+    def execute(self, *args):
+        return self.timed(self.cursor.execute, *args)
+
+    def executemany(self, *args):
+        return self.timed(self.cursor.executemany, *args)
+
+
+def install():
+    """
+    Makes database cursors and template rendering report to the probe of the current request.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    cursor, render = BaseDatabaseWrapper.cursor, Template.render
+
+    def probed_cursor(self):
+        probe = current_probe()
+        return TimedCursor(cursor(self), probe) if probe else cursor(self)
+
+    def probed_render(self, context):
+        probe = current_probe()
+        # Included templates render inside their parent, only the outermost is timed.
+        if probe is None or probe.template_depth:
+            return render(self, context)
+        probe.template_depth += 1
+        start = time.time()
+        try:
+            return render(self, context)
+        finally:
+            probe.template_time += time.time() - start
+            probe.template_depth -= 1
+
+    BaseDatabaseWrapper.cursor = probed_cursor
+    Template.render = probed_render
+
+
+@contextmanager
+def span(name):
+    """
+    Times a section of a sampled request, reported as its own Server-Timing metric.
+    """
+    probe = current_probe()
+    start = time.time()
+    try:
+        yield
+    finally:
+        if probe is not None:
+            probe.spans.append((name, time.time() - start))
+
+
+def cache_access(hit):
+    probe = current_probe()
+    if probe is not None:
+        if hit:
+            probe.cache_hits += 1
+        else:
+            probe.cache_misses += 1
+
+
+def observe(metric, view, value, buckets):
+    with _lock:
+        histogram = _histograms.get((metric, view))
+        if histogram is None:
+            histogram = _histograms[metric, view] = [0] * (len(buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+
+def record(probe, total):
+    view = probe.view or 'unresolved'
+    for (metric, help, buckets), value in zip(HISTOGRAMS, (total, probe.db_time, probe.queries, probe.template_time)):
+        observe(metric, view, value, buckets)
+    with _lock:
+        for result, count in (('hit', probe.cache_hits), ('miss', probe.cache_misses)):
+            if count:
+                _cache_requests[view, result] = _cache_requests.get((view, result), 0) + count
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _cache_requests.clear()
+
+
+def render_metrics():
+    """
+    Returns the metrics of this process in the Prometheus text exposition format; the other
+    workers have their own.
+    """
+    with _lock:
+        histograms, cache_requests = dict((key, list(value)) for key, value in _histograms.items()), dict(_cache_requests)
+    lines = []
+    for metric, help, buckets in HISTOGRAMS:
+        lines += ['# HELP %s %s' % (metric, help), '# TYPE %s histogram' % metric]
+        for (name, view), histogram in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), histogram):
+                cumulative += count
+                lines.append('%s_bucket{view="%s",le="%s"} %d' % (metric, view, bound, cumulative))
+            lines.append('%s_sum{view="%s"} %s' % (metric, view, repr(float(histogram[-1]))))
+            lines.append('%s_count{view="%s"} %d' % (metric, view, cumulative))
+    lines += ['# HELP %s Cache lookups of the sampled requests.' % CACHE_COUNTER, '# TYPE %s counter' % CACHE_COUNTER]
+    for (view, result), count in sorted(cache_requests.items()):
+        lines.append('%s{view="%s",result="%s"} %d' % (CACHE_COUNTER, view, result, count))
+    return '\n'.join(lines) + '\n'
+
+
+def internal(request):
+    """
+    Whether the request has the 'Authorization: Bearer <POMODORO_METRICS_TOKEN>' header or
+    comes from a staff user, who may see the timings.
+    """
+    token = getattr(settings, 'POMODORO_METRICS_TOKEN', '')
+    parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if token and len(parts) == 2 and parts[0] == 'Bearer' and constant_time_compare(parts[1], token):
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def view_name(view_func):
+    return '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', view_func.__class__.__name__))
+
+
+class PerformanceMiddleware(object):
+    """
+    Follows a sample of the requests, see the module documentation. Goes first in
+    MIDDLEWARE_CLASSES, so the time of the other middleware is counted too.
+    """
+
+    def __init__(self):
+        install()
+
+    def process_request(self, request):
+        rate = getattr(settings, 'POMODORO_METRICS_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        _local.probe = Probe() if rate >= 1 or random.random() < rate else None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        probe = current_probe()
+        if probe is not None:
+            probe.view = view_name(view_func)
+
+    def process_response(self, request, response):
+        probe = current_probe()
+        if probe is None:
+            return response
+        _local.probe = None
+        total = time.time() - probe.start
+        record(probe, total)
+        if getattr(settings, 'POMODORO_SERVER_TIMING', False) or internal(request):
+            response['Server-Timing'] = probe.server_timing(total)
+        return response
@@ -0,0 +1,278 @@
+"""
+Background jobs stored in the Job table and run by ``manage.py run_jobs``.
+
+Workers claim due jobs in batches with a conditional update, so several run_jobs
+processes can share the table without a broker, and run them in a pool of
+threads. A job that raises is retried later, waiting twice as long each time,
+until it has been tried POMODORO_JOB_ATTEMPTS times; one whose worker died is
+claimed again once POMODORO_JOB_TIMEOUT_SECONDS have passed, so workers keep
+pushing the lock of their running jobs forward, and skip the jobs of a batch
+whose lock ran out while they waited and went to another worker. The periodic
+jobs schedule their next run themselves, and a unique key keeps one of each
+queued.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+from django.db import connection, transaction, DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.six.moves import queue
+
+from contextlib import contextmanager
+import datetime, json, threading, traceback, uuid
+
+from Pymodoro import rollups, sync
+from Pymodoro.models import DailyRollup, Job, PomodoroSession, day_bounds, local_date, local_today
+
+JOB_BATCH_SIZE = 100
+RETRY_DELAY = datetime.timedelta(seconds=30)
+
+
+def every(minutes):
+    return lambda now: now + datetime.timedelta(minutes=minutes)
+
+
+def at_midnight(now):
+    # The start of the next local day.
+    return day_bounds(local_date(now))[1]
+
+
+def complete_sessions():
+    # The pomodoros of users who are not looking are stored too.
+    PomodoroSession.objects.complete_due()
+
+
+def break_reminder(user_id, ended):
+    """
+    Tells the user their break is over, unless they started another pomodoro since the one
+    that ended.
+    """
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if user is None or not user.email:
+        return
+    if PomodoroSession.objects.filter(user=user, start_time__gte=parse_datetime(ended)).exists():
+        return
+    send_mail('Your break is over', 'Time for another pomodoro.', settings.DEFAULT_FROM_EMAIL, [user.email])
+
+
+def daily_summaries(day=None, batch_size=JOB_BATCH_SIZE):
+    """
+    Queues a daily_summary job for every user with pomodoros on day, yesterday by default, so
+    a failure mails again only the user it failed for.
+    """
+    day = day or (local_today() - datetime.timedelta(days=1)).isoformat()
+    users = (DailyRollup.objects.filter(day=parse_date(day), count__gt=0).exclude(user__email='')
+             .order_by('user').values_list('user', flat=True))
+    now = timezone.now()
+    Job.objects.bulk_create([Job(name='daily_summary', args=json.dumps({'user_id': user_id, 'day': day}, sort_keys=True),
+                                 run_at=now) for user_id in users.iterator()], batch_size=batch_size)
+
+
+def daily_summary(user_id, day):
+    """
+    Mails the user how many pomodoros they completed on day.
+    """
+    row = DailyRollup.objects.filter(user_id=user_id, day=parse_date(day), count__gt=0).select_related('user').first()
+    if row is None or not row.user.email:
+        return
+    send_mail('Your pomodoros of %s' % day,
+              'You completed %d pomodoro%s, %d minutes of focus.' % (row.count, 's' if row.count != 1 else '', row.minutes),
+              settings.DEFAULT_FROM_EMAIL, [row.user.email])
+
+
+def compact_changes():
+    sync.compact()
+
+
+def repair_rollups():
+    # Rebuilds only the rollups of users whose counts drifted.
+    users = set(key['user_id'] for model, key, expected, stored in rollups.check())
+    if users:
+        rollups.rebuild(User.objects.filter(pk__in=users))
+
+
+def purge_jobs():
+    cutoff = timezone.now() - datetime.timedelta(days=getattr(settings, 'POMODORO_JOB_RETENTION_DAYS', 7))
+    Job.objects.filter(status__in=(Job.DONE, Job.FAILED), run_at__lt=cutoff).delete()
+
+
+HANDLERS = {
+    'break_reminder': break_reminder,
+    'compact_changes': compact_changes,
+    'complete_sessions': complete_sessions,
+    'daily_summaries': daily_summaries,
+    'daily_summary': daily_summary,
+    'purge_jobs': purge_jobs,
+    'repair_rollups': repair_rollups,
+}
+
+# When each periodic job runs next, from the time it ran.
+PERIODIC = {
+    'compact_changes': at_midnight,
+    'complete_sessions': every(1),
+    'daily_summaries': at_midnight,
+    'purge_jobs': at_midnight,
+    'repair_rollups': at_midnight,
+}
+
+
+def schedule_periodic(now=None):
+    """
+    Queues the periodic jobs that are not queued yet, to run now. Returns their names.
+    """
+    now = now or timezone.now()
+    return [name for name in sorted(PERIODIC) if Job.objects.schedule_once(name, now)]
+
+
+def requeue_stalled(now=None):
+    """
+    Gives back the jobs whose worker stopped answering, or fails them if that was their last
+    attempt; periodic ones are then queued again for their next run.
+    """
+    now = now or timezone.now()
+    stalled = Job.objects.filter(status=Job.RUNNING, locked_until__lt=now)
+    attempts = getattr(settings, 'POMODORO_JOB_ATTEMPTS', 3)
+    failed = list(stalled.filter(attempts__gte=attempts).values_list('id', 'name', 'args'))
+    if failed:
+        stalled.filter(pk__in=[pk for pk, name, args in failed]).update(
+            status=Job.FAILED, worker='', last_error='Stalled.', unique_name=None)
+        for pk, name, args in failed:
+            if name in PERIODIC:
+                Job.objects.schedule_once(name, PERIODIC[name](now), **json.loads(args))
+    return stalled.update(status=Job.PENDING, worker='')
+
+
+def lock_timeout():
+    return datetime.timedelta(seconds=getattr(settings, 'POMODORO_JOB_TIMEOUT_SECONDS', 600))
+
+
+def extend_lock(job, now=None):
+    """
+    Pushes the lock of a job the worker is running a timeout past now. Returns whether it still had the job.
+    """
+    now = now or timezone.now()
+    return bool(Job.objects.filter(pk=job.pk, worker=job.worker, status=Job.RUNNING)
+                .update(locked_until=now + lock_timeout()))
+
+
+@contextmanager
+def keeping_locked(job):
+    """
+    Extends the lock of job every third of the timeout until the block ends, so a long job
+    is not given to another worker and run twice. The lock is extended from a thread with
+    a connection of its own, outside the transaction of the job.
+    """
+    done = threading.Event()
+
+    def beat():
+        try:
+            while not done.wait(lock_timeout().total_seconds() / 3):
+                try:
+                    extend_lock(job)
+                except DatabaseError:
+                    # E.g. a locked SQLite database, the next beat tries again.
+                    pass
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def claim(limit=JOB_BATCH_SIZE, now=None):
+    """
+    Takes up to limit due jobs, oldest first, for a new worker and returns them.
+    """
+    now = now or timezone.now()
+    ids = list(Job.objects.due(now).order_by('run_at').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    worker = uuid.uuid4().hex
+    # Conditional update, so jobs another worker claimed meanwhile are left to it.
+    Job.objects.filter(pk__in=ids, status=Job.PENDING).update(status=Job.RUNNING, worker=worker,
+                                                              locked_until=now + lock_timeout(), attempts=F('attempts') + 1)
+    return list(Job.objects.filter(pk__in=ids, worker=worker).order_by('run_at'))
+
+
+def run_job(job):
+    """
+    Runs a claimed job in a transaction and records how it went. Returns its new status, or
+    None if the worker lost the job while it waited in its batch.
+    """
+    now = timezone.now()
+    # The lock of the jobs waiting in a batch may run out, then the job went to another worker.
+    if not extend_lock(job, now):
+        return None
+    handler = HANDLERS.get(job.name)
+    try:
+        if handler is None:
+            raise KeyError('No job is called %r.' % job.name)
+        with keeping_locked(job), transaction.atomic():
+            handler(**json.loads(job.args))
+    except Exception:
+        error = traceback.format_exc()
+        if handler is not None and job.attempts < getattr(settings, 'POMODORO_JOB_ATTEMPTS', 3):
+            changes = {'status': Job.PENDING, 'run_at': now + RETRY_DELAY * 2 ** (job.attempts - 1)}
+        else:
+            changes = {'status': Job.FAILED}
+        changes['last_error'] = error
+    else:
+        changes = {'status': Job.DONE, 'last_error': ''}
+    if changes['status'] != Job.PENDING:
+        changes['unique_name'] = None
+    # A job given back as stalled may have another worker already.
+    Job.objects.filter(pk=job.pk, worker=job.worker).update(worker='', locked_until=None, **changes)
+    if job.name in PERIODIC and changes['status'] != Job.PENDING:
+        Job.objects.schedule_once(job.name, PERIODIC[job.name](now), **json.loads(job.args))
+    return changes['status']
+
+
+def run_batch(jobs, workers=1):
+    if workers <= 1:
+        return [run_job(job) for job in jobs]
+    pending, statuses = queue.Queue(), []
+    for job in jobs:
+        pending.put(job)
+
+    def work():
+        try:
+            while True:
+                try:
+                    job = pending.get_nowait()
+                except queue.Empty:
+                    return
+                statuses.append(run_job(job))
+        finally:
+            # Every thread has a connection of its own.
+            connection.close()
+
+    threads = [threading.Thread(target=work) for i in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def run_due(batch_size=JOB_BATCH_SIZE, workers=1):
+    """
+    Runs the due jobs batch after batch until none is left, workers at a time, and
+    returns how many ran.
+    """
+    requeue_stalled()
+    ran = 0
+    while True:
+        jobs = claim(batch_size)
+        if not jobs:
+            return ran
+        run_batch(jobs, workers)
+        ran += len(jobs)
@@ -0,0 +1,123 @@
+"""
+Team leaderboards of the most pomodoros in a day and in a week.
+
+A TeamScore row holds the pomodoros of a member of a team in a day or a week.
+The Pomodoro save and delete signals bump the rows of every team of its user
+along with the rollups, and joining a team adds the member's rows from their
+daily rollups. Leaderboards then walk the (team, period, start, count) index
+from the top instead of counting the pomodoros of every member.
+
+Both reads are a single SQL statement written out: building them with the ORM
+takes longer than the indexed lookups themselves.
+"""
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+from collections import defaultdict
+
+from Pymodoro.models import DailyRollup, Membership, TeamScore, local_today, week_start
+
+PERIODS = (TeamScore.DAY, TeamScore.WEEK)
+
+
+def period_start(period, day=None):
+    day = day or local_today()
+    return week_start(day) if period == TeamScore.WEEK else day
+
+
+def fetch(sql, team, period, day, *params):
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute(sql % {'score': qn(TeamScore._meta.db_table), 'user': qn(User._meta.db_table)},
+                   [team.pk, period, connection.ops.value_to_db_date(period_start(period, day))] + list(params))
+    return cursor.fetchall()
+
+
+def top(team, period, limit=10, day=None):
+    """
+    Returns the limit best members of the team in the day or week of day, today by default,
+    as dicts with their username, count and rank; members with as many pomodoros share it.
+    """
+    rows = fetch('SELECT u.username, s.count FROM %(score)s s INNER JOIN %(user)s u ON u.id = s.user_id '
+                 'WHERE s.team_id = %%s AND s.period = %%s AND s.start = %%s AND s.count > 0 '
+                 'ORDER BY s.count DESC, s.user_id LIMIT %%s', team, period, day, limit)
+    best = []
+    for position, (username, count) in enumerate(rows):
+        shared = best and best[-1]['count'] == count
+        best.append({'username': username, 'count': count, 'rank': best[-1]['rank'] if shared else position + 1})
+    return best
+
+
+def rank(team, user, period, day=None):
+    """
+    Returns the (rank, count) of the user in the team, or (None, 0) without pomodoros.
+    """
+    rows = fetch('SELECT s.count, (SELECT COUNT(*) FROM %(score)s o WHERE o.team_id = s.team_id '
+                 'AND o.period = s.period AND o.start = s.start AND o.count > s.count) FROM %(score)s s '
+                 'WHERE s.team_id = %%s AND s.period = %%s AND s.start = %%s AND s.user_id = %%s',
+                 team, period, day, user.pk)
+    if not rows or rows[0][0] <= 0:
+        return None, 0
+    return rows[0][1] + 1, rows[0][0]
+
+
+def leaderboard(team, user, period, limit=10, day=None):
+    position, count = rank(team, user, period, day)
+    return {
+        'team': team.name,
+        'period': period,
+        'start': period_start(period, day).isoformat(),
+        'top': top(team, period, limit, day),
+        'me': {'rank': position, 'count': count},
+    }
+
+
+def member_scores(team_id, user_id):
+    """
+    Computes the TeamScore rows of a member from their daily rollups.
+    """
+    weeks = defaultdict(lambda: [0, 0])
+    rows = []
+    for day, count, minutes in (DailyRollup.objects.filter(user_id=user_id, count__gt=0)
+                                .values_list('day', 'count', 'minutes').iterator()):
+        rows.append(TeamScore(team_id=team_id, user_id=user_id, period=TeamScore.DAY, start=day,
+                              count=count, minutes=minutes))
+        weeks[week_start(day)][0] += count
+        weeks[week_start(day)][1] += minutes
+    rows += [TeamScore(team_id=team_id, user_id=user_id, period=TeamScore.WEEK, start=start,
+                       count=count, minutes=minutes) for start, (count, minutes) in weeks.items()]
+    return rows
+
+
+def rebuild(teams=None):
+    """
+    Replaces the scores of the given teams, or of every team, with ones computed from the
+    daily rollups of their members. Returns the number of score rows.
+    """
+    memberships = Membership.objects.all()
+    rows = TeamScore.objects.all()
+    if teams is not None:
+        memberships, rows = memberships.filter(team__in=teams), rows.filter(team__in=teams)
+    with transaction.atomic():
+        rows.delete()
+        stored = 0
+        for team_id, user_id in memberships.values_list('team_id', 'user_id').iterator():
+            member_rows = member_scores(team_id, user_id)
+            TeamScore.objects.bulk_create(member_rows, batch_size=500)
+            stored += len(member_rows)
+    return stored
+
+
+def add_member_scores(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        TeamScore.objects.bulk_create(member_scores(instance.team_id, instance.user_id), batch_size=500)
+
+
+def drop_member_scores(sender, instance, **kwargs):
+    TeamScore.objects.filter(team_id=instance.team_id, user_id=instance.user_id).delete()
+
+
+post_save.connect(add_member_scores, sender=Membership)
+post_delete.connect(drop_member_scores, sender=Membership)
@@ -0,0 +1,104 @@
+"""
+Concurrent HTTP load against the WSGI application, and comparison of benchmark results.
+
+serve() runs the application on a local threaded WSGI server and drive() sends
+it requests from several threads at once, like browsers would. Results are
+the JSON files written by the benchmark suite; compare() tells which metrics
+of a run got worse than in another one.
+"""
+
+from django.utils.six.moves import http_client, socketserver
+
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+import json, threading, time
+
+# Metrics that are better when lower, the others are better when higher.
+LOWER_IS_BETTER = ('p50_ms', 'p99_ms', 'queries', 'errors', 'peak_rss_kb', 'models_ms', 'first_response_ms', 'modules')
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0
+
+
+def serve(application):
+    """
+    Serves the application on a free local port from a background thread; shutdown() stops it.
+    """
+    server = make_server('127.0.0.1', 0, application, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def drive(server, paths, headers=None, concurrency=10, requests=1000):
+    """
+    Sends requests GETs for the paths in turn from concurrency threads, and returns the
+    throughput, latency percentiles and number of failed requests.
+    """
+    host, port = server.server_address[:2]
+    timings, errors = [], []
+
+    def worker(count, offset):
+        for i in range(count):
+            start = time.time()
+            try:
+                connection = http_client.HTTPConnection(host, port, timeout=30)
+                connection.request('GET', paths[(offset + i) % len(paths)], headers=headers or {})
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (IOError, http_client.HTTPException) as e:
+                errors.append(e)
+            timings.append((time.time() - start) * 1000)
+
+    threads = [threading.Thread(target=worker, args=(requests // concurrency + (i < requests % concurrency), i))
+               for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    return {
+        'requests_per_s': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 0.5), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'errors': len(errors),
+    }
+
+
+def compare(old, new, threshold=10.0):
+    """
+    Returns the (benchmark, metric, old, new, change %) of every metric present in both
+    results that got worse by more than threshold percent. Query counts have no slack.
+    """
+    regressions = []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before, after = old['results'][name], new['results'][name]
+        for metric in sorted(set(before) & set(after)):
+            if before[metric] == after[metric]:
+                continue
+            change = 100.0 * (after[metric] - before[metric]) / before[metric] if before[metric] else float('inf')
+            worse = change if metric in LOWER_IS_BETTER else -change
+            if worse > (0 if metric in ('queries', 'errors') else threshold):
+                regressions.append((name, metric, before[metric], after[metric], round(change, 1)))
+    return regressions
+
+
+def load_results(path):
+    with open(path) as results:
+        return json.load(results)
@@ -0,0 +1,99 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.backends.util import truncate_name
+
+from optparse import make_option
+import datetime
+
+from Pymodoro.models import Break, Pomodoro, PomodoroSession
+
+# Columns of tables from before durations were stored.
+COLUMNS = ((Pomodoro, 'start_time'), (Pomodoro, 'duration'), (PomodoroSession, 'duration'),
+           (PomodoroSession, 'break_duration'), (PomodoroSession, 'end_time'))
+# Tables from before their index_together indexes, which syncdb does not add to them.
+INDEXED = (Pomodoro, PomodoroSession)
+# Columns computed from the others, as (model, column, column they follow, sign of the duration).
+COMPUTED = ((Pomodoro, 'start_time', 'end_time', -1), (PomodoroSession, 'end_time', 'start_time', 1))
+
+
+class Command(BaseCommand):
+    help = ('Adds the start time and duration columns to the pomodoros and sessions of a database from '
+            'before they were stored, fills them in and creates their missing indexes. Run syncdb first '
+            'so the Break table exists.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+                    help='Pomodoros filled in per transaction.'),
+    )
+
+    def handle(self, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError('Only SQLite and PostgreSQL databases can be migrated.')
+        cursor = connection.cursor()
+        if Break._meta.db_table not in connection.introspection.table_names(cursor):
+            raise CommandError('The %s table does not exist, run syncdb first.' % Break._meta.db_table)
+        qn = connection.ops.quote_name
+        for model, name in COLUMNS:
+            if name in self.columns(cursor, model):
+                continue
+            field = model._meta.get_field(name)
+            # Existing rows lasted the defaults, POMODORO_MINUTES and POMODORO_BREAK_MINUTES; the
+            # computed columns are filled in below.
+            computed = (model, name) in [(m, column) for m, column, source, sign in COMPUTED]
+            constraint = 'NULL' if computed else 'NOT NULL DEFAULT %d' % field.get_default()
+            cursor.execute('ALTER TABLE %s ADD COLUMN %s %s %s'
+                           % (qn(model._meta.db_table), qn(field.column), field.db_type(connection), constraint))
+        filled = [self.fill(cursor, model, column, source, sign, options['batch_size'])
+                  for model, column, source, sign in COMPUTED]
+        indexes = sum(self.create_indexes(cursor, model) for model in INDEXED)
+        self.stdout.write('Filled in the start time of %d pomodoros and the end time of %d sessions.' % tuple(filled))
+        self.stdout.write('Created %d indexes.' % indexes)
+
+    def fill(self, cursor, model, column, source, sign, batch_size):
+        # Sets the empty column to the source column plus sign times the duration, in batches.
+        qn = connection.ops.quote_name
+        update = 'UPDATE %s SET %s = %%s WHERE id = %%s' % (qn(model._meta.db_table), qn(column))
+        filled = 0
+        while True:
+            with transaction.atomic():
+                rows = list(model.objects.filter(**{column + '__isnull': True}).order_by('id')
+                            .values_list('id', source, 'duration')[:batch_size])
+                cursor.executemany(update, [
+                    (connection.ops.value_to_db_datetime(value + sign * datetime.timedelta(minutes=duration)), pk)
+                    for pk, value, duration in rows])
+            filled += len(rows)
+            if len(rows) < batch_size:
+                break
+        if connection.vendor == 'postgresql':
+            cursor.execute('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL' % (qn(model._meta.db_table), qn(column)))
+        return filled
+
+    def create_indexes(self, cursor, model):
+        # Creates the index_together indexes missing from the table, but those on columns still to be
+        # added, like the tag of the pomodoros which migrate_tags indexes. Returns how many were created.
+        columns = self.columns(cursor, model)
+        existing = self.indexes(cursor, model)
+        created = 0
+        for names in model._meta.index_together:
+            fields = [model._meta.get_field(name) for name in names]
+            if self.index_name(model, names) in existing or any(field.column not in columns for field in fields):
+                continue
+            for statement in connection.creation.sql_indexes_for_fields(model, fields, no_style()):
+                cursor.execute(statement)
+            created += 1
+        return created
+
+    def indexes(self, cursor, model):
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [model._meta.db_table])
+        else:
+            cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [model._meta.db_table])
+        return set(name for (name,) in cursor.fetchall())
+
+    def index_name(self, model, field_names):
+        # The name syncdb gives to an index_together index.
+        name = '%s_%s' % (model._meta.db_table, connection.creation._digest(field_names))
+        return truncate_name(name, connection.ops.max_name_length())
+
+    def columns(self, cursor, model):
+        return [column[0] for column in connection.introspection.get_table_description(cursor, model._meta.db_table)]
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from optparse import make_option
+import os, tempfile
+
+from Pymodoro.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    args = '<scenario>'
+    help = 'Runs a benchmark scenario (%s) against a throwaway test database.' % ', '.join(sorted(SCENARIOS))
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', default='10000,100000,1000000',
+                    help='Comma separated table sizes, or running pomodoros, to measure at.'),
+        make_option('--repeat', type='int', default=20,
+                    help='Requests per measurement.'),
+        make_option('--budget', type='float', default=250,
+                    help='Latency budget in milliseconds, flagged by the scenarios that have one.'),
+        make_option('--users', type='int', default=10,
+                    help='Users the suite seeds.'),
+        make_option('--pomodoros', type='int', default=10000,
+                    help='Pomodoros the suite seeds per user.'),
+        make_option('--concurrency', type='int', default=10,
+                    help='Simultaneous clients of the suite load test.'),
+        make_option('--requests', type='int', default=1000,
+                    help='Requests of the suite load test.'),
+        make_option('--output', default='benchmark.json',
+                    help='JSON file the suite writes its results to.'),
+    )
+
+    def handle(self, scenario='index', **options):
+        if scenario not in SCENARIOS:
+            raise CommandError('Unknown scenario %r.' % scenario)
+        options['sizes'] = [int(size) for size in options['sizes'].split(',')]
+        setup_test_environment()
+        # Scenarios log in thousands of users, the default hasher would dominate the timings.
+        fast_hashers = override_settings(PASSWORD_HASHERS=('django.contrib.auth.hashers.MD5PasswordHasher',))
+        fast_hashers.enable()
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and scenario == 'suite':
+            # The load test threads have their own connections, they would not share an in-memory database.
+            connection.settings_dict['TEST_NAME'] = os.path.join(tempfile.gettempdir(), 'pymodoro_benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            SCENARIOS[scenario](self.stdout, **options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            fast_hashers.disable()
+            teardown_test_environment()
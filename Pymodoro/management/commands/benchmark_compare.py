@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from optparse import make_option
+
+from Pymodoro import loadtest
+
+
+class Command(BaseCommand):
+    args = '<old results> <new results>'
+    help = 'Compares two benchmark suite result files and fails on the metrics that got worse.'
+    option_list = BaseCommand.option_list + (
+        make_option('--threshold', type='float', default=10.0,
+                    help='Percentage a timing, throughput or memory metric may get worse by.'),
+    )
+
+    def handle(self, old=None, new=None, **options):
+        if new is None:
+            raise CommandError('Usage: benchmark_compare %s' % self.args)
+        try:
+            regressions = loadtest.compare(loadtest.load_results(old), loadtest.load_results(new), options['threshold'])
+        except (IOError, ValueError, KeyError) as e:
+            raise CommandError('Cannot read the results: %s' % e)
+        for name, metric, before, after, change in regressions:
+            self.stdout.write('%-24s %-16s %12s -> %-12s %+.1f%%' % (name, metric, before, after, change))
+        if regressions:
+            raise CommandError('%d metrics regressed.' % len(regressions))
+        self.stdout.write('No regressions.')
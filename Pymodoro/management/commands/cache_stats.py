@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from optparse import make_option
+
+from Pymodoro import caching
+
+
+class Command(BaseCommand):
+    help = "Shows the hits and misses of the per-user today cache."
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', default=False,
+                    help='Resets the counters after showing them.'),
+    )
+
+    def handle(self, **options):
+        stats = caching.stats()
+        self.stdout.write('hits: %(hits)d, misses: %(misses)d, hit ratio: %(ratio).2f' % stats)
+        if options['reset']:
+            caching.reset_stats()
@@ -0,0 +1,18 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from Pymodoro import rollups
+
+
+class Command(BaseCommand):
+    args = '[username ...]'
+    help = 'Checks the rollups of the given users, or of everybody, against their pomodoros.'
+
+    def handle(self, *usernames, **options):
+        users = User.objects.filter(username__in=usernames) if usernames else None
+        mismatches = rollups.check(users)
+        for model, key, expected, stored in mismatches:
+            self.stdout.write('%s %r: expected %r, stored %r' % (model, key, expected, stored))
+        if mismatches:
+            raise CommandError('%d rollups differ from the pomodoros, run rebuild_rollups.' % len(mismatches))
+        self.stdout.write('Rollups are consistent.')
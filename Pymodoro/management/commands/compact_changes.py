@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from optparse import make_option
+
+from Pymodoro import sync
+
+
+class Command(BaseCommand):
+    help = 'Drops superseded changes and old deletes from the sync change log, run it periodically.'
+    option_list = BaseCommand.option_list + (
+        make_option('--retention-days', type='int',
+                    help='Days deletes are kept, POMODORO_CHANGE_RETENTION_DAYS (30) by default.'),
+    )
+
+    def handle(self, **options):
+        self.stdout.write('Dropped %d changes.' % sync.compact(options['retention_days']))
@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.encoding import force_bytes
+
+from optparse import make_option
+
+from Pymodoro import transfer
+
+
+class Command(BaseCommand):
+    args = '<username>'
+    help = "Streams the pomodoro history of a user as CSV or NDJSON."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=transfer.FORMATS, default='csv',
+                    help='csv (default) or ndjson.'),
+        make_option('--output', help='File to write to instead of the standard output.'),
+    )
+
+    def handle(self, username=None, **options):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError('Unknown user %r.' % username)
+        lines = transfer.export_lines(user, options['format'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for line in lines:
+                    output.write(force_bytes(line))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
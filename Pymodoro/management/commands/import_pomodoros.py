@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from optparse import make_option
+
+from Pymodoro import transfer
+
+
+class Command(BaseCommand):
+    args = '<username> <file>'
+    help = "Imports a CSV or NDJSON pomodoro history for a user, all or nothing."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=transfer.FORMATS,
+                    help='csv or ndjson, guessed from the file extension by default.'),
+        make_option('--batch-size', type='int', default=transfer.IMPORT_BATCH_SIZE,
+                    help='Rows per bulk insert.'),
+    )
+
+    def handle(self, username=None, path=None, **options):
+        if path is None:
+            raise CommandError('Usage: import_pomodoros %s' % self.args)
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError('Unknown user %r.' % username)
+        format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        try:
+            with open(path, 'rb') as lines:
+                imported = transfer.import_lines(user, lines, format, options['batch_size'])
+        except (IOError, ValueError) as e:
+            raise CommandError(e)
+        self.stdout.write('Imported %d pomodoros for %s.' % (imported, username))
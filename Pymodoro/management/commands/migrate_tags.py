@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.backends.util import truncate_name
+
+from Pymodoro import rollups
+from Pymodoro.models import Pomodoro, Tag, TagRollup
+
+
+class Command(BaseCommand):
+    help = ('Moves the tags of a database created before the Tag model, stored as text in every '
+            'pomodoro, to Tag rows. Run syncdb and backfill_durations first.')
+
+    def handle(self, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError('Only SQLite and PostgreSQL databases can be migrated.')
+        cursor = connection.cursor()
+        if Tag._meta.db_table not in connection.introspection.table_names(cursor):
+            raise CommandError('The %s table does not exist, run syncdb first.' % Tag._meta.db_table)
+        columns = self.columns(cursor, Pomodoro)
+        if 'tag_id' in columns:
+            self.stdout.write('The tags are already migrated.')
+            return
+        if 'duration' not in columns:
+            # The rollups are recomputed from the lengths of the pomodoros.
+            raise CommandError('The pomodoros have no duration column, run backfill_durations first.')
+        qn = connection.ops.quote_name
+        style = no_style()
+        pomodoro, tag = qn(Pomodoro._meta.db_table), qn(Tag._meta.db_table)
+        with transaction.atomic():
+            cursor.execute('INSERT INTO %s (user_id, name) SELECT DISTINCT user_id, tag FROM %s' % (tag, pomodoro))
+            cursor.execute('ALTER TABLE %s ADD COLUMN tag_id %s NULL REFERENCES %s (id)'
+                           % (pomodoro, Pomodoro._meta.get_field('tag').db_type(connection), tag))
+            cursor.execute('UPDATE %s SET tag_id = (SELECT t.id FROM %s t WHERE t.user_id = %s.user_id AND t.name = %s.tag)'
+                           % (pomodoro, tag, pomodoro, pomodoro))
+            # SQLite cannot drop a column that is still indexed.
+            cursor.execute('DROP INDEX IF EXISTS %s' % qn(self.index_name(Pomodoro, ['user', 'tag', 'end_time'])))
+            cursor.execute('ALTER TABLE %s DROP COLUMN tag' % pomodoro)
+            if connection.vendor == 'postgresql':
+                cursor.execute('ALTER TABLE %s ALTER COLUMN tag_id SET NOT NULL' % pomodoro)
+            for fields in (['tag'], ['tag', 'end_time']):
+                for sql in connection.creation.sql_indexes_for_fields(
+                        Pomodoro, [Pomodoro._meta.get_field(name) for name in fields], style):
+                    cursor.execute(sql)
+            if 'tag_id' not in self.columns(cursor, TagRollup):
+                # The rollups are counters, they are recreated from the pomodoros below.
+                cursor.execute('DROP TABLE %s' % qn(TagRollup._meta.db_table))
+                sql, references = connection.creation.sql_create_model(TagRollup, style, set([User, Tag]))
+                for statement in sql + connection.creation.sql_indexes_for_model(TagRollup, style):
+                    cursor.execute(statement)
+            tags = Tag.objects.count()
+            rollups.rebuild()
+        self.stdout.write('Migrated the pomodoros to %d tags.' % tags)
+
+    def columns(self, cursor, model):
+        return [column[0] for column in connection.introspection.get_table_description(cursor, model._meta.db_table)]
+
+    def index_name(self, model, field_names):
+        # The name syncdb gave to an index_together index.
+        name = '%s_%s' % (model._meta.db_table, connection.creation._digest(field_names))
+        return truncate_name(name, connection.ops.max_name_length())
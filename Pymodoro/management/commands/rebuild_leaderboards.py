@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from Pymodoro import leaderboards
+from Pymodoro.models import Team
+
+
+class Command(BaseCommand):
+    args = '[team ...]'
+    help = 'Rebuilds the leaderboard scores of the given teams, or of every team, from the daily rollups.'
+
+    def handle(self, *names, **options):
+        teams = Team.objects.filter(name__in=names) if names else None
+        self.stdout.write('Rebuilt %d team scores.' % leaderboards.rebuild(teams))
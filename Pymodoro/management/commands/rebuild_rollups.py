@@ -0,0 +1,13 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from Pymodoro import rollups
+
+
+class Command(BaseCommand):
+    args = '[username ...]'
+    help = 'Rebuilds the rollups from the pomodoros of the given users, or of everybody.'
+
+    def handle(self, *usernames, **options):
+        users = User.objects.filter(username__in=usernames) if usernames else None
+        self.stdout.write('Rebuilt %d rollups.' % rollups.rebuild(users))
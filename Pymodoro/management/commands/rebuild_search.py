@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connection, transaction
+
+from Pymodoro import search
+from Pymodoro.models import Tag
+
+
+class Command(BaseCommand):
+    help = ('Creates the tag search indexes of a database from before them and refills the SQLite one, '
+            'e.g. after tags were added with SQL.')
+
+    def handle(self, **options):
+        with transaction.atomic():
+            cursor = connection.cursor()
+            # The statements of Pymodoro/sql/tag.<backend>.sql, which only create what is missing.
+            for statement in custom_sql_for_model(Tag, no_style(), connection):
+                cursor.execute(statement)
+            indexed = search.rebuild()
+        self.stdout.write('Indexed %d tags.' % indexed)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from optparse import make_option
+import time
+
+from Pymodoro import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the due background jobs, and keeps waiting for more unless --once is given.'
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', default=False,
+                    help='Run the jobs due now, backlog included, and stop.'),
+        make_option('--workers', type='int', default=4,
+                    help='Jobs run at the same time.'),
+        make_option('--batch-size', type='int', default=jobs.JOB_BATCH_SIZE,
+                    help='Jobs a worker claims at once.'),
+        make_option('--interval', type='float', default=5,
+                    help='Seconds to wait between looks for due jobs.'),
+    )
+
+    def handle(self, **options):
+        jobs.schedule_periodic()
+        while True:
+            ran = jobs.run_due(options['batch_size'], options['workers'])
+            if ran or int(options['verbosity']) > 1:
+                self.stdout.write('Ran %d jobs.' % ran)
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,13 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from Pymodoro import sync
+
+
+class Command(BaseCommand):
+    args = '[username ...]'
+    help = 'Adds the pomodoros stored before the sync change log, of the given users or of everybody, to it.'
+
+    def handle(self, *usernames, **options):
+        users = User.objects.filter(username__in=usernames) if usernames else None
+        self.stdout.write('Logged %d pomodoros.' % sync.seed(users))
@@ -1,34 +1,721 @@
-from django.db import models
+from django.conf import settings
+from django.db import connections, models, router, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save
 from django.contrib.auth.models import User
+from django.utils import timezone
 
-import datetime
-from operator import attrgetter
+import binascii, datetime, json, os
+
+
+# The shortest pomodoro or break, in minutes.
+MIN_MINUTES = 1
+
+
+def default_minutes():
+    return getattr(settings, 'POMODORO_MINUTES', 25)
+
+
+def default_break_minutes():
+    return getattr(settings, 'POMODORO_BREAK_MINUTES', 5)
+
+
+def max_minutes():
+    return getattr(settings, 'POMODORO_MAX_MINUTES', 240)
+
+
+def pomodoro_length():
+    """
+    Returns how long a pomodoro lasts by default, from the POMODORO_MINUTES setting.
+    """
+    return datetime.timedelta(minutes=default_minutes())
+
+
+def local_today():
+    """
+    Returns the current date in the current time zone.
+    """
+    if settings.USE_TZ:
+        return timezone.localtime(timezone.now()).date()
+    return datetime.date.today()
+
+
+def local_datetime(value):
+    """
+    Returns a datetime in the current time zone.
+    """
+    if settings.USE_TZ:
+        return timezone.localtime(value)
+    return value
+
+
+def local_date(value):
+    return local_datetime(value).date()
+
+
+def week_start(day):
+    # Weeks start on Monday.
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def day_bounds(day=None):
+    """
+    Returns the [start, end) datetimes of a local day, today by default.
+    """
+    if day is None:
+        day = local_today()
+    start = datetime.datetime.combine(day, datetime.time.min)
+    end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min)
+    if settings.USE_TZ:
+        tz = timezone.get_current_timezone()
+        start, end = timezone.make_aware(start, tz), timezone.make_aware(end, tz)
+    return start, end
+
+
+class TagManager(models.Manager):
+
+    def named(self, user, name):
+        """
+        Returns the user's tag with this name, creating it if needed.
+        """
+        return self.get_or_create(user=user, name=name)[0]
+
+    def autocomplete(self, user, prefix, limit=10):
+        """
+        Returns the names of up to limit tags of the user starting with prefix, in order.
+        """
+        # A range on name instead of LIKE, so the unique (user, name) index is used on every backend.
+        tags = self.filter(user=user)
+        if prefix:
+            tags = tags.filter(name__gte=prefix, name__lt=prefix + u'\U0010ffff')
+        return list(tags.order_by('name').values_list('name', flat=True)[:limit])
+
+
+class Tag(models.Model):
+
+    user = models.ForeignKey(User)
+    name = models.CharField(max_length=200)
+
+    objects = TagManager()
+
+    class Meta:
+        unique_together = [['user', 'name']]
+
+    def __unicode__(self):
+        return self.name
+
+
+class PomodoroQuerySet(QuerySet):
+
+    def for_user(self, user):
+        return self.filter(user=user)
+
+    def on_day(self, day=None):
+        # A range on end_time, so the (user, end_time) index can be used.
+        start, end = day_bounds(day)
+        return self.filter(end_time__gte=start, end_time__lt=end)
+
+    def from_today(self):
+        return self.on_day()
+
+    def ending_between(self, start, end):
+        # Pomodoros end at most max_minutes() after they start, so both ends of the
+        # end_time range are bounded and the (user, end_time) index is used.
+        return self.filter(end_time__gt=start, end_time__lt=end + datetime.timedelta(minutes=max_minutes()))
+
+    def overlapping(self, start, end):
+        """
+        The pomodoros that were running at some point of [start, end).
+        """
+        return self.ending_between(start, end).filter(start_time__lt=end)
+
+    def focused_minutes(self, start, end):
+        """
+        Returns the minutes of pomodoros within [start, end), counting the part inside of
+        the pomodoros that cross its ends.
+        """
+        inside = self.filter(end_time__gt=start, end_time__lte=end, start_time__gte=start)
+        minutes = inside.aggregate(models.Sum('duration'))['duration__sum'] or 0
+        # The few that cross the ends are added up here.
+        crossing = self.overlapping(start, end).exclude(end_time__lte=end, start_time__gte=start)
+        for start_time, end_time in crossing.values_list('start_time', 'end_time'):
+            minutes += (min(end_time, end) - max(start_time, start)).total_seconds() / 60
+        return minutes
+
+
+class PomodoroManager(models.Manager):
+
+    def get_queryset(self):
+        return PomodoroQuerySet(self.model, using=self._db)
+
+    def for_user(self, user):
+        return self.get_queryset().for_user(user)
+
+    def on_day(self, day=None):
+        return self.get_queryset().on_day(day)
+
+    def from_today(self):
+        return self.get_queryset().from_today()
+
+    def overlapping(self, start, end):
+        return self.get_queryset().overlapping(start, end)
+
+    def focused_minutes(self, start, end):
+        return self.get_queryset().focused_minutes(start, end)
+
+    def taken(self, user_id, start, end, exclude=None):
+        """
+        Returns whether a stored pomodoro of the user, other than the one with the pk exclude,
+        was running at some point of [start, end). Called in the transaction that stores a
+        pomodoro, it makes the other writes of the user wait until the transaction ends.
+        """
+        PomodoroLock.objects.lock(user_id)
+        pomodoros = self.get_queryset().filter(user_id=user_id).overlapping(start, end)
+        if exclude is not None:
+            pomodoros = pomodoros.exclude(pk=exclude)
+        return pomodoros.exists()
+
+    def bulk_create(self, objs, batch_size=None):
+        for pomodoro in objs:
+            pomodoro.set_start_time()
+        return super(PomodoroManager, self).bulk_create(objs, batch_size)
+
+    def are_from_today(self, user):
+        return Pomodoro.objects.for_user(user).from_today().select_related('tag').order_by('-end_time', '-id')
 
 
 class Pomodoro(models.Model):
 
     user = models.ForeignKey(User)
-    tag = models.CharField(max_length=200)
+    tag = models.ForeignKey(Tag)
+    start_time = models.DateTimeField("start time")
     end_time = models.DateTimeField("end time")
+    duration = models.PositiveSmallIntegerField(default=default_minutes)  # minutes
+
+    objects = PomodoroManager()
+
+    class Meta:
+        index_together = [['user', 'end_time'], ['tag', 'end_time']]
 
     def __unicode__(self):
-        return 'user %s, from %s to %s in %s' % (self.user.username, self.init_time().strftime('%c'), self.end_time.strftime('%c'), self.tag)
+        return 'user %s, from %s to %s in %s' % (self.user.username, self.start_time.strftime('%c'), self.end_time.strftime('%c'), self.tag)
+
+    def set_start_time(self):
+        # Stored for the interval queries, it follows the end time and duration.
+        self.start_time = self.end_time - datetime.timedelta(minutes=self.duration)
+
+    def save(self, *args, **kwargs):
+        self.set_start_time()
+        super(Pomodoro, self).save(*args, **kwargs)
 
     def init_time(self):
-        return self.end_time - datetime.timedelta(minutes=25)
+        return self.start_time
 
     def is_from_today(self):
-        return self.end_time.date() == datetime.date.today()
+        start, end = day_bounds()
+        return start <= self.end_time < end
     is_from_today.admin_order_field = 'end_time'
     is_from_today.boolean = True
     is_from_today.short_description = 'is from today?'
 
+    def minutes(self):
+        return self.duration
 
-class PomodoroManager(models.Manager):
+    def rollup_key(self):
+        # Counted in the default time zone, whichever one is active, see stats.in_rollup_zone().
+        end_time = timezone.localtime(self.end_time, timezone.get_default_timezone()) if settings.USE_TZ else self.end_time
+        return (self.user_id, self.tag_id, end_time.date(), end_time.hour)
 
-    def are_from_today(self, user):
-        result_list = []
-        for p in Pomodoro.objects.all():
-            if p.is_from_today() and p.user == user:
-                result_list.append(p)
-        return sorted(result_list, key=attrgetter('end_time'), reverse=True)
\ No newline at end of file
+
+class PomodoroLockManager(models.Manager):
+
+    def lock(self, user_id):
+        """
+        Locks the user's row until the transaction ends, so the overlaps the transaction checks
+        cannot change before it stores its pomodoros. Taken before the change sequence.
+        """
+        self.get_or_create(user_id=user_id)
+        if connections[router.db_for_write(PomodoroLock)].features.has_select_for_update:
+            list(self.select_for_update().filter(user_id=user_id))
+        else:
+            # SQLite has no row locks, writing the row takes the database's until the transaction ends.
+            self.filter(user_id=user_id).update(user=F('user'))
+
+
+class PomodoroLock(models.Model):
+    # A row per user, locked by the transactions that check and store the user's pomodoros.
+
+    user = models.OneToOneField(User, primary_key=True)
+
+    objects = PomodoroLockManager()
+
+    def __unicode__(self):
+        return 'user %s, pomodoro lock' % self.user.username
+
+
+class PomodoroSessionManager(models.Manager):
+
+    def running(self, user=None):
+        sessions = self.filter(status=PomodoroSession.RUNNING)
+        if user is not None:
+            sessions = sessions.filter(user=user)
+        return sessions
+
+    def complete_due(self, user=None, now=None):
+        """
+        Completes the running sessions whose time is up and returns how many were completed.
+        """
+        due = self.running(user).filter(end_time__lte=now or timezone.now())
+        return len([s for s in due if s.complete()])
+
+    def bulk_create(self, objs, batch_size=None):
+        for session in objs:
+            session.set_end_time()
+        return super(PomodoroSessionManager, self).bulk_create(objs, batch_size)
+
+
+class PomodoroSession(models.Model):
+
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    ABANDONED = 'abandoned'
+    STATUS_CHOICES = (
+        (RUNNING, 'running'),
+        (COMPLETED, 'completed'),
+        (ABANDONED, 'abandoned'),
+    )
+
+    user = models.ForeignKey(User)
+    tag = models.CharField(max_length=200)
+    start_time = models.DateTimeField("start time")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    duration = models.PositiveSmallIntegerField(default=default_minutes)  # minutes
+    break_duration = models.PositiveSmallIntegerField(default=default_break_minutes)  # minutes
+    end_time = models.DateTimeField("end time")
+
+    objects = PomodoroSessionManager()
+
+    class Meta:
+        index_together = [['user', 'status'], ['status', 'end_time']]
+
+    def __unicode__(self):
+        return 'user %s, %s from %s in %s' % (self.user.username, self.status, self.start_time.strftime('%c'), self.tag)
+
+    def set_end_time(self):
+        # Stored so the due sessions are found with the (status, end_time) index.
+        self.end_time = self.start_time + datetime.timedelta(minutes=self.duration)
+
+    def save(self, *args, **kwargs):
+        self.set_end_time()
+        super(PomodoroSession, self).save(*args, **kwargs)
+
+    def is_due(self, now=None):
+        return self.end_time <= (now or timezone.now())
+
+    def _leave_running(self, status):
+        # Conditional update, so concurrent requests cannot finish a session twice.
+        changed = PomodoroSession.objects.filter(pk=self.pk, status=self.RUNNING).update(status=status)
+        if changed:
+            self.status = status
+        return bool(changed)
+
+    def complete(self):
+        """
+        Stores the pomodoro of a running session. Returns False if it was not running, or if a
+        pomodoro stored meanwhile from another client overlaps it, which abandons it.
+        """
+        with transaction.atomic():
+            taken = Pomodoro.objects.taken(self.user_id, self.start_time, self.end_time)
+            if not self._leave_running(self.ABANDONED if taken else self.COMPLETED) or taken:
+                return False
+            tag = Tag.objects.named(self.user, self.tag)
+            pomodoro = Pomodoro.objects.create(user_id=self.user_id, tag=tag, end_time=self.end_time,
+                                               duration=self.duration)
+            pause = Break.objects.after(pomodoro, self.break_duration)
+            if self.user.email:
+                Job.objects.schedule('break_reminder', pause.end_time, user_id=self.user_id,
+                                     ended=pomodoro.end_time.isoformat())
+        return True
+
+    def abandon(self):
+        return self._leave_running(self.ABANDONED)
+
+
+class BreakManager(models.Manager):
+
+    def after(self, pomodoro, minutes=None):
+        """
+        Starts the break after a pomodoro, a long one after every POMODORO_LONG_BREAK_EVERY
+        pomodoros of the day.
+        """
+        every = getattr(settings, 'POMODORO_LONG_BREAK_EVERY', 4)
+        count = DailyRollup.objects.filter(user_id=pomodoro.user_id, day=local_date(pomodoro.end_time)).values_list(
+            'count', flat=True).first() or 0
+        if every and count and count % every == 0:
+            kind, minutes = Break.LONG, getattr(settings, 'POMODORO_LONG_BREAK_MINUTES', 15)
+        else:
+            kind, minutes = Break.SHORT, minutes or default_break_minutes()
+        return self.create(user_id=pomodoro.user_id, kind=kind, start_time=pomodoro.end_time,
+                           end_time=pomodoro.end_time + datetime.timedelta(minutes=minutes))
+
+
+class Break(models.Model):
+
+    SHORT = 'short'
+    LONG = 'long'
+    KIND_CHOICES = (
+        (SHORT, 'short'),
+        (LONG, 'long'),
+    )
+
+    user = models.ForeignKey(User)
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES, default=SHORT)
+    start_time = models.DateTimeField("start time")
+    end_time = models.DateTimeField("end time")
+
+    objects = BreakManager()
+
+    class Meta:
+        index_together = [['user', 'end_time']]
+
+    def __unicode__(self):
+        return 'user %s, %s break from %s to %s' % (self.user.username, self.kind, self.start_time.strftime('%c'),
+                                                    self.end_time.strftime('%c'))
+
+    def minutes(self):
+        return int((self.end_time - self.start_time).total_seconds() // 60)
+
+
+class JobManager(models.Manager):
+
+    def schedule(self, name, run_at=None, **args):
+        """
+        Queues the job name to run with the JSON serializable args at run_at, now by default.
+        """
+        return self.create(name=name, args=json.dumps(args, sort_keys=True), run_at=run_at or timezone.now())
+
+    def schedule_once(self, name, run_at=None, **args):
+        """
+        Like schedule(), unless a job name is already pending or running; returns None then.
+        """
+        try:
+            with transaction.atomic():
+                return self.create(name=name, args=json.dumps(args, sort_keys=True), run_at=run_at or timezone.now(),
+                                   unique_name=name)
+        except IntegrityError:
+            return None
+
+    def due(self, now=None):
+        return self.filter(status=Job.PENDING, run_at__lte=now or timezone.now())
+
+
+class Job(models.Model):
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    args = models.TextField(default='{}')
+    run_at = models.DateTimeField("run at")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    # The worker running it, and until when before it counts as stalled.
+    worker = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    # The name of a job queued with schedule_once() until it is done or failed, so it is queued once.
+    unique_name = models.CharField(max_length=100, null=True, blank=True, unique=True)
+
+    objects = JobManager()
+
+    class Meta:
+        index_together = [['status', 'run_at']]
+
+    def __unicode__(self):
+        return '%s job %s at %s' % (self.status, self.name, self.run_at.strftime('%c'))
+
+
+class ApiTokenManager(models.Manager):
+
+    def for_user(self, user):
+        """
+        Returns the user's API token, creating it if needed.
+        """
+        return self.get_or_create(user=user, defaults={'key': binascii.hexlify(os.urandom(20)).decode()})[0]
+
+
+class ApiToken(models.Model):
+
+    user = models.OneToOneField(User)
+    key = models.CharField(max_length=40, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = ApiTokenManager()
+
+    def __unicode__(self):
+        return 'user %s, API token' % self.user.username
+
+
+class DailyRollup(models.Model):
+
+    user = models.ForeignKey(User)
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['user', 'day']]
+
+    def __unicode__(self):
+        return 'user %s, %d pomodoros on %s' % (self.user.username, self.count, self.day)
+
+
+class TagRollup(models.Model):
+
+    user = models.ForeignKey(User)
+    tag = models.ForeignKey(Tag)
+    count = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['user', 'tag']]
+
+    def __unicode__(self):
+        return 'user %s, %d pomodoros in %s' % (self.user.username, self.count, self.tag)
+
+
+class HourRollup(models.Model):
+
+    user = models.ForeignKey(User)
+    week_day = models.PositiveSmallIntegerField()  # 0 is Monday
+    hour = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['user', 'week_day', 'hour']]
+
+    def __unicode__(self):
+        return 'user %s, %d pomodoros on weekday %d at %d' % (self.user.username, self.count, self.week_day, self.hour)
+
+
+class Team(models.Model):
+
+    name = models.CharField(max_length=200, unique=True)
+    members = models.ManyToManyField(User, through='Membership', related_name='teams')
+
+    def __unicode__(self):
+        return self.name
+
+
+class Membership(models.Model):
+
+    team = models.ForeignKey(Team)
+    user = models.ForeignKey(User)
+    joined = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['team', 'user']]
+
+    def __unicode__(self):
+        return 'user %s in %s' % (self.user.username, self.team)
+
+
+class TeamScore(models.Model):
+
+    DAY = 'day'
+    WEEK = 'week'
+    PERIOD_CHOICES = (
+        (DAY, 'day'),
+        (WEEK, 'week'),
+    )
+
+    team = models.ForeignKey(Team)
+    user = models.ForeignKey(User)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateField()
+    count = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['team', 'period', 'start', 'user']]
+        # Leaderboards walk it from the highest count down.
+        index_together = [['team', 'period', 'start', 'count']]
+
+    def __unicode__(self):
+        return 'user %s, %d pomodoros in %s on the %s of %s' % (self.user.username, self.count, self.team,
+                                                               self.period, self.start)
+
+
+def team_ids(user_id):
+    return list(Membership.objects.filter(user_id=user_id).values_list('team_id', flat=True))
+
+
+def bump_rollup(model, count, minutes, **key):
+    """
+    Adds count and minutes to the rollup row identified by key, creating it if needed.
+    """
+    changes = {'count': F('count') + count, 'minutes': F('minutes') + minutes}
+    if model.objects.filter(**key).update(**changes) or count <= 0:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(count=count, minutes=minutes, **key)
+    except IntegrityError:
+        # Somebody else created it meanwhile.
+        model.objects.filter(**key).update(**changes)
+
+
+def rollup_rows(rollup_key, team_ids=()):
+    """
+    Returns the (model, key) of every rollup row a pomodoro with this rollup key counts in,
+    and of the team scores of the given teams of its user.
+    """
+    user_id, tag_id, day, hour = rollup_key
+    rows = [(DailyRollup, (('user_id', user_id), ('day', day))),
+            (TagRollup, (('user_id', user_id), ('tag_id', tag_id))),
+            (HourRollup, (('user_id', user_id), ('week_day', day.weekday()), ('hour', hour)))]
+    for team_id in team_ids:
+        rows += [(TeamScore, (('team_id', team_id), ('period', TeamScore.DAY), ('start', day), ('user_id', user_id))),
+                 (TeamScore, (('team_id', team_id), ('period', TeamScore.WEEK), ('start', week_start(day)),
+                              ('user_id', user_id)))]
+    return rows
+
+
+def bump_rollups(rollup_key, count, minutes):
+    for model, key in rollup_rows(rollup_key, team_ids(rollup_key[0])):
+        bump_rollup(model, count, minutes, **dict(key))
+
+
+def remember_rollup_key(sender, instance, **kwargs):
+    # Saves of an existing pomodoro need the key and minutes it was counted under.
+    instance._rollup_key = instance.rollup_key() if instance.pk else None
+    instance._rollup_minutes = instance.minutes()
+
+
+def update_rollups_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new_key = instance.rollup_key()
+    old_key = None if created else instance._rollup_key
+    if (old_key, instance._rollup_minutes) != (new_key, instance.minutes()):
+        if old_key is not None:
+            bump_rollups(old_key, -1, -instance._rollup_minutes)
+        bump_rollups(new_key, 1, instance.minutes())
+    instance._rollup_key = new_key
+    instance._rollup_minutes = instance.minutes()
+
+
+def update_rollups_on_delete(sender, instance, **kwargs):
+    bump_rollups(instance._rollup_key or instance.rollup_key(), -1, -instance._rollup_minutes)
+
+
+post_init.connect(remember_rollup_key, sender=Pomodoro)
+post_save.connect(update_rollups_on_save, sender=Pomodoro)
+post_delete.connect(update_rollups_on_delete, sender=Pomodoro)
+
+
+class ChangeSequence(models.Model):
+
+    user = models.OneToOneField(User)
+    last_seq = models.BigIntegerField(default=0)
+    # Tombstones up to this number were compacted away, older cursors need a full sync.
+    compacted_seq = models.BigIntegerField(default=0)
+
+    def __unicode__(self):
+        return 'user %s, change %d' % (self.user.username, self.last_seq)
+
+
+class Change(models.Model):
+
+    user = models.ForeignKey(User)
+    seq = models.BigIntegerField()
+    pomodoro_id = models.IntegerField()
+    deleted = models.BooleanField(default=False)
+    time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['user', 'seq']]
+        index_together = [['user', 'pomodoro_id', 'seq'], ['deleted', 'time']]
+
+    def __unicode__(self):
+        return 'user %s, change %d %s pomodoro %d' % (self.user.username, self.seq,
+                                                       'deletes' if self.deleted else 'saves', self.pomodoro_id)
+
+
+def reserve_seqs(user_id, count):
+    """
+    Takes the next count numbers of the user's change sequence and returns the last one.
+    The user's sequence stays locked until the transaction ends, so changes of a user
+    become visible in sequence order.
+    """
+    if not ChangeSequence.objects.filter(user_id=user_id).update(last_seq=F('last_seq') + count):
+        # Numbers go on after the changes left, e.g. by a user deletion that removed the sequence first.
+        last_seq = (Change.objects.filter(user_id=user_id).aggregate(models.Max('seq'))['seq__max'] or 0) + count
+        try:
+            with transaction.atomic():
+                ChangeSequence.objects.create(user_id=user_id, last_seq=last_seq)
+            return last_seq
+        except IntegrityError:
+            # Somebody else created it meanwhile.
+            ChangeSequence.objects.filter(user_id=user_id).update(last_seq=F('last_seq') + count)
+    return ChangeSequence.objects.filter(user_id=user_id).values_list('last_seq', flat=True)[0]
+
+
+def record_changes(user_id, pomodoro_ids, deleted=False):
+    """
+    Appends saves or deletes of pomodoros of the user to the change log.
+    """
+    if not pomodoro_ids:
+        return
+    with transaction.atomic():
+        first = reserve_seqs(user_id, len(pomodoro_ids)) - len(pomodoro_ids) + 1
+        Change.objects.bulk_create([Change(user_id=user_id, seq=first + i, pomodoro_id=pk, deleted=deleted)
+                                    for i, pk in enumerate(pomodoro_ids)], batch_size=500)
+
+
+def remember_change_user(sender, instance, **kwargs):
+    instance._change_user_id = instance.user_id if instance.pk else None
+
+
+def log_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # A pomodoro given to another user is gone for its former user.
+    if instance._change_user_id not in (None, instance.user_id):
+        record_changes(instance._change_user_id, [instance.pk], deleted=True)
+    record_changes(instance.user_id, [instance.pk])
+    instance._change_user_id = instance.user_id
+
+
+def log_delete(sender, instance, **kwargs):
+    record_changes(instance.user_id, [instance.pk], deleted=True)
+
+
+def drop_change_log(sender, instance, **kwargs):
+    # The deletes of a deleted user's pomodoros were logged after the collector gathered the
+    # log, they go in the same transaction, so a deletion that fails keeps them.
+    Change.objects.filter(user_id=instance.pk).delete()
+    ChangeSequence.objects.filter(user_id=instance.pk).delete()
+
+
+post_init.connect(remember_change_user, sender=Pomodoro)
+post_save.connect(log_save, sender=Pomodoro)
+post_delete.connect(log_delete, sender=Pomodoro)
+post_delete.connect(drop_change_log, sender=User)
+
+# The cache, replica, leaderboard and search receivers need the models above.
+import Pymodoro.caching
+import Pymodoro.leaderboards
+import Pymodoro.routers
+import Pymodoro.search
+Pymodoro.search.connect_signals()
@@ -0,0 +1,76 @@
+"""
+Keyset pagination of pomodoros from newest to oldest.
+
+A page is located by a cursor on the (end_time, id) of a pomodoro instead of
+an offset, so every page costs the same index range scan no matter how deep
+it is, and pages stay stable while new pomodoros are stored.
+"""
+
+from django.conf import settings
+from django.utils import timezone
+
+import calendar, datetime
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def encode_cursor(pomodoro):
+    end_time = pomodoro.end_time
+    if timezone.is_aware(end_time):
+        end_time = timezone.make_naive(end_time, timezone.utc)
+    microseconds = calendar.timegm(end_time.timetuple()) * 10 ** 6 + end_time.microsecond
+    return '%d_%d' % (microseconds, pomodoro.id)
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (end_time, id) of a cursor, or raises ValueError if it is not valid.
+    """
+    microseconds, pk = [int(part) for part in cursor.split('_')]
+    try:
+        end_time = EPOCH + datetime.timedelta(microseconds=microseconds)
+    except OverflowError:
+        raise ValueError('Cursor out of range: %r' % cursor)
+    if settings.USE_TZ:
+        end_time = timezone.make_aware(end_time, timezone.utc)
+    return end_time, pk
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(queryset, size, after=None, before=None):
+    """
+    Returns the page of queryset following the after cursor, preceding the before
+    cursor, or the first one. Raises ValueError for cursors that are not valid.
+    """
+    if before:
+        end_time, pk = decode_cursor(before)
+        rows = list(queryset.filter(end_time__gte=end_time).exclude(end_time=end_time, id__lte=pk)
+                    .order_by('end_time', 'id')[:size + 1])
+        has_previous, has_next = len(rows) > size, True
+        rows = rows[:size][::-1]
+    else:
+        if after:
+            end_time, pk = decode_cursor(after)
+            # A plain range on end_time, so the index can seek straight to the cursor.
+            queryset = queryset.filter(end_time__lte=end_time).exclude(end_time=end_time, id__gte=pk)
+        rows = list(queryset.order_by('-end_time', '-id')[:size + 1])
+        has_previous, has_next = bool(after), len(rows) > size
+        rows = rows[:size]
+    if not rows:
+        return KeysetPage(rows)
+    return KeysetPage(rows,
+                      next_cursor=encode_cursor(rows[-1]) if has_next else None,
+                      previous_cursor=encode_cursor(rows[0]) if has_previous else None)
@@ -0,0 +1,96 @@
+"""
+Per-user counters of completed pomodoros per day, tag and hour of the week.
+
+The DailyRollup, TagRollup and HourRollup rows are kept up to date by the
+Pomodoro save and delete signals; the functions below read them, rebuild them
+from the Pomodoro table and check them against it.
+"""
+
+from django.db import transaction
+
+from collections import defaultdict
+
+from Pymodoro.models import Pomodoro, DailyRollup, HourRollup, TagRollup, local_today, rollup_rows
+
+ROLLUP_FIELDS = (
+    (DailyRollup, ('user_id', 'day')),
+    (TagRollup, ('user_id', 'tag_id')),
+    (HourRollup, ('user_id', 'week_day', 'hour')),
+)
+
+
+def today_count(user):
+    return day_count(user, local_today())
+
+
+def day_count(user, day):
+    rollup = DailyRollup.objects.filter(user=user, day=day).values_list('count', flat=True)
+    return rollup[0] if rollup else 0
+
+
+def tag_count(tag):
+    rollup = TagRollup.objects.filter(tag=tag).values_list('count', flat=True)
+    return rollup[0] if rollup else 0
+
+
+def expected_rollups(users=None):
+    """
+    Computes the rollups from the Pomodoro table, as {(model, key): [count, minutes]}.
+    Memory grows with the rollups, not with the pomodoros.
+    """
+    rollups = defaultdict(lambda: [0, 0])
+    pomodoros = Pomodoro.objects.all()
+    if users is not None:
+        pomodoros = pomodoros.filter(user__in=users)
+    for pomodoro in pomodoros.only('user', 'tag', 'end_time', 'duration').iterator():
+        minutes = pomodoro.minutes()
+        for row in rollup_rows(pomodoro.rollup_key()):
+            rollups[row][0] += 1
+            rollups[row][1] += minutes
+    return rollups
+
+
+def stored_rows(model, users=None):
+    rows = model.objects.all()
+    if users is not None:
+        rows = rows.filter(user__in=users)
+    return rows
+
+
+def stored_rollups(users=None):
+    rollups = {}
+    for model, fields in ROLLUP_FIELDS:
+        for row in stored_rows(model, users).values(*fields + ('count', 'minutes')).iterator():
+            if row['count']:
+                key = tuple((field, row[field]) for field in fields)
+                rollups[(model, key)] = [row['count'], row['minutes']]
+    return rollups
+
+
+def rebuild(users=None):
+    """
+    Replaces the rollups of the given users, or of everybody, with freshly computed ones.
+    Returns the number of rollup rows.
+    """
+    rollups = expected_rollups(users)
+    with transaction.atomic():
+        for model, fields in ROLLUP_FIELDS:
+            stored_rows(model, users).delete()
+            model.objects.bulk_create([model(count=count, minutes=minutes, **dict(key))
+                                       for (row_model, key), (count, minutes) in rollups.items()
+                                       if row_model is model], batch_size=500)
+    return len(rollups)
+
+
+def check(users=None):
+    """
+    Returns the rollups that differ from the Pomodoro table, as (model name, key, expected,
+    stored) tuples.
+    """
+    mismatches = []
+    expected, stored = expected_rollups(users), stored_rollups(users)
+    for row in set(expected) | set(stored):
+        if expected.get(row) != stored.get(row):
+            model, key = row
+            mismatches.append((model.__name__, dict(key), expected.get(row), stored.get(row)))
+    return sorted(mismatches, key=repr)
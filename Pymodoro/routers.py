@@ -0,0 +1,90 @@
+"""
+Reads of the read-only views from a replica database, and SQLite in WAL mode.
+
+Views decorated with reads_from_replica read the Pymodoro tables from the
+POMODORO_REPLICA_DATABASE alias, when DATABASES has it. A user who saved or
+deleted something in the last POMODORO_REPLICA_LAG_SECONDS keeps reading from
+the primary, so their own writes never seem lost to replication lag. Sessions
+and users are always read from the primary.
+"""
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+
+from functools import wraps
+import threading
+
+# Imported as a module, caching imports the models and they import this.
+import Pymodoro.caching
+
+_local = threading.local()
+
+
+def replica_alias():
+    alias = getattr(settings, 'POMODORO_REPLICA_DATABASE', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def write_key(user_id):
+    return 'pymodoro:wrote:%d' % user_id
+
+
+def mark_write(user_id):
+    Pymodoro.caching.pomodoro_cache().set(write_key(user_id), True, getattr(settings, 'POMODORO_REPLICA_LAG_SECONDS', 10))
+
+
+def wrote_recently(user_id):
+    return bool(Pymodoro.caching.pomodoro_cache().get(write_key(user_id)))
+
+
+def reads_from_replica(view):
+    """
+    Lets a read-only view read from the replica, unless its user wrote recently.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user = request.user
+        if replica_alias() is None or (user.is_authenticated() and wrote_recently(user.id)):
+            return view(request, *args, **kwargs)
+        _local.replica = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _local.replica = False
+    return wrapper
+
+
+class PrimaryReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if getattr(_local, 'replica', False) and model._meta.app_label == 'Pymodoro':
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica has the same rows as the primary.
+        return True
+
+    def allow_syncdb(self, db, model):
+        return None
+
+
+def remember_write(sender, instance, **kwargs):
+    user_id = getattr(instance, 'user_id', None)
+    if sender._meta.app_label == 'Pymodoro' and user_id is not None:
+        mark_write(user_id)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    # Readers go on while a writer commits, writers still take turns.
+    if connection.vendor == 'sqlite' and getattr(settings, 'POMODORO_SQLITE_WAL', True):
+        connection.cursor().execute('PRAGMA journal_mode=WAL')
+
+
+post_save.connect(remember_write)
+post_delete.connect(remember_write)
+connection_created.connect(configure_sqlite)
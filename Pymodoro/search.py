@@ -0,0 +1,274 @@
+# coding=utf-8
+
+"""
+Search of a user's tags ignoring case and accents, by the start of their words
+and, when too few tags start so, by similarity.
+
+On SQLite the tags are indexed in the Pymodoro_tagsearch FTS5 table, created
+by sql/tag.sqlite3.sql and kept in sync by the Tag save and delete signals,
+see connect_signals(). The user is a column of it, so the index narrows the
+search to the user's tags at once, and another column holds the trigrams of the
+name prefixed with the user id, which find the candidates of the fuzzy search
+among the user's tags only. On PostgreSQL the GIN indexes of
+sql/tag.postgresql_psycopg2.sql on the folded name serve both searches and need
+no syncing. Other backends, and databases where the index could not be created
+(an SQLite without FTS5, a PostgreSQL without the extensions), compare the
+user's tags one by one.
+``manage.py rebuild_search`` creates the index of an older database and
+refills it. Searches read from the database the router picks for tags.
+
+Counts and minutes come from the tag rollups, so the searches do not read the
+pomodoros however many there are.
+"""
+
+from django.db import connection, connections, router
+from django.db.models.signals import post_delete, post_save
+from django.utils.encoding import force_text
+
+import re, unicodedata
+
+from Pymodoro.models import Tag, TagRollup
+
+TABLE = 'Pymodoro_tagsearch'
+# Longest query searched, and most of its words used.
+MAX_QUERY_LENGTH = 100
+MAX_WORDS = 8
+# Tags ranked by shared trigrams before their similarity is computed.
+FUZZY_CANDIDATES = 100
+# Least similarity of a fuzzy match to the query, see similarity().
+SIMILARITY = 0.3
+PREFIX, FUZZY = 'prefix', 'fuzzy'
+
+# Whether the index exists, by database alias.
+_indexed = {}
+
+
+def fold(text):
+    # Lower case and without accents, 'fÓóÖ' is 'fooo'.
+    text = unicodedata.normalize('NFKD', force_text(text))
+    return u''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def words(text):
+    return re.findall(r'\w+', fold(text), re.UNICODE)
+
+
+def word_trigrams(word):
+    # Padded as pg_trgm does, so the start and end of the word count more.
+    padded = u'__%s_' % word
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def trigrams(text):
+    grams = set()
+    for word in words(text):
+        grams |= word_trigrams(word)
+    return grams
+
+
+def one_edit_apart(a, b):
+    # Whether a letter added, removed, changed or swapped with the next one turns a into b.
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return a == b
+    start = 0
+    while start < min(len(a), len(b)) and a[start] == b[start]:
+        start += 1
+    if len(a) == len(b):
+        return (a[start + 1:] == b[start + 1:] or
+                a[start] == b[start + 1] and a[start + 1] == b[start] and a[start + 2:] == b[start + 2:])
+    longer, shorter = (a, b) if len(a) > len(b) else (b, a)
+    return longer[start + 1:] == shorter[start:]
+
+
+def word_similarity(query_word, word):
+    shared, total = word_trigrams(query_word), word_trigrams(word)
+    score = float(len(shared & total)) / len(shared | total)
+    if len(query_word) >= 4 and one_edit_apart(query_word, word):
+        score = max(score, SIMILARITY)
+    return score
+
+
+def similarity(query, name):
+    """
+    How close the words of a name are to those of the query, from 0 to 1: the mean over the
+    query words of the trigrams they share with the closest word of the name. A word one
+    typing mistake away from a query word of four letters or more is close enough.
+    """
+    query_words, name_words = words(query), words(name)
+    if not query_words or not name_words:
+        return 0.0
+    return sum(max(word_similarity(q, w) for w in name_words) for q in query_words) / len(query_words)
+
+
+def quoted(term):
+    return u'"%s"' % term.replace(u'"', u'""')
+
+
+def user_token(user_id):
+    return u'u%d' % user_id
+
+
+def user_trigrams(user_id, text):
+    # Trigrams of the user alone, so the fuzzy search reads only the user's part of the index.
+    return sorted(u'%d%s' % (user_id, gram) for gram in trigrams(text))
+
+
+def indexed(db):
+    """
+    Returns whether the database has the index, which is looked up once per process.
+    """
+    if db.alias not in _indexed:
+        if db.vendor == 'sqlite':
+            sql, name = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", TABLE
+        elif db.vendor == 'postgresql':
+            sql, name = 'SELECT COUNT(*) FROM pg_proc WHERE proname = %s', 'pymodoro_fold'
+        else:
+            sql = None
+        if sql is None:
+            _indexed[db.alias] = False
+        else:
+            cursor = db.cursor()
+            cursor.execute(sql, [name])
+            _indexed[db.alias] = bool(cursor.fetchone()[0])
+    return _indexed[db.alias]
+
+
+def index_tag(sender, instance, using=None, **kwargs):
+    db = connections[using or 'default']
+    if db.vendor != 'sqlite' or not indexed(db):
+        return
+    cursor = db.cursor()
+    cursor.execute('DELETE FROM %s WHERE rowid = %%s' % TABLE, [instance.pk])
+    cursor.execute('INSERT INTO %s (rowid, user, name, grams) VALUES (%%s, %%s, %%s, %%s)' % TABLE,
+                   [instance.pk, user_token(instance.user_id), fold(instance.name),
+                    u' '.join(user_trigrams(instance.user_id, instance.name))])
+
+
+def unindex_tag(sender, instance, using=None, **kwargs):
+    db = connections[using or 'default']
+    if db.vendor == 'sqlite' and indexed(db):
+        db.cursor().execute('DELETE FROM %s WHERE rowid = %%s' % TABLE, [instance.pk])
+
+
+def rebuild(batch_size=1000):
+    """
+    Fills the SQLite index again from the Tag table. Returns the number of tags indexed.
+    """
+    # It may just have been created.
+    _indexed.pop(connection.alias, None)
+    if connection.vendor != 'sqlite' or not indexed(connection):
+        return 0
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s' % TABLE)
+    count, batch = 0, []
+    for pk, user_id, name in Tag.objects.order_by('pk').values_list('pk', 'user_id', 'name').iterator():
+        batch.append((pk, user_token(user_id), fold(name), u' '.join(user_trigrams(user_id, name))))
+        if len(batch) >= batch_size:
+            cursor.executemany('INSERT INTO %s (rowid, user, name, grams) VALUES (%%s, %%s, %%s, %%s)' % TABLE, batch)
+            count, batch = count + len(batch), []
+    if batch:
+        cursor.executemany('INSERT INTO %s (rowid, user, name, grams) VALUES (%%s, %%s, %%s, %%s)' % TABLE, batch)
+    return count + len(batch)
+
+
+def search_db():
+    # The replica in the views reading from it.
+    return connections[router.db_for_read(Tag)]
+
+
+def fetch(db, sql, *params):
+    # The (id, name, count, minutes) of the tags the SQL selects, joined with their rollups.
+    qn = db.ops.quote_name
+    cursor = db.cursor()
+    cursor.execute(sql % {'tag': qn(Tag._meta.db_table), 'rollup': qn(TagRollup._meta.db_table), 'index': TABLE},
+                   params)
+    return cursor.fetchall()
+
+
+def prefix_matches(db, user, terms, limit):
+    vendor = db.vendor if indexed(db) else None
+    if vendor == 'sqlite':
+        match = u'user : %s AND name : (%s)' % (quoted(user_token(user.pk)),
+                                                u' AND '.join(quoted(term) + u'*' for term in terms))
+        return fetch(db, 'SELECT t.id, t.name, r.count, r.minutes FROM %(index)s INNER JOIN %(tag)s t '
+                     'ON t.id = %(index)s.rowid LEFT OUTER JOIN %(rollup)s r ON r.tag_id = t.id '
+                     'WHERE %(index)s MATCH %%s ORDER BY COALESCE(r.count, 0) DESC, t.name LIMIT %%s', match, limit)
+    if vendor == 'postgresql':
+        query = u' & '.join(u"'%s':*" % t.replace(u"'", u"''") for t in terms)
+        return fetch(db, "SELECT t.id, t.name, r.count, r.minutes FROM %(tag)s t "
+                     "LEFT OUTER JOIN %(rollup)s r ON r.tag_id = t.id WHERE t.user_id = %%s "
+                     "AND to_tsvector('simple', pymodoro_fold(t.name)) @@ to_tsquery('simple', %%s) "
+                     "ORDER BY COALESCE(r.count, 0) DESC, t.name LIMIT %%s", user.pk, query, limit)
+    rows = [row for row in scan(db, user) if all(any(w.startswith(t) for w in words(row[1])) for t in terms)]
+    return sorted(rows, key=lambda row: (-(row[2] or 0), row[1]))[:limit]
+
+
+def fuzzy_matches(db, user, text, limit):
+    vendor = db.vendor if indexed(db) else None
+    if vendor == 'sqlite':
+        match = u'grams : (%s)' % u' OR '.join(quoted(gram) for gram in user_trigrams(user.pk, text))
+        rows = fetch(db, 'SELECT t.id, t.name, r.count, r.minutes FROM %(index)s INNER JOIN %(tag)s t '
+                     'ON t.id = %(index)s.rowid LEFT OUTER JOIN %(rollup)s r ON r.tag_id = t.id '
+                     'WHERE %(index)s MATCH %%s ORDER BY %(index)s.rank LIMIT %%s', match, FUZZY_CANDIDATES)
+    elif vendor == 'postgresql':
+        # pg_trgm's word similarity, the <%% operator keeps the names above its
+        # word_similarity_threshold using the trigram index.
+        return fetch(db, 'SELECT t.id, t.name, r.count, r.minutes FROM %(tag)s t '
+                     'LEFT OUTER JOIN %(rollup)s r ON r.tag_id = t.id WHERE t.user_id = %%s '
+                     'AND %%s <%%%% pymodoro_fold(t.name) '
+                     'ORDER BY word_similarity(%%s, pymodoro_fold(t.name)) DESC, t.name LIMIT %%s',
+                     user.pk, fold(text), fold(text), limit)
+    else:
+        rows = scan(db, user)
+    scored = [(similarity(text, row[1]), row) for row in rows]
+    scored.sort(key=lambda item: (-item[0], item[1][1]))
+    return [row for score, row in scored if score >= SIMILARITY][:limit]
+
+
+def scan(db, user):
+    return list(Tag.objects.using(db.alias).filter(user=user).order_by('name').values_list(
+        'id', 'name', 'tagrollup__count', 'tagrollup__minutes'))
+
+
+def tag_ids_sql(db, query):
+    """
+    Returns the SQL and parameters selecting the ids of the tags of every user with words
+    starting with the words of the query, through the index; None without the index or words.
+    """
+    terms = words(query[:MAX_QUERY_LENGTH])[:MAX_WORDS]
+    vendor = db.vendor if terms and indexed(db) else None
+    if vendor == 'sqlite':
+        return ('SELECT rowid FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE),
+                [u'name : (%s)' % u' AND '.join(quoted(term) + u'*' for term in terms)])
+    if vendor == 'postgresql':
+        return ("SELECT id FROM %s WHERE to_tsvector('simple', pymodoro_fold(name)) @@ to_tsquery('simple', %%s)"
+                % db.ops.quote_name(Tag._meta.db_table), [u' & '.join(u"'%s':*" % t.replace(u"'", u"''") for t in terms)])
+    return None
+
+
+def search_tags(user, query, limit=10):
+    """
+    Returns up to limit of the user's tags whose words start with the words of the query,
+    then the tags most similar to it, as dicts with their name, count, minutes and how they
+    matched.
+    """
+    terms = words(query[:MAX_QUERY_LENGTH])[:MAX_WORDS]
+    if not terms:
+        return []
+    db = search_db()
+    found = [(row, PREFIX) for row in prefix_matches(db, user, terms, limit)]
+    if len(found) < limit:
+        seen = set(row[0] for row, match in found)
+        similar = fuzzy_matches(db, user, u' '.join(terms), limit + len(found))
+        found += [(row, FUZZY) for row in similar if row[0] not in seen]
+    return [{'name': name, 'count': count or 0, 'minutes': minutes or 0, 'match': match}
+            for (pk, name, count, minutes), match in found[:limit]]
+
+
+def connect_signals():
+    """
+    Keeps the SQLite index in sync with the Tag table. Called by Pymodoro.models once the models
+    are defined.
+    """
+    post_save.connect(index_tag, sender=Tag)
+    post_delete.connect(unindex_tag, sender=Tag)
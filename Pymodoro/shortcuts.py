@@ -0,0 +1,23 @@
+"""
+Helpers of the HTML views and the API, kept out of both so the API does not
+import the views, their forms and templates along with them.
+"""
+
+from django.http import HttpResponse
+from django.utils.dateparse import parse_date
+
+import json
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data), content_type='application/json', status=status)
+
+
+def parse_day(value):
+    # Raises ValueError for values that are not dates as YYYY-MM-DD.
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError('%r is not a date as YYYY-MM-DD.' % value)
+    return day
@@ -0,0 +1,9 @@
+-- Trigram index for the admin's case insensitive tag search, UPPER("name"::text) LIKE UPPER('%...%').
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS "Pymodoro_tag_name_trgm" ON "Pymodoro_tag" USING gin (UPPER("name"::text) gin_trgm_ops);
+-- Indexes of Pymodoro.search on the name in lower case without accents: its words, for prefix
+-- searches, and its trigrams, for similar names.
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE OR REPLACE FUNCTION pymodoro_fold(text) RETURNS text AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, $1)) $$ LANGUAGE sql IMMUTABLE;
+CREATE INDEX IF NOT EXISTS "Pymodoro_tag_name_words" ON "Pymodoro_tag" USING gin (to_tsvector('simple', pymodoro_fold("name")));
+CREATE INDEX IF NOT EXISTS "Pymodoro_tag_name_fold_trgm" ON "Pymodoro_tag" USING gin (pymodoro_fold("name") gin_trgm_ops);
@@ -0,0 +1,4 @@
+-- Full-text index of the tag names for Pymodoro.search, filled by the Tag signals: the user as a word, the
+-- folded name, indexed by prefixes of 2 and 3 letters too, and its trigrams, padded with '_' as a letter and
+-- prefixed with the user id.
+CREATE VIRTUAL TABLE IF NOT EXISTS Pymodoro_tagsearch USING fts5(user, name, grams, tokenize = "unicode61 remove_diacritics 2 tokenchars '_'", prefix = '2 3');
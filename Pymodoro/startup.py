@@ -0,0 +1,110 @@
+"""
+Startup profile of a fresh Django process.
+
+Run as ``python -m Pymodoro.startup <path>`` with DJANGO_SETTINGS_MODULE set, it
+times the import of every module, then loads the models and the WSGI
+application and sends it one GET of path, and prints the timings as JSON.
+Only the standard library is imported before the import hook is in place,
+run() starts such a process and returns what it printed. The modules loaded
+are told by what sys.modules gained, so ``from package import module`` and
+relative imports count too.
+"""
+
+import json, os, subprocess, sys, time
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+_import = builtins.__import__
+_preloaded = set(sys.modules)
+
+# Seconds spent importing each module, without the modules it imported in turn.
+_import_times = {}
+# [seconds, modules] loaded by the imports nested in each import running.
+_stack = []
+# What __import__ takes for level when it is not given: implicit relative imports first on Python 2.
+DEFAULT_LEVEL = -1 if sys.version_info[0] < 3 else 0
+
+
+def imported(name, fromlist):
+    # Whether the import has nothing left to load: the module and the names taken from it are there.
+    module = sys.modules.get(name)
+    return module is not None and all(hasattr(module, item) for item in fromlist or () if item != '*')
+
+
+def timed_import(name, globals=None, locals=None, fromlist=None, level=DEFAULT_LEVEL):
+    # Only the first import of a module takes time, later ones find it in sys.modules.
+    if level in (0, -1) and imported(name, fromlist):
+        return _import(name, globals, locals, fromlist, level)
+    before = set(sys.modules)
+    start = time.time()
+    _stack.append([0.0, set()])
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - start
+        nested, nested_modules = _stack.pop()
+        loaded = set(module for module in sys.modules if module not in before and sys.modules[module] is not None)
+        if _stack:
+            _stack[-1][0] += elapsed
+            _stack[-1][1].update(loaded)
+        own = loaded - nested_modules
+        if own:
+            # The time goes to the innermost module this import loaded itself, e.g. package.module.
+            module = max(own, key=lambda module: (module.count('.'), module))
+            _import_times[module] = _import_times.get(module, 0.0) + elapsed - nested
+
+
+def loaded_modules():
+    # The modules loaded since this module was, None entries of failed relative imports aside.
+    return sorted(name for name, module in sys.modules.items() if module is not None and name not in _preloaded)
+
+
+def profile(path, top=25):
+    """
+    Returns the milliseconds until the models are loaded, the application is ready and the
+    first response to a GET of path is sent, and the slowest module imports.
+    """
+    start = time.time()
+    from django.db.models import get_models
+    get_models()
+    models = time.time()
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    ready = time.time()
+    statuses = []
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80', 'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': 'localhost',
+               'wsgi.url_scheme': 'http', 'wsgi.input': sys.stdin, 'wsgi.errors': sys.stderr,
+               'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True,
+               'wsgi.run_once': False}
+    b''.join(application(environ, lambda status, headers, *args: statuses.append(status)))
+    first_response = time.time()
+    loaded = loaded_modules()
+    slowest = sorted(_import_times.items(), key=lambda item: -item[1])[:top]
+    return {
+        'models_ms': round((models - start) * 1000, 1),
+        'application_ms': round((ready - start) * 1000, 1),
+        'first_response_ms': round((first_response - start) * 1000, 1),
+        'status': statuses[0] if statuses else None,
+        'modules': len(loaded),
+        'imports': [[name, round(seconds * 1000, 2)] for name, seconds in slowest],
+        'loaded': loaded,
+    }
+
+
+def run(settings_module, path, top=25):
+    # The profile of a new Python process with the settings module, from the project directory.
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    output = subprocess.check_output([sys.executable, '-m', 'Pymodoro.startup', path, str(top)], cwd=root, env=env)
+    return json.loads(output.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    builtins.__import__ = timed_import
+    sys.stdout.write(json.dumps(profile(sys.argv[1] if len(sys.argv) > 1 else '/',
+                                        int(sys.argv[2]) if len(sys.argv) > 2 else 25)))
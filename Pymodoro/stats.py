@@ -0,0 +1,150 @@
+"""
+Productivity statistics of a user, aggregated by the database.
+
+In the default time zone they are read from the rollups, which are already
+counted per local day, tag and hour of the week. Otherwise pomodoros are
+grouped in the current time zone with the backend's date truncation and
+extraction functions, so only one row per bucket leaves the database either
+way. Weeks, months and streaks are derived from the daily buckets.
+"""
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Sum
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+
+import datetime
+
+from Pymodoro.models import Pomodoro, DailyRollup, HourRollup, TagRollup, day_bounds, local_today
+
+PERIODS = ('day', 'week', 'month')
+KINDS = PERIODS + ('tags', 'hours', 'streaks')
+
+
+def user_pomodoros(user, since=None, until=None):
+    """
+    The pomodoros of the user between the since and until local days, both included.
+    """
+    pomodoros = Pomodoro.objects.for_user(user)
+    if since is not None:
+        pomodoros = pomodoros.filter(end_time__gte=day_bounds(since)[0])
+    if until is not None:
+        pomodoros = pomodoros.filter(end_time__lt=day_bounds(until)[1])
+    return pomodoros
+
+
+def with_datetime_sql(pomodoros, name, function, lookup_type):
+    """
+    Adds a column named name with the datetime trunc or extract SQL of end_time.
+    """
+    connection = connections[pomodoros.db]
+    qn = connection.ops.quote_name
+    field = '%s.%s' % (qn(Pomodoro._meta.db_table), qn('end_time'))
+    tzname = timezone.get_current_timezone_name() if settings.USE_TZ else None
+    sql, params = getattr(connection.ops, 'datetime_%s_sql' % function)(lookup_type, field, tzname)
+    return pomodoros.extra(select={name: sql}, select_params=params)
+
+
+def to_date(value):
+    # Backends hand back truncated datetimes either as strings or as datetimes.
+    if isinstance(value, six.string_types):
+        value = parse_datetime(value)
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def in_rollup_zone():
+    """
+    Whether the current time zone is the one the rollups are counted in.
+    """
+    return not settings.USE_TZ or timezone.get_current_timezone_name() == timezone.get_default_timezone_name()
+
+
+def daily_counts(user, since=None, until=None):
+    """
+    Returns (day, count, minutes) tuples for the local days with pomodoros, in order.
+    """
+    if in_rollup_zone():
+        rows = DailyRollup.objects.filter(user=user, count__gt=0)
+        if since is not None:
+            rows = rows.filter(day__gte=since)
+        if until is not None:
+            rows = rows.filter(day__lte=until)
+        return list(rows.order_by('day').values_list('day', 'count', 'minutes'))
+    pomodoros = with_datetime_sql(user_pomodoros(user, since, until), 'bucket', 'trunc', 'day')
+    rows = pomodoros.values('bucket').annotate(count=Count('id'), minutes=Sum('duration')).order_by('bucket')
+    return [(to_date(row['bucket']), row['count'], row['minutes']) for row in rows]
+
+
+def period_counts(user, period='day', since=None, until=None):
+    """
+    Returns the number of pomodoros and minutes per day, week (starting on Monday) or month.
+    """
+    buckets = {}
+    for day, count, total in daily_counts(user, since, until):
+        if period == 'week':
+            day -= datetime.timedelta(days=day.weekday())
+        elif period == 'month':
+            day = day.replace(day=1)
+        bucket = buckets.setdefault(day, [0, 0])
+        bucket[0] += count
+        bucket[1] += total
+    return [{'start': start.isoformat(), 'count': count, 'minutes': total}
+            for start, (count, total) in sorted(buckets.items())]
+
+
+def tag_breakdown(user, since=None, until=None):
+    if since is None and until is None:
+        rows = TagRollup.objects.filter(user=user, count__gt=0).values('tag__name', 'count', 'minutes')
+    else:
+        rows = (user_pomodoros(user, since, until).values('tag__name')
+                .annotate(count=Count('id'), minutes=Sum('duration')))
+    return [{'tag': row['tag__name'], 'count': row['count'], 'minutes': row['minutes']}
+            for row in rows.order_by('-count', 'tag__name')]
+
+
+def hour_heatmap(user, since=None, until=None):
+    """
+    Returns 7 lists, Monday first, with the number of pomodoros ended at each hour of that weekday.
+    """
+    heatmap = [[0] * 24 for i in range(7)]
+    if in_rollup_zone() and since is None and until is None:
+        for week_day, hour, count in HourRollup.objects.filter(user=user).values_list('week_day', 'hour', 'count'):
+            heatmap[week_day][hour] = count
+        return heatmap
+    pomodoros = with_datetime_sql(user_pomodoros(user, since, until), 'week_day', 'extract', 'week_day')
+    pomodoros = with_datetime_sql(pomodoros, 'hour', 'extract', 'hour')
+    for row in pomodoros.values('week_day', 'hour').annotate(count=Count('id')):
+        # The backends number week days from Sunday=1 to Saturday=7.
+        heatmap[(int(row['week_day']) + 5) % 7][int(row['hour'])] = row['count']
+    return heatmap
+
+
+def streaks(user):
+    """
+    Returns the current and longest runs of consecutive local days with pomodoros.
+    """
+    days = [day for day, count, total in daily_counts(user)]
+    longest = run = 0
+    previous = None
+    for day in days:
+        run = run + 1 if previous is not None and day - previous == datetime.timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+    today = local_today()
+    # A streak is still current until a whole day goes by without pomodoros.
+    current = run if previous is not None and today - previous <= datetime.timedelta(days=1) else 0
+    return {'current': current, 'longest': longest, 'last_day': previous.isoformat() if previous else None}
+
+
+def results(user, kind, since=None, until=None):
+    """
+    Returns the statistics of one of the KINDS.
+    """
+    if kind in PERIODS:
+        return period_counts(user, kind, since, until)
+    elif kind == 'tags':
+        return tag_breakdown(user, since, until)
+    elif kind == 'hours':
+        return hour_heatmap(user, since, until)
+    return streaks(user)
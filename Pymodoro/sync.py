@@ -0,0 +1,147 @@
+"""
+Delta sync of a user's pomodoros through the change log.
+
+Every save and delete of a pomodoro appends a Change with the next number of
+its user's sequence, so a client keeps the last number it has seen as its
+cursor and only asks for what changed after it. Writes of a user take turns
+on the row of their sequence: a client change based on an older number than
+the pomodoro's latest change loses to it, whoever sent it first.
+
+Compaction keeps the log bounded: it drops the changes that a later change of
+the same pomodoro supersedes, then the deletes older than the retention. The
+clients whose cursor is older than the dropped deletes get a full sync.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+import datetime
+
+from Pymodoro.models import Change, ChangeSequence, Pomodoro, PomodoroLock, Tag, record_changes, reserve_seqs
+
+SYNC_PAGE_SIZE = 500
+CREATE, UPDATE, DELETE = 'create', 'update', 'delete'
+OPERATIONS = (CREATE, UPDATE, DELETE)
+
+
+def changes_since(user, cursor=0, limit=SYNC_PAGE_SIZE):
+    """
+    Returns the changes of the user's pomodoros after cursor, at most limit of them, as a dict
+    with the new 'cursor', whether there are 'more', the 'saved' pomodoros (with the seq of
+    their latest change) and the ids of the 'deleted' ones. With 'reset', the client has to
+    drop what it has first, its cursor was compacted away.
+    """
+    compacted = ChangeSequence.objects.filter(user=user).values_list('compacted_seq', flat=True).first() or 0
+    reset = 0 < cursor < compacted
+    if reset:
+        cursor = 0
+    rows = list(Change.objects.filter(user=user, seq__gt=cursor).order_by('seq')
+                .values_list('seq', 'pomodoro_id', 'deleted')[:limit])
+    latest = {}
+    for seq, pk, deleted in rows:
+        latest[pk] = seq, deleted
+    saved_ids = [pk for pk, (seq, deleted) in latest.items() if not deleted]
+    saved = []
+    if saved_ids:
+        # Pomodoros deleted since then are left out, their delete comes later.
+        for pomodoro in Pomodoro.objects.filter(user=user, id__in=saved_ids).select_related('tag'):
+            pomodoro.seq = latest[pomodoro.id][0]
+            saved.append(pomodoro)
+    return {
+        'cursor': rows[-1][0] if rows else cursor,
+        'more': len(rows) == limit,
+        'reset': reset,
+        'saved': sorted(saved, key=lambda pomodoro: pomodoro.seq),
+        'deleted': sorted(pk for pk, (seq, deleted) in latest.items() if deleted),
+    }
+
+
+def latest_seq(user, pomodoro_id):
+    return Change.objects.filter(user=user, pomodoro_id=pomodoro_id).aggregate(Max('seq'))['seq__max'] or 0
+
+
+def apply_changes(user, changes):
+    """
+    Applies (operation, id, base seq, tag name, end time, minutes) changes of a client in
+    order and in one transaction. Returns a (result, id) pair per change, the result being
+    the operation done or 'conflict' when the pomodoro changed after base seq, is gone or
+    would overlap another stored pomodoro; a create in conflict has no id.
+    """
+    results = []
+    with transaction.atomic():
+        # Concurrent writes of the user wait for this transaction, so conflicts are decided in order;
+        # the pomodoros first, as every writer locks them before the change sequence.
+        PomodoroLock.objects.lock(user.id)
+        reserve_seqs(user.id, 0)
+        for operation, pk, base_seq, name, end_time, minutes in changes:
+            start_time = end_time - datetime.timedelta(minutes=minutes) if operation != DELETE else None
+            if operation == CREATE:
+                if Pomodoro.objects.taken(user.id, start_time, end_time):
+                    results.append(('conflict', None))
+                    continue
+                pomodoro = Pomodoro.objects.create(user=user, tag=Tag.objects.named(user, name), end_time=end_time,
+                                                   duration=minutes)
+                results.append((CREATE, pomodoro.id))
+                continue
+            pomodoro = Pomodoro.objects.filter(user=user, pk=pk).first()
+            if pomodoro is None:
+                results.append((DELETE if operation == DELETE else 'conflict', pk))
+            elif latest_seq(user, pk) > (base_seq or 0):
+                results.append(('conflict', pk))
+            elif operation == UPDATE and Pomodoro.objects.taken(user.id, start_time, end_time, exclude=pk):
+                results.append(('conflict', pk))
+            elif operation == DELETE:
+                pomodoro.delete()
+                results.append((DELETE, pk))
+            else:
+                pomodoro.tag = Tag.objects.named(user, name)
+                pomodoro.end_time = end_time
+                pomodoro.duration = minutes
+                pomodoro.save()
+                results.append((UPDATE, pk))
+    return results
+
+
+def seed(users=None):
+    """
+    Logs a save of every pomodoro that is not in the change log yet, like those stored
+    before it existed. Returns how many were logged.
+    """
+    pomodoros = Pomodoro.objects.all()
+    if users is not None:
+        pomodoros = pomodoros.filter(user__in=users)
+    logged = 0
+    for user_id in pomodoros.order_by().values_list('user_id', flat=True).distinct():
+        known = set(Change.objects.filter(user_id=user_id).values_list('pomodoro_id', flat=True))
+        missing = [pk for pk in Pomodoro.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True)
+                   if pk not in known]
+        record_changes(user_id, missing)
+        logged += len(missing)
+    return logged
+
+
+def compact(retention_days=None):
+    """
+    Drops superseded changes and the deletes older than retention_days, the
+    POMODORO_CHANGE_RETENTION_DAYS setting by default. Returns how many changes were dropped.
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'POMODORO_CHANGE_RETENTION_DAYS', 30)
+    qn = connection.ops.quote_name
+    table = qn(Change._meta.db_table)
+    cutoff = timezone.now() - datetime.timedelta(days=retention_days)
+    with transaction.atomic():
+        cursor = connection.cursor()
+        # Uses the (user, pomodoro_id, seq) index for every change.
+        cursor.execute('DELETE FROM %s WHERE seq < (SELECT MAX(latest.seq) FROM %s latest '
+                       'WHERE latest.user_id = %s.user_id AND latest.pomodoro_id = %s.pomodoro_id)'
+                       % (table, table, table, table))
+        dropped = cursor.rowcount
+        tombstones = Change.objects.filter(deleted=True, time__lt=cutoff)
+        for user_id, seq in tombstones.order_by().values_list('user_id').annotate(Max('seq')):
+            ChangeSequence.objects.filter(user_id=user_id, compacted_seq__lt=seq).update(compacted_seq=seq)
+        dropped += tombstones.count()
+        tombstones.delete()
+    return dropped
@@ -1,19 +1,40 @@
 # coding=utf-8
 
+from django.contrib import admin
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.timezone import utc
-from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.core import mail
+from django.core.cache import cache
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models.signals import post_delete
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.urlresolvers import resolve, reverse
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.functional import empty
+from django.utils.six import StringIO
 
-from Pymodoro.models import Pomodoro, PomodoroManager
+from Pymodoro import api, assets, caching, instrumentation, jobs, leaderboards, loadtest, routers, rollups, search, startup, stats, sync, transfer, views
+from Pymodoro.admin import EstimatedCountQuerySet, ESTIMATE_THRESHOLD
+from Pymodoro.models import ApiToken, Break, ChangeSequence, Job, Pomodoro, PomodoroLock, PomodoroManager, PomodoroSession, Tag, Change, DailyRollup, TagRollup, Membership, Team, TeamScore, day_bounds, local_today, pomodoro_length
 
-import datetime, unittest
+import datetime, gzip, json, os, random, shutil, subprocess, sys, tempfile, unittest
 
 def create_user(username='john_doe', password='john_doe'):
     return User.objects.create_user(username=username, password=password)
 
 def create_pomodoro(user, end_time, tag='foo'):
-    return Pomodoro.objects.create(user=user, end_time=end_time, tag=tag)
+    return Pomodoro.objects.create(user=user, end_time=end_time, tag=Tag.objects.named(user, tag))
+
+def create_session(user, start_time, tag='foo'):
+    return PomodoroSession.objects.create(user=user, start_time=start_time, tag=tag)
 
 class PomodoroMethodTests(unittest.TestCase):
 
@@ -108,6 +129,25 @@ class PomodoroManagerMethodTests(unittest.TestCase):
         create_pomodoro(self.u2, datetime.datetime.utcnow().replace(tzinfo=utc))
         self.assertEqual(len(self.pm.are_from_today(self.u1)), 0)
 
+    def test_are_from_today_with_pomodoros_at_the_local_day_bounds(self):
+        """
+        are_from_today() should use the local day, including its first instant and excluding the next day's.
+        """
+        start, end = day_bounds()
+        p1 = create_pomodoro(self.u1, start)
+        create_pomodoro(self.u1, end)
+        create_pomodoro(self.u1, start - datetime.timedelta(microseconds=1))
+        self.assertEqual(list(self.pm.are_from_today(self.u1)), [p1])
+
+    def test_are_from_today_orders_from_newest_to_oldest(self):
+        """
+        are_from_today() should return the most recent pomodoro first.
+        """
+        start, end = day_bounds()
+        p1 = create_pomodoro(self.u1, start)
+        p2 = create_pomodoro(self.u1, start + datetime.timedelta(minutes=30))
+        self.assertEqual(list(self.pm.are_from_today(self.u1)), [p2, p1])
+
     def tearDown(self):
         self.u1.delete()
         self.u2.delete()
@@ -115,6 +155,7 @@ class PomodoroManagerMethodTests(unittest.TestCase):
 class PomodoroIndexViewTests(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.u1 = User.objects.create_user(username='john_doe', password='john_doe')
         self.client.login(username='john_doe', password='john_doe')
         self.u2 = User.objects.create_user(username='jane_doe', password='jane_doe')
@@ -242,7 +283,7 @@ class PomodoroTagViewTests(TestCase):
         The tag view of a tag from other user should return a 404 not found.
         """
         p = create_pomodoro(self.u2, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
-        response = self.client.get(reverse('Pymodoro:tag', args=(p.tag,)))
+        response = self.client.get(reverse('Pymodoro:tag', args=(p.tag.name,)))
         self.assertEqual(response.status_code, 404)
 
     def test_detail_view_of_an_existent_tag_from_logged_user_with_one_pomodoro(self):
@@ -250,7 +291,7 @@ class PomodoroTagViewTests(TestCase):
         The tag view of a tag from logged user should display correctly.
         """
         p = create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
-        response = self.client.get(reverse('Pymodoro:tag', args=(p.tag,)))
+        response = self.client.get(reverse('Pymodoro:tag', args=(p.tag.name,)))
         self.assertContains(response, p.id, status_code=200)
         self.assertEqual(len(response.context['pomodoro_list']), 1)
 
@@ -260,7 +301,7 @@ class PomodoroTagViewTests(TestCase):
         """
         p1 = create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
         create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
-        response = self.client.get(reverse('Pymodoro:tag', args=(p1.tag,)))
+        response = self.client.get(reverse('Pymodoro:tag', args=(p1.tag.name,)))
         self.assertContains(response, p1.id, status_code=200)
         self.assertEqual(len(response.context['pomodoro_list']), 2)
 
@@ -270,7 +311,7 @@ class PomodoroTagViewTests(TestCase):
         """
         p1 = create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
         create_pomodoro(self.u2, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
-        response = self.client.get(reverse('Pymodoro:tag', args=(p1.tag,)))
+        response = self.client.get(reverse('Pymodoro:tag', args=(p1.tag.name,)))
         self.assertContains(response, p1.id, status_code=200)
         self.assertEqual(len(response.context['pomodoro_list']), 1)
 
@@ -279,10 +320,1592 @@ class PomodoroTagViewTests(TestCase):
         The tag view of a tag with a written accent from current user should display correctly.
         """
         p1 = create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'fÓóÖ')
-        response = self.client.get(reverse('Pymodoro:tag', args=(p1.tag,)))
+        response = self.client.get(reverse('Pymodoro:tag', args=(p1.tag.name,)))
         self.assertContains(response, p1.id, status_code=200)
         self.assertEqual(len(response.context['pomodoro_list']), 1)
 
+    @override_settings(POMODORO_PAGE_SIZE=2)
+    def test_tag_view_pages_from_newest_to_oldest_and_back(self):
+        """
+        The tag view should page through the pomodoros of a tag, ties included, and back again.
+        """
+        dt = datetime.datetime.utcnow().replace(tzinfo=utc)
+        pomodoros = [create_pomodoro(self.u1, dt - datetime.timedelta(minutes=i // 2), 'foo') for i in range(5)]
+        newest_first = sorted(pomodoros, key=lambda p: (p.end_time, p.id), reverse=True)
+        response = self.client.get(reverse('Pymodoro:tag', args=('foo',)))
+        self.assertContains(response, "You have completed 5 pomodoros with this tag.", status_code=200)
+        self.assertEqual(response.context['pomodoro_list'], newest_first[:2])
+        self.assertIsNone(response.context['previous_url'])
+        response = self.client.get(response.context['next_url'])
+        self.assertEqual(response.context['pomodoro_list'], newest_first[2:4])
+        last = self.client.get(response.context['next_url'])
+        self.assertEqual(last.context['pomodoro_list'], newest_first[4:])
+        self.assertIsNone(last.context['next_url'])
+        response = self.client.get(last.context['previous_url'])
+        self.assertEqual(response.context['pomodoro_list'], newest_first[2:4])
+        response = self.client.get(response.context['previous_url'])
+        self.assertEqual(response.context['pomodoro_list'], newest_first[:2])
+        self.assertIsNone(response.context['previous_url'])
+
+    @override_settings(POMODORO_PAGE_SIZE=1)
+    def test_tag_view_json_variant(self):
+        """
+        The JSON variant of the tag view should return the same page with its links.
+        """
+        create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
+        p2 = create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
+        response = self.client.get(reverse('Pymodoro:tag', args=('foo',)), {'format': 'json'})
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([p['id'] for p in data['pomodoros']], [p2.id])
+        self.assertIn('format=json', data['next'])
+        self.assertIsNone(data['previous'])
+
+    def test_tag_view_with_a_cursor_that_is_not_valid(self):
+        """
+        The tag view with a cursor that is not valid should return a 404 not found.
+        """
+        create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
+        response = self.client.get(reverse('Pymodoro:tag', args=('foo',)), {'after': 'foo'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tag_autocomplete_suggests_tags_of_the_user_by_prefix(self):
+        """
+        The tag autocomplete should return the names of the user's tags starting with what was typed, in order.
+        """
+        for name in ('food', 'foo', 'bar', 'fo'):
+            Tag.objects.named(self.u1, name)
+        Tag.objects.named(self.u2, 'fox')
+        response = self.client.get(reverse('Pymodoro:tag_autocomplete'), {'q': 'foo'})
+        self.assertEqual(json.loads(response.content), {'tags': ['foo', 'food']})
+        self.assertEqual(Tag.objects.autocomplete(self.u1, 'f', limit=2), ['fo', 'foo'])
+        self.assertEqual(Tag.objects.autocomplete(self.u1, ''), ['bar', 'fo', 'foo', 'food'])
+
+    def test_tags_are_unique_per_user(self):
+        """
+        Pomodoros of a user with the same tag name should share one tag, other users get their own.
+        """
+        p1 = create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
+        p2 = create_pomodoro(self.u1, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
+        p3 = create_pomodoro(self.u2, datetime.datetime.utcnow().replace(tzinfo=utc), 'foo')
+        self.assertEqual(p1.tag_id, p2.tag_id)
+        self.assertNotEqual(p1.tag_id, p3.tag_id)
+
+    def tearDown(self):
+        self.u1.delete()
+        self.u2.delete()
+
+class PomodoroSessionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.client.login(username='john_doe', password='john_doe')
+        self.u2 = create_user('jane_doe', 'jane_doe')
+
+    def test_start_view_returns_without_storing_a_pomodoro(self):
+        """
+        Starting a pomodoro should redirect at once with a running session and no pomodoro stored yet.
+        """
+        response = self.client.post(reverse('Pymodoro:index'), {'tag': 'foo'})
+        self.assertRedirects(response, reverse('Pymodoro:index'))
+        self.assertEqual(PomodoroSession.objects.running(self.u1).count(), 1)
+        self.assertEqual(Pomodoro.objects.filter(user=self.u1).count(), 0)
+
+    def test_start_view_with_a_running_session(self):
+        """
+        Starting a pomodoro while another one is running should display an error.
+        """
+        create_session(self.u1, timezone.now())
+        response = self.client.post(reverse('Pymodoro:index'), {'tag': 'bar'})
+        self.assertContains(response, "You already have a pomodoro running.", status_code=200)
+        self.assertEqual(PomodoroSession.objects.running(self.u1).count(), 1)
+
+    def test_index_view_completes_a_due_session(self):
+        """
+        A session whose time is up should be stored as a pomodoro ending at its scheduled end.
+        """
+        s = create_session(self.u1, timezone.now() - pomodoro_length() - datetime.timedelta(minutes=1))
+        response = self.client.get(reverse('Pymodoro:index'))
+        self.assertEqual(len(response.context['today_pomodoro_list']), 1)
+        self.assertEqual(response.context['today_pomodoro_list'][0].end_time, s.end_time)
+        self.assertEqual(PomodoroSession.objects.get(pk=s.pk).status, PomodoroSession.COMPLETED)
+
+    def test_complete_due_ignores_sessions_not_due(self):
+        """
+        complete_due() should only complete the sessions whose time is up.
+        """
+        create_session(self.u1, timezone.now())
+        create_session(self.u2, timezone.now() - pomodoro_length())
+        self.assertEqual(PomodoroSession.objects.complete_due(), 1)
+        self.assertEqual(Pomodoro.objects.filter(user=self.u1).count(), 0)
+        self.assertEqual(Pomodoro.objects.filter(user=self.u2).count(), 1)
+
+    def test_complete_twice_stores_one_pomodoro(self):
+        """
+        Completing a session twice should store its pomodoro only once.
+        """
+        s = create_session(self.u1, timezone.now() - pomodoro_length())
+        self.assertTrue(s.complete())
+        self.assertFalse(PomodoroSession.objects.get(pk=s.pk).complete())
+        self.assertEqual(Pomodoro.objects.filter(user=self.u1).count(), 1)
+
+    def test_end_session_view_before_time_abandons_it(self):
+        """
+        Ending a session before its time is up should abandon it without storing a pomodoro.
+        """
+        s = create_session(self.u1, timezone.now())
+        response = self.client.post(reverse('Pymodoro:end_session', args=(s.id,)))
+        self.assertRedirects(response, reverse('Pymodoro:index'))
+        self.assertEqual(PomodoroSession.objects.get(pk=s.pk).status, PomodoroSession.ABANDONED)
+        self.assertEqual(Pomodoro.objects.filter(user=self.u1).count(), 0)
+
+    def test_session_events_view_of_a_running_session(self):
+        """
+        The events of a running session should be a tick with the seconds left, and end at once.
+        """
+        s = create_session(self.u1, timezone.now() - datetime.timedelta(minutes=20))
+        with self.settings(POMODORO_STATUS_SECONDS=15):
+            response = self.client.get(reverse('Pymodoro:session_events', args=(s.id,)))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.streaming)
+        retry, tick = response.content.split('\n\n')[:2]
+        self.assertEqual(retry, 'retry: 15001')
+        self.assertIn('event: tick', tick)
+        self.assertEqual(json.loads(tick.split('data: ')[1])['remaining'], 300)
+
+    def test_session_events_view_of_a_due_session(self):
+        """
+        The events of a session whose time is up should complete it and announce it.
+        """
+        s = create_session(self.u1, timezone.now() - pomodoro_length())
+        response = self.client.get(reverse('Pymodoro:session_events', args=(s.id,)))
+        content = response.content
+        self.assertNotIn('event: tick', content)
+        self.assertIn('event: completed', content)
+        self.assertEqual(Pomodoro.objects.filter(user=self.u1).count(), 1)
+
+    def test_session_events_view_of_an_abandoned_session(self):
+        """
+        The events of an abandoned session should only announce it.
+        """
+        s = create_session(self.u1, timezone.now())
+        s.abandon()
+        response = self.client.get(reverse('Pymodoro:session_events', args=(s.id,)))
+        self.assertIn('event: abandoned', response.content)
+
+    def test_session_events_view_of_a_session_from_other_user(self):
+        """
+        The events of a session from other user should return a 404 not found.
+        """
+        s = create_session(self.u2, timezone.now())
+        response = self.client.get(reverse('Pymodoro:session_events', args=(s.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_end_session_view_of_a_session_from_other_user(self):
+        """
+        Ending a session from other user should return a 404 not found.
+        """
+        s = create_session(self.u2, timezone.now())
+        response = self.client.post(reverse('Pymodoro:end_session', args=(s.id,)))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(PomodoroSession.objects.get(pk=s.pk).status, PomodoroSession.RUNNING)
+
+    def tearDown(self):
+        self.u1.delete()
+        self.u2.delete()
+
+class PomodoroRollupTests(TestCase):
+
+    def setUp(self):
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.u2 = create_user('jane_doe', 'jane_doe')
+
+    def test_rollups_count_created_pomodoros(self):
+        """
+        Creating pomodoros should count them in the daily and tag rollups of their user.
+        """
+        create_pomodoro(self.u1, timezone.now(), 'foo')
+        create_pomodoro(self.u1, timezone.now(), 'bar')
+        create_pomodoro(self.u2, timezone.now(), 'foo')
+        self.assertEqual(rollups.today_count(self.u1), 2)
+        self.assertEqual(rollups.tag_count(Tag.objects.get(user=self.u1, name='foo')), 1)
+        self.assertEqual(DailyRollup.objects.get(user=self.u1, day=local_today()).minutes, 50)
+
+    def test_rollups_follow_a_changed_pomodoro(self):
+        """
+        Changing the tag and day of a pomodoro should move it between rollups.
+        """
+        p = create_pomodoro(self.u1, timezone.now(), 'foo')
+        p.tag = Tag.objects.named(self.u1, 'bar')
+        p.end_time -= datetime.timedelta(days=1)
+        p.save()
+        self.assertEqual(rollups.today_count(self.u1), 0)
+        self.assertEqual(rollups.day_count(self.u1, local_today() - datetime.timedelta(days=1)), 1)
+        self.assertEqual(rollups.tag_count(Tag.objects.get(user=self.u1, name='foo')), 0)
+        self.assertEqual(rollups.tag_count(Tag.objects.get(user=self.u1, name='bar')), 1)
+
+    def test_rollups_uncount_deleted_pomodoros(self):
+        """
+        Deleting a pomodoro should uncount it from its rollups.
+        """
+        create_pomodoro(self.u1, timezone.now(), 'foo')
+        Pomodoro.objects.get(user=self.u1).delete()
+        self.assertEqual(rollups.today_count(self.u1), 0)
+        self.assertEqual(rollups.tag_count(Tag.objects.get(user=self.u1, name='foo')), 0)
+        self.assertEqual(rollups.check(), [])
+
+    def test_check_and_rebuild_of_drifted_rollups(self):
+        """
+        check() should report rollups that differ from the pomodoros until they are rebuilt.
+        """
+        create_pomodoro(self.u1, timezone.now(), 'foo')
+        create_pomodoro(self.u2, timezone.now(), 'foo')
+        TagRollup.objects.filter(user=self.u1).update(count=5)
+        DailyRollup.objects.filter(user=self.u2).delete()
+        self.assertEqual(len(rollups.check()), 2)
+        self.assertEqual(len(rollups.check([self.u1])), 1)
+        self.assertRaises(CommandError, call_command, 'check_rollups', stdout=StringIO())
+        call_command('rebuild_rollups', 'john_doe', 'jane_doe', stdout=StringIO())
+        self.assertEqual(rollups.check(), [])
+        self.assertEqual(rollups.tag_count(Tag.objects.get(user=self.u1, name='foo')), 1)
+
+    def test_rollups_count_in_the_default_time_zone(self):
+        """
+        Pomodoros saved while another time zone is active should be counted on their day in the default one.
+        """
+        with timezone.override('America/New_York'):
+            pomodoro = create_pomodoro(self.u1, datetime.datetime(2013, 10, 1, 23, 30, tzinfo=utc), 'foo')
+            pomodoro.end_time += datetime.timedelta(minutes=10)
+            pomodoro.save()
+        self.assertEqual(list(DailyRollup.objects.filter(user=self.u1).values_list('day', 'count')),
+                         [(datetime.date(2013, 10, 2), 1)])
+        self.assertEqual(rollups.check(), [])
+        with timezone.override('America/New_York'):
+            rollups.rebuild()
+            self.assertEqual(rollups.check(), [])
+            pomodoro.delete()
+        self.assertFalse(DailyRollup.objects.filter(count__gt=0).exists())
+
+    def tearDown(self):
+        self.u1.delete()
+        self.u2.delete()
+
+class PomodoroTagMigrationTests(TestCase):
+
+    def setUp(self):
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.u2 = create_user('jane_doe', 'jane_doe')
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'The legacy tables are written for SQLite.')
+    def test_migrate_tags_moves_the_text_tags_to_tag_rows(self):
+        """
+        migrate_tags should replace the text tags of a database from before the Tag model with tag rows.
+        """
+        cursor = connection.cursor()
+        cursor.execute('DROP TABLE "Pymodoro_pomodoro"')
+        cursor.execute('CREATE TABLE "Pymodoro_pomodoro" ("id" integer NOT NULL PRIMARY KEY, '
+                       '"user_id" integer NOT NULL, "tag" varchar(200) NOT NULL, "end_time" datetime NOT NULL)')
+        cursor.execute('CREATE INDEX "Pymodoro_pomodoro_0d039d87" ON "Pymodoro_pomodoro" ("user_id", "tag", "end_time")')
+        cursor.execute('DROP TABLE "Pymodoro_tagrollup"')
+        cursor.execute('CREATE TABLE "Pymodoro_tagrollup" ("id" integer NOT NULL PRIMARY KEY, "user_id" integer NOT NULL, '
+                       '"tag" varchar(200) NOT NULL, "count" integer NOT NULL, "minutes" integer NOT NULL)')
+        for user, tag, end_time in ((self.u1, 'foo', '2013-10-01 10:00:00'), (self.u1, 'foo', '2013-10-01 11:00:00'),
+                                    (self.u1, 'bar', '2013-10-01 12:00:00'), (self.u2, 'foo', '2013-10-01 10:00:00')):
+            cursor.execute('INSERT INTO "Pymodoro_pomodoro" ("user_id", "tag", "end_time") VALUES (%s, %s, %s)',
+                           [user.id, tag, end_time])
+        # The rollups need the lengths of the pomodoros.
+        self.assertRaises(CommandError, call_command, 'migrate_tags', stdout=StringIO())
+        call_command('backfill_durations', stdout=StringIO())
+        call_command('migrate_tags', stdout=StringIO())
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertEqual(sorted(Pomodoro.objects.values_list('user__username', 'tag__name')),
+                         [('jane_doe', 'foo'), ('john_doe', 'bar'), ('john_doe', 'foo'), ('john_doe', 'foo')])
+        self.assertEqual(rollups.tag_count(Tag.objects.get(user=self.u1, name='foo')), 2)
+        self.assertEqual(rollups.check(), [])
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'The legacy tables are written for SQLite.')
+    def test_backfill_durations_fills_in_the_start_times(self):
+        """
+        backfill_durations should add the duration columns and indexes to a database from before them
+        and fill them in.
+        """
+        create_pomodoro(self.u1, datetime.datetime(2013, 10, 1, 10, 0, tzinfo=utc))
+        create_session(self.u2, datetime.datetime(2013, 10, 1, 10, 0, tzinfo=utc))
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN "
+                       "('Pymodoro_pomodoro', 'Pymodoro_pomodorosession') AND sql LIKE '%%end_time%%'")
+        for (index,) in cursor.fetchall():
+            cursor.execute('DROP INDEX "%s"' % index)
+        for table, columns in (('Pymodoro_pomodoro', ('start_time', 'duration')),
+                               ('Pymodoro_pomodorosession', ('duration', 'break_duration', 'end_time'))):
+            for column in columns:
+                cursor.execute('ALTER TABLE "%s" DROP COLUMN "%s"' % (table, column))
+        cursor.execute('INSERT INTO "Pymodoro_pomodoro" ("user_id", "tag_id", "end_time") '
+                       'SELECT "user_id", "tag_id", \'2013-10-01 11:00:00\' FROM "Pymodoro_pomodoro"')
+        out = StringIO()
+        call_command('backfill_durations', batch_size=1, stdout=out)
+        self.assertIn('2 pomodoros and the end time of 1 sessions', out.getvalue())
+        self.assertIn('Created 3 indexes.', out.getvalue())
+        plan = connection.cursor()
+        plan.execute('EXPLAIN QUERY PLAN SELECT id FROM "Pymodoro_pomodoro" WHERE "tag_id" = 1 AND "end_time" > 0')
+        self.assertIn('INDEX', ' '.join(row[-1] for row in plan.fetchall()))
+        self.assertEqual(PomodoroSession.objects.get().end_time, datetime.datetime(2013, 10, 1, 10, 25, tzinfo=utc))
+        self.assertEqual(PomodoroSession.objects.complete_due(), 1)
+        self.assertEqual([(p.init_time(), p.duration) for p in Pomodoro.objects.filter(user=self.u1).order_by('end_time')], [
+            (datetime.datetime(2013, 10, 1, 9, 35, tzinfo=utc), 25), (datetime.datetime(2013, 10, 1, 10, 35, tzinfo=utc), 25)])
+        create_session(self.u1, timezone.now())
+        self.assertEqual(PomodoroSession.objects.get(user=self.u1).duration, 25)
+        out = StringIO()
+        call_command('backfill_durations', stdout=out)
+        self.assertIn('Created 0 indexes.', out.getvalue())
+
     def tearDown(self):
         self.u1.delete()
-        self.u2.delete()
\ No newline at end of file
+        self.u2.delete()
+
+class PomodoroCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.client.login(username='john_doe', password='john_doe')
+
+    def test_index_view_reloads_hit_the_cache(self):
+        """
+        Reloading the index view should render today's list from the cache.
+        """
+        create_pomodoro(self.u1, timezone.now())
+        self.client.get(reverse('Pymodoro:index'))
+        self.assertEqual(caching.stats()['misses'], 2)
+        # Only the data version is read.
+        with self.assertNumQueries(1):
+            caching.today_list(self.u1)
+        response = self.client.get(reverse('Pymodoro:index'))
+        self.assertContains(response, "You have completed 1 pomodoro so far today.", status_code=200)
+        self.assertEqual(caching.stats(), {'hits': 3, 'misses': 2, 'ratio': 0.6})
+
+    def test_saving_a_pomodoro_invalidates_its_day(self):
+        """
+        Saving and deleting pomodoros should drop the cached list of their day.
+        """
+        self.client.get(reverse('Pymodoro:index'))
+        p = create_pomodoro(self.u1, timezone.now())
+        response = self.client.get(reverse('Pymodoro:index'))
+        self.assertContains(response, "You have completed 1 pomodoro so far today.", status_code=200)
+        p.delete()
+        response = self.client.get(reverse('Pymodoro:index'))
+        self.assertContains(response, "You have completed 0 pomodoros so far today.", status_code=200)
+
+    def test_moving_a_pomodoro_to_another_day_invalidates_both_days(self):
+        """
+        Moving a pomodoro out of today should drop today's cached list.
+        """
+        p = create_pomodoro(self.u1, timezone.now())
+        self.assertEqual(len(caching.today_list(self.u1)), 1)
+        p.end_time -= datetime.timedelta(days=1)
+        p.save()
+        self.assertEqual(len(caching.today_list(self.u1)), 0)
+
+    def test_cache_entries_are_per_day(self):
+        """
+        Entries of a past day should not be used today.
+        """
+        yesterday = local_today() - datetime.timedelta(days=1)
+        cache.set(caching.today_key(self.u1.id, yesterday, 0, 'list'), ['stale'])
+        self.assertEqual(caching.today_list(self.u1), [])
+
+    def test_entries_cached_before_a_write_committed_are_not_served(self):
+        """
+        A list cached by another process, or before a write committed, should be left under the old version.
+        """
+        version = caching.data_version(self.u1.id)
+        cache.set(caching.today_key(self.u1.id, local_today(), version, 'list'), ['stale'])
+        self.assertEqual(caching.today_list(self.u1), ['stale'])
+        p = create_pomodoro(self.u1, timezone.now())
+        self.assertEqual(caching.today_list(self.u1), [p])
+
+    def tearDown(self):
+        self.u1.delete()
+
+class PomodoroTransferTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.client.login(username='john_doe', password='john_doe')
+        self.u2 = create_user('jane_doe', 'jane_doe')
+
+    def test_export_view_streams_the_history_of_the_user(self):
+        """
+        The export view should stream the pomodoros of the logged user only, from newest to oldest.
+        """
+        dt = datetime.datetime(2013, 10, 1, 10, 0, tzinfo=utc)
+        create_pomodoro(self.u1, dt, 'foo')
+        create_pomodoro(self.u1, dt + datetime.timedelta(hours=1), 'fÓóÖ')
+        create_pomodoro(self.u2, dt, 'bar')
+        response = self.client.get(reverse('Pymodoro:export'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(b''.join(response.streaming_content).decode('utf-8').splitlines(),
+                         [u'tag,end_time,minutes', u'fÓóÖ,2013-10-01T11:00:00+00:00,25', u'foo,2013-10-01T10:00:00+00:00,25'])
+
+    def test_import_of_an_export_round_trips(self):
+        """
+        Importing an exported history should store the same pomodoros and keep the rollups consistent.
+        """
+        dt = datetime.datetime.utcnow().replace(tzinfo=utc)
+        for i in range(5):
+            create_pomodoro(self.u2, dt - datetime.timedelta(days=i), 'foo%d' % (i % 2))
+        for format in transfer.FORMATS:
+            Pomodoro.objects.filter(user=self.u1).delete()
+            lines = list(transfer.export_lines(self.u2, format))
+            self.assertEqual(transfer.import_lines(self.u1, lines, format, batch_size=2), 5)
+            self.assertEqual(sorted(Pomodoro.objects.filter(user=self.u1).values_list('tag__name', 'end_time')),
+                             sorted(Pomodoro.objects.filter(user=self.u2).values_list('tag__name', 'end_time')))
+            self.assertEqual(rollups.check(), [])
+        self.assertEqual(len(caching.today_list(self.u1)), 1)
+
+    def test_shuffled_import_reads_only_the_stored_pomodoros_near_its_rows(self):
+        """
+        An import in no order should check overlaps across batches while reading only the stored
+        pomodoros near those of each batch, not the whole history between them.
+        """
+        dt = datetime.datetime(2013, 10, 1, 10, 0, tzinfo=utc)
+        Pomodoro.objects.bulk_create([Pomodoro(user=self.u1, tag=Tag.objects.named(self.u1, 'old'),
+                                               end_time=dt + datetime.timedelta(days=i)) for i in range(1, 60)])
+        rows = [(dt + datetime.timedelta(days=i, hours=1 + j)).isoformat() for i in range(60) for j in range(2)]
+        random.Random(0).shuffle(rows)
+        read = []
+        check_overlaps = transfer.check_overlaps
+
+        def counting(batch):
+            with CaptureQueriesContext(connection) as queries:
+                check_overlaps(batch)
+            read.append(len(queries))
+
+        transfer.check_overlaps = counting
+        try:
+            self.assertEqual(transfer.import_lines(self.u1, ['tag,end_time\n'] + ['foo,%s\n' % row for row in rows],
+                                                   batch_size=10), 120)
+        finally:
+            transfer.check_overlaps = check_overlaps
+        # Every batch has rows of about ten days, each read on its own.
+        self.assertTrue(all(5 <= queries <= 10 for queries in read), read)
+        stored = Pomodoro.objects.filter(user=self.u1).overlapping(dt, dt + datetime.timedelta(days=61))
+        self.assertEqual(stored.count(), 179)
+        lines = ['tag,end_time\n'] + ['foo,%s\n' % row for row in rows[:30]] + ['foo,%s\n' % rows[3]]
+        with self.assertRaisesRegexp(ValueError, 'overlaps'):
+            transfer.import_lines(self.u2, lines, batch_size=10)
+        self.assertEqual(Pomodoro.objects.filter(user=self.u2).count(), 0)
+
+    def test_import_with_a_row_that_is_not_valid_stores_nothing(self):
+        """
+        An import with a row that is not valid should fail on its line and store no pomodoro.
+        """
+        lines = ['tag,end_time\n', 'foo,2013-10-01T10:00:00+00:00\n', ',2013-10-01T11:00:00+00:00\n']
+        with self.assertRaisesRegexp(ValueError, 'Line 3'):
+            transfer.import_lines(self.u1, lines, 'csv', batch_size=1)
+        self.assertEqual(Pomodoro.objects.filter(user=self.u1).count(), 0)
+        self.assertEqual(rollups.check(), [])
+
+    def test_import_view(self):
+        """
+        The import view should store the uploaded history for the logged user.
+        """
+        upload = SimpleUploadedFile('pomodoros.ndjson', b'{"tag": "foo", "end_time": "2013-10-01T10:00:00"}\n')
+        response = self.client.post(reverse('Pymodoro:import'), {'file': upload})
+        self.assertEqual(json.loads(response.content), {'imported': 1})
+        self.assertEqual(Pomodoro.objects.get(user=self.u1).tag.name, 'foo')
+
+    def test_import_view_with_a_date_that_is_not_valid(self):
+        """
+        The import view should reject an upload with a date that is not valid.
+        """
+        upload = SimpleUploadedFile('pomodoros.csv', b'tag,end_time\nfoo,yesterday\n')
+        response = self.client.post(reverse('Pymodoro:import'), {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 2', json.loads(response.content)['error'])
+
+    def tearDown(self):
+        self.u1.delete()
+        self.u2.delete()
+
+class PomodoroStatsTests(TestCase):
+
+    def setUp(self):
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.client.login(username='john_doe', password='john_doe')
+        self.u2 = create_user('jane_doe', 'jane_doe')
+        # Three pomodoros on Wednesday 2 October 2013 and one the next day, local time.
+        tz = timezone.get_current_timezone()
+        for day, hour, tag in ((2, 0, 'foo'), (2, 23, 'foo'), (2, 23, 'bar'), (3, 9, 'foo')):
+            create_pomodoro(self.u1, timezone.make_aware(datetime.datetime(2013, 10, day, hour, 30), tz), tag)
+        create_pomodoro(self.u2, timezone.make_aware(datetime.datetime(2013, 10, 2, 9, 30), tz))
+
+    def test_period_counts_in_local_days(self):
+        """
+        period_counts() should count the pomodoros of the user per local day, week and month.
+        """
+        self.assertEqual(stats.period_counts(self.u1, 'day'), [
+            {'start': '2013-10-02', 'count': 3, 'minutes': 75},
+            {'start': '2013-10-03', 'count': 1, 'minutes': 25}])
+        self.assertEqual(stats.period_counts(self.u1, 'week'), [{'start': '2013-09-30', 'count': 4, 'minutes': 100}])
+        self.assertEqual(stats.period_counts(self.u1, 'month'), [{'start': '2013-10-01', 'count': 4, 'minutes': 100}])
+        self.assertEqual(stats.period_counts(self.u1, 'day', since=datetime.date(2013, 10, 3)),
+                         [{'start': '2013-10-03', 'count': 1, 'minutes': 25}])
+
+    def test_tag_breakdown(self):
+        """
+        tag_breakdown() should count the pomodoros of the user per tag, most used first.
+        """
+        self.assertEqual([(row['tag'], row['count']) for row in stats.tag_breakdown(self.u1)], [('foo', 3), ('bar', 1)])
+
+    def test_hour_heatmap(self):
+        """
+        hour_heatmap() should count the pomodoros of the user per local weekday and hour.
+        """
+        heatmap = stats.hour_heatmap(self.u1)
+        self.assertEqual((heatmap[2][0], heatmap[2][23], heatmap[3][9]), (1, 2, 1))
+        self.assertEqual(sum(sum(hours) for hours in heatmap), 4)
+
+    def test_stats_in_other_time_zone(self):
+        """
+        Statistics in a time zone other than the rollups' one should be grouped by the database in that zone.
+        """
+        with timezone.override('UTC'):
+            self.assertEqual([(row['start'], row['count']) for row in stats.period_counts(self.u1, 'day')],
+                             [('2013-10-01', 1), ('2013-10-02', 2), ('2013-10-03', 1)])
+            heatmap = stats.hour_heatmap(self.u1)
+        self.assertEqual((heatmap[1][22], heatmap[2][21], heatmap[3][7]), (1, 2, 1))
+
+    def test_streaks(self):
+        """
+        streaks() should find the longest run of days and whether it is still going on.
+        """
+        self.assertEqual(stats.streaks(self.u1), {'current': 0, 'longest': 2, 'last_day': '2013-10-03'})
+        create_pomodoro(self.u1, timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(stats.streaks(self.u1)['current'], 1)
+
+    def test_stats_view(self):
+        """
+        The stats view should return the statistics of the logged user as JSON.
+        """
+        response = self.client.get(reverse('Pymodoro:stats', args=('month',)))
+        self.assertEqual(json.loads(response.content), {'kind': 'month', 'results': [
+            {'start': '2013-10-01', 'count': 4, 'minutes': 100}]})
+
+    def test_stats_view_with_a_date_that_is_not_valid(self):
+        """
+        The stats view should reject since and until values that are not dates.
+        """
+        response = self.client.get(reverse('Pymodoro:stats', args=('day',)), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def tearDown(self):
+        self.u1.delete()
+        self.u2.delete()
+
+class PomodoroApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.u2 = create_user('jane_doe', 'jane_doe')
+        response = self.client.post(reverse('Pymodoro:api_token'), {'username': 'john_doe', 'password': 'john_doe'})
+        self.auth = {'HTTP_AUTHORIZATION': 'Token %s' % json.loads(response.content)['token']}
+
+    def post_json(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json', **self.auth)
+
+    def test_api_without_a_valid_token(self):
+        """
+        The API should answer 401 to requests without a valid token, a session is not enough.
+        """
+        self.client.login(username='john_doe', password='john_doe')
+        self.assertEqual(self.client.get(reverse('Pymodoro:api_pomodoros')).status_code, 401)
+        response = self.client.get(reverse('Pymodoro:api_pomodoros'), HTTP_AUTHORIZATION='Token foo')
+        self.assertEqual(response.status_code, 401)
+
+    def test_api_creates_and_lists_pomodoros_of_the_user(self):
+        """
+        A pomodoro created through the API should be listed and shown to its user only.
+        """
+        response = self.post_json(reverse('Pymodoro:api_pomodoros'), {'tag': 'foo', 'end_time': '2013-10-01T10:00:00Z'})
+        self.assertEqual(response.status_code, 201)
+        pomodoro = json.loads(response.content)
+        self.assertEqual(pomodoro['tag'], 'foo')
+        create_pomodoro(self.u2, timezone.now())
+        response = self.client.get(reverse('Pymodoro:api_pomodoros'), **self.auth)
+        self.assertEqual(json.loads(response.content), {'pomodoros': [pomodoro], 'next': None, 'previous': None})
+        response = self.client.get(reverse('Pymodoro:api_pomodoro', args=(pomodoro['id'],)), **self.auth)
+        self.assertEqual(json.loads(response.content), pomodoro)
+        p = Pomodoro.objects.get(user=self.u2)
+        response = self.client.get(reverse('Pymodoro:api_pomodoro', args=(p.id,)), **self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_batch_stores_all_or_nothing(self):
+        """
+        The batch endpoint should store every queued pomodoro, or none if one is not valid.
+        """
+        pomodoros = [{'tag': 'foo', 'end_time': '2013-10-01T10:00:00Z'}, {'tag': 'bar', 'end_time': '2013-10-01T11:00:00Z'}]
+        response = self.post_json(reverse('Pymodoro:api_batch'), {'pomodoros': pomodoros + [{'tag': 'foo'}]})
+        self.assertEqual(json.loads(response.content), {'imported': 3})
+        response = self.post_json(reverse('Pymodoro:api_batch'), {'pomodoros': pomodoros + [{'end_time': 'now'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Pomodoro 3', json.loads(response.content)['error'])
+        self.assertEqual(Pomodoro.objects.filter(user=self.u1).count(), 3)
+        response = self.client.get(reverse('Pymodoro:api_tags'), **self.auth)
+        self.assertEqual([(t['name'], t['count']) for t in json.loads(response.content)['tags']], [('foo', 2), ('bar', 1)])
+        self.assertEqual(rollups.check(), [])
+
+    def test_api_lists_are_not_sent_again_until_they_change(self):
+        """
+        A list requested with the ETag of its last response should be a 304 until a pomodoro of the user changes.
+        """
+        url = reverse('Pymodoro:api_stats', args=('day',))
+        etag = self.client.get(url, **self.auth)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth).status_code, 304)
+        create_pomodoro(self.u2, timezone.now())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth).status_code, 304)
+        create_pomodoro(self.u1, timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['results'][0]['count'], 1)
+
+    def test_api_etags_come_from_the_database(self):
+        """
+        ETags should not depend on what a process has cached, and change with the user's change log.
+        """
+        url = reverse('Pymodoro:api_tags')
+        etag = self.client.get(url, **self.auth)['ETag']
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth).status_code, 304)
+        create_pomodoro(self.u1, timezone.now())
+        self.assertEqual(caching.data_version(self.u1.id), 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth).status_code, 200)
+
+    def tearDown(self):
+        self.u1.delete()
+        self.u2.delete()
+
+class PomodoroSyncTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.u1 = create_user('john_doe', 'john_doe')
+        self.u2 = create_user('jane_doe', 'jane_doe')
+        response = self.client.post(reverse('Pymodoro:api_token'), {'username': 'john_doe', 'password': 'john_doe'})
+        self.auth = {'HTTP_AUTHORIZATION': 'Token %s' % json.loads(response.content)['token']}
+
+    def test_changes_since_a_cursor(self):
+        """
+        changes_since() should return only what changed after the cursor, each pomodoro once.
+        """
+        p1 = create_pomodoro(self.u1, timezone.now())
+        p2 = create_pomodoro(self.u1, timezone.now())
+        create_pomodoro(self.u2, timezone.now())
+        delta = sync.changes_since(self.u1)
+        self.assertEqual([p.id for p in delta['saved']], [p1.id, p2.id])
+        self.assertEqual(delta['cursor'], 2)
+        p1.end_time -= datetime.timedelta(hours=1)
+        p1.save()
+        p1.save()
+        deleted_id = p2.id
+        p2.delete()
+        delta = sync.changes_since(self.u1, 2)
+        self.assertEqual([(p.id, p.seq) for p in delta['saved']], [(p1.id, 4)])
+        self.assertEqual(delta['deleted'], [deleted_id])
+        self.assertEqual((delta['cursor'], delta['more'], delta['reset']), (5, False, False))
+        self.assertEqual(sync.changes_since(self.u1, 5)['saved'], [])
+
+    def test_imports_are_logged(self):
+        """
+        Pomodoros stored by a bulk import should be in the change log.
+        """
+        now = timezone.now()
+        transfer.import_pomodoros(self.u1, [('foo', now, 25), ('bar', now - pomodoro_length(), 25)], batch_size=1)
+        self.assertEqual(sorted(p.tag.name for p in sync.changes_since(self.u1)['saved']), ['bar', 'foo'])
+
+    def test_imports_log_only_their_own_pomodoros(self):
+        """
+        A pomodoro saved by the user while an import runs should be logged once, by its own save.
+        """
+        now = timezone.now()
+
+        def rows():
+            yield 'foo', now - pomodoro_length() * 4, 25
+            create_pomodoro(self.u1, now - pomodoro_length() * 2, 'bar')
+            yield 'foo', now, 25
+        transfer.import_pomodoros(self.u1, rows(), batch_size=1)
+        logged = sorted(Change.objects.filter(user=self.u1).values_list('pomodoro_id', flat=True))
+        self.assertEqual(logged, sorted(Pomodoro.objects.filter(user=self.u1).values_list('id', flat=True)))
+
+    def test_sync_endpoint_applies_changes_and_reports_conflicts(self):
+        """
+        A change based on an older change of the pomodoro should lose to it, the others should apply in order.
+        """
+        p = create_pomodoro(self.u1, timezone.now())
+        response = self.client.post(reverse('Pymodoro:api_sync'), json.dumps({'cursor': 0, 'changes': [
+            {'op': 'update', 'id': p.id, 'base_seq': 1, 'tag': 'bar', 'end_time': '2013-10-01T10:00:00Z'},
+            {'op': 'delete', 'id': p.id, 'base_seq': 1},
+            {'op': 'create', 'tag': 'foo', 'end_time': '2013-10-01T11:00:00Z'},
+        ]}), content_type='application/json', **self.auth)
+        data = json.loads(response.content)
+        created = Pomodoro.objects.get(user=self.u1, tag__name='foo')
+        self.assertEqual(data['results'], [{'result': 'update', 'id': p.id}, {'result': 'conflict', 'id': p.id},
+                                           {'result': 'create', 'id': created.id}])
+        self.assertEqual([(s['id'], s['tag'], s['seq']) for s in data['saved']], [(p.id, 'bar', 2), (created.id, 'foo', 3)])
+        self.assertEqual(data['cursor'], 3)
+        response = self.client.get(reverse('Pymodoro:api_sync'), {'cursor': 3}, **self.auth)
+        self.assertEqual(json.loads(response.content)['saved'], [])
+
+    def test_compaction_keeps_the_latest_changes(self):
+        """
+        compact() should drop superseded changes and old deletes, sending older cursors to a full sync.
+        """
+        p1 = create_pomodoro(self.u1, timezone.now())
+        p2 = create_pomodoro(self.u1, timezone.now())
+        p1.save()
+        p2.delete()
+        self.assertEqual(sync.compact(), 2)
+        self.assertEqual(sorted(Change.objects.values_list('seq', flat=True)), [3, 4])
+        Change.objects.filter(deleted=True).update(time=timezone.now() - datetime.timedelta(days=31))
+        call_command('compact_changes', stdout=StringIO())
+        delta = sync.changes_since(self.u1, 1)
+        self.assertTrue(delta['reset'])
+        self.assertEqual(([p.id for p in delta['saved']], delta['deleted']), ([p1.id], []))
+        self.assertFalse(sync.changes_since(self.u1, 4)['reset'])
+
+    def test_a_failed_user_deletion_keeps_logging_the_user(self):
+        """
+        Changes of a user whose deletion failed should still be logged afterwards.
+        """
+        create_pomodoro(self.u1, timezone.now())
+        def fail(sender, **kwargs):
+            raise RuntimeError('Deletion failed.')
+        post_delete.connect(fail, sender=Pomodoro)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.u1.delete()
+        finally:
+            post_delete.disconnect(fail, sender=Pomodoro)
+        create_pomodoro(self.u1, timezone.now())
+        self.assertEqual(sync.changes_since(self.u1)['cursor'], 2)
+
+    def test_seed_logs_pomodoros_missing_from_the_log(self):
+        """
+        seed() should log the pomodoros stored before the change log, and only those.
+        """
+        create_pomodoro(self.u1, timezone.now())
+        create_pomodoro(self.u2, timezone.now())
+        Change.objects.filter(user=self.u2).delete()
+        self.assertEqual(sync.seed(), 1)
+        self.assertEqual(len(sync.changes_since(self.u2)['saved']), 1)
+
+    def tearDown(self):
+        self.u1.delete()
+        self.u2.delete()
+        self.assertEqual(Change.objects.count(), 0)
+
+class PomodoroAdminTests(TestCase):
+
+    # Session, user, count estimate, exact count below the threshold and results.
+    MAX_CHANGELIST_QUERIES = 5
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.users = [create_user('user%d' % i, 'user%d' % i) for i in range(3)]
+
+    def changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:Pymodoro_pomodoro_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_changelist_queries_do_not_grow_with_the_rows(self):
+        """
+        The changelist should issue a fixed number of queries, whatever the number of pomodoros and users.
+        """
+        for user in self.users:
+            create_pomodoro(user, timezone.now())
+        few, response = self.changelist_queries()
+        self.assertLessEqual(few, self.MAX_CHANGELIST_QUERIES)
+        self.users += [create_user('other%d' % i, 'other%d' % i) for i in range(10)]
+        for user in self.users:
+            create_pomodoro(user, timezone.now() - datetime.timedelta(days=1), 'bar')
+        many, response = self.changelist_queries()
+        self.assertEqual(many, few)
+        self.assertEqual(many, self.changelist_queries(q='bar')[0] - 1)
+
+    def test_changelist_computes_is_from_today_in_the_database(self):
+        """
+        The changelist should mark the pomodoros from today with the database annotation.
+        """
+        create_pomodoro(self.users[0], timezone.now())
+        create_pomodoro(self.users[0], timezone.now() - datetime.timedelta(days=1))
+        queries, response = self.changelist_queries()
+        self.assertEqual(sorted(p.ended_today for p in response.context['cl'].result_list), [False, True])
+
+    def test_changelist_searches_tags_through_the_index(self):
+        """
+        The changelist search should find pomodoros by the start of the words of their tag, ignoring
+        case and accents, through the tag search index where there is one.
+        """
+        create_pomodoro(self.users[0], timezone.now(), u'Café reading')
+        create_pomodoro(self.users[1], timezone.now(), u'Deep work')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:Pymodoro_pomodoro_changelist'), {'q': u'cafe'})
+        self.assertEqual([p.tag.name for p in response.context['cl'].result_list], [u'Café reading'])
+        if search.indexed(connection):
+            self.assertTrue(any(search.TABLE in query['sql'] or 'pymodoro_fold' in query['sql']
+                                for query in queries.captured_queries))
+        response = self.client.get(reverse('admin:Pymodoro_pomodoro_changelist'), {'q': u'ork'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_changelist_queryset_follows_the_default_manager(self):
+        """
+        The changelist should list the pomodoros of the default manager's queryset, from its database.
+        """
+        create_pomodoro(self.users[0], timezone.now())
+        create_pomodoro(self.users[1], timezone.now())
+        manager = Pomodoro._default_manager
+        scoped = manager.db_manager('default')
+        scoped.get_queryset = lambda: manager.db_manager('default').get_queryset().filter(user=self.users[0])
+        Pomodoro._default_manager = scoped
+        try:
+            request = RequestFactory().get(reverse('admin:Pymodoro_pomodoro_changelist'))
+            request.user = self.admin
+            pomodoros = admin.site._registry[Pomodoro].get_queryset(request)
+        finally:
+            Pomodoro._default_manager = manager
+        self.assertIsInstance(pomodoros, EstimatedCountQuerySet)
+        self.assertEqual(pomodoros._db, 'default')
+        self.assertEqual([p.user for p in pomodoros], [self.users[0]])
+        self.assertEqual(pomodoros.count(), 1)
+
+    def test_count_of_a_big_table_is_estimated(self):
+        """
+        Unfiltered counts should come from the database statistics above the threshold, filtered ones should be exact.
+        """
+        create_pomodoro(self.users[0], timezone.now())
+        pomodoros = EstimatedCountQuerySet(Pomodoro)
+        self.assertEqual(pomodoros.count(), 1)
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            cursor.execute('ANALYZE')
+            cursor.execute('UPDATE sqlite_stat1 SET stat = %s WHERE tbl = %s', ['%d 1' % ESTIMATE_THRESHOLD, Pomodoro._meta.db_table])
+            self.assertEqual(pomodoros.count(), ESTIMATE_THRESHOLD)
+            self.assertEqual(pomodoros.filter(user=self.users[0]).count(), 1)
+
+@override_settings(POMODORO_METRICS_SAMPLE_RATE=1)
+class PomodoroInstrumentationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.reset()
+        self.u1 = create_user('john_doe', 'john_doe')
+        User.objects.filter(pk=self.u1.pk).update(is_staff=True)
+        self.client.login(username='john_doe', password='john_doe')
+
+    def test_sampled_requests_have_a_server_timing_header(self):
+        """
+        A sampled request should report its total, database, template and cache timings.
+        """
+        response = self.client.get(reverse('Pymodoro:index'))
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'tpl;dur=', 'cache;desc="0 hits, 2 misses"', 'today;dur='):
+            self.assertIn(metric, timing)
+        with override_settings(POMODORO_METRICS_SAMPLE_RATE=0):
+            self.assertFalse(self.client.get(reverse('Pymodoro:index')).has_header('Server-Timing'))
+
+    @override_settings(POMODORO_METRICS_TOKEN='s3cret')
+    def test_server_timing_is_only_sent_to_staff_or_with_the_metrics_token(self):
+        """
+        Other users should not see the timings of their requests, whatever their address, unless
+        POMODORO_SERVER_TIMING is on.
+        """
+        User.objects.filter(pk=self.u1.pk).update(is_staff=False)
+        self.assertFalse(self.client.get(reverse('Pymodoro:index'), REMOTE_ADDR='127.0.0.1').has_header('Server-Timing'))
+        self.assertFalse(self.client.get(reverse('Pymodoro:index'),
+                                         HTTP_AUTHORIZATION='Bearer wrong').has_header('Server-Timing'))
+        self.assertEqual(self.client.get(reverse('Pymodoro:metrics')).status_code, 404)
+        self.assertTrue(self.client.get(reverse('Pymodoro:index'),
+                                        HTTP_AUTHORIZATION='Bearer s3cret').has_header('Server-Timing'))
+        with override_settings(POMODORO_SERVER_TIMING=True):
+            self.assertTrue(self.client.get(reverse('Pymodoro:index')).has_header('Server-Timing'))
+        User.objects.filter(pk=self.u1.pk).update(is_staff=True)
+        self.assertTrue(self.client.get(reverse('Pymodoro:index')).has_header('Server-Timing'))
+        self.assertIn('pymodoro_request_duration_seconds_count{view="Pymodoro.views.index"} 5',
+                      self.client.get(reverse('Pymodoro:metrics')).content.decode('utf-8'))
+        self.client.logout()
+        response = self.client.get(reverse('Pymodoro:metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_endpoint_has_histograms_per_view(self):
+        """
+        The metrics endpoint should expose the sampled requests as Prometheus histograms per view.
+        """
+        self.client.get(reverse('Pymodoro:index'))
+        self.client.get(reverse('Pymodoro:index'))
+        metrics = self.client.get(reverse('Pymodoro:metrics')).content.decode('utf-8')
+        self.assertIn('# TYPE pymodoro_request_duration_seconds histogram', metrics)
+        self.assertIn('pymodoro_request_duration_seconds_count{view="Pymodoro.views.index"} 2', metrics)
+        self.assertIn('pymodoro_db_queries_bucket{view="Pymodoro.views.index",le="+Inf"} 2', metrics)
+        self.assertIn('pymodoro_cache_requests_total{view="Pymodoro.views.index",result="hit"} 2', metrics)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('Pymodoro:metrics')).status_code, 404)
+
+    def tearDown(self):
+        self.u1.delete()
+
+class PomodoroLeaderboardTests(TestCase):
+
+    def setUp(self):
+        self.users = [create_user('user%d' % i, 'user%d' % i) for i in range(4)]
+        self.team = Team.objects.create(name='team')
+        for user in self.users[:3]:
+            Membership.objects.create(team=self.team, user=user)
+
+    def complete(self, user, count):
+        for i in range(count):
+            create_pomodoro(user, timezone.now())
+
+    def test_leaderboard_follows_completed_and_deleted_pomodoros(self):
+        """
+        The leaderboards should rank the members as they complete pomodoros, ties sharing a rank.
+        """
+        self.complete(self.users[0], 2)
+        self.complete(self.users[1], 3)
+        self.complete(self.users[2], 2)
+        self.complete(self.users[3], 5)
+        self.assertEqual([(row['username'], row['rank'], row['count']) for row in leaderboards.top(self.team, TeamScore.DAY)],
+                         [('user1', 1, 3), ('user0', 2, 2), ('user2', 2, 2)])
+        self.assertEqual(leaderboards.rank(self.team, self.users[2], TeamScore.WEEK), (2, 2))
+        Pomodoro.objects.filter(user=self.users[1])[0].delete()
+        Pomodoro.objects.filter(user=self.users[1])[0].delete()
+        self.assertEqual(leaderboards.rank(self.team, self.users[1], TeamScore.DAY), (3, 1))
+        self.assertEqual(leaderboards.rank(self.team, self.users[3], TeamScore.DAY), (None, 0))
+
+    def test_joining_and_leaving_a_team(self):
+        """
+        A new member should bring the pomodoros they completed before, and take them away on leaving.
+        """
+        self.complete(self.users[3], 2)
+        transfer.import_pomodoros(self.users[3], [('foo', timezone.now() - datetime.timedelta(minutes=30), 25)])
+        membership = Membership.objects.create(team=self.team, user=self.users[3])
+        self.assertEqual(leaderboards.rank(self.team, self.users[3], TeamScore.WEEK), (1, 3))
+        transfer.import_pomodoros(self.users[3], [('foo', timezone.now() - datetime.timedelta(minutes=60), 25)])
+        self.assertEqual(leaderboards.rank(self.team, self.users[3], TeamScore.DAY), (1, 4))
+        stored = sorted(TeamScore.objects.values_list('user', 'period', 'start', 'count'))
+        leaderboards.rebuild()
+        self.assertEqual(sorted(TeamScore.objects.values_list('user', 'period', 'start', 'count')), stored)
+        membership.delete()
+        self.assertEqual(leaderboards.top(self.team, TeamScore.DAY), [])
+
+    def test_leaderboard_of_a_team_of_the_user_only(self):
+        """
+        The leaderboard view and API should be there for members of the team only.
+        """
+        self.complete(self.users[0], 1)
+        self.client.login(username='user0', password='user0')
+        response = self.client.get(reverse('Pymodoro:leaderboard', args=(self.team.id, 'week')))
+        self.assertEqual(json.loads(response.content)['me'], {'rank': 1, 'count': 1})
+        self.client.login(username='user3', password='user3')
+        response = self.client.get(reverse('Pymodoro:leaderboard', args=(self.team.id, 'week')))
+        self.assertEqual(response.status_code, 404)
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % ApiToken.objects.for_user(self.users[3]).key}
+        self.assertEqual(json.loads(self.client.get(reverse('Pymodoro:api_teams'), **auth).content), {'teams': []})
+        response = self.client.get(reverse('Pymodoro:api_leaderboard', args=(self.team.id, 'day')), **auth)
+        self.assertEqual(response.status_code, 404)
+
+class PomodoroJobTests(TestCase):
+
+    def setUp(self):
+        self.u1 = create_user()
+        self.u1.email = 'john@example.com'
+        self.u1.save()
+        self.past = timezone.now() - datetime.timedelta(minutes=1)
+
+    def test_due_jobs_run_in_batches_and_periodic_ones_come_back(self):
+        """
+        run_due() should run every due job, batch after batch, and leave the later ones queued.
+        """
+        for i in range(5):
+            Job.objects.schedule('purge_jobs', self.past)
+        later = Job.objects.schedule_once('compact_changes', timezone.now() + datetime.timedelta(hours=1))
+        self.assertEqual(jobs.run_due(batch_size=2), 5)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 5)
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.PENDING)
+        # The periodic job that ran is queued once more, at the next midnight.
+        self.assertEqual(Job.objects.filter(status=Job.PENDING, name='purge_jobs').count(), 1)
+        self.assertEqual(jobs.schedule_periodic(), ['complete_sessions', 'daily_summaries', 'repair_rollups'])
+
+    def test_failed_jobs_are_retried_then_given_up(self):
+        """
+        A job that raises should be retried later, up to POMODORO_JOB_ATTEMPTS times.
+        """
+        jobs.HANDLERS['fail'] = lambda: 1 / 0
+        try:
+            job = Job.objects.schedule('fail', self.past)
+            with override_settings(POMODORO_JOB_ATTEMPTS=2):
+                self.assertEqual(jobs.run_due(), 1)
+                job = Job.objects.get(pk=job.pk)
+                self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+                self.assertGreater(job.run_at, timezone.now())
+                self.assertIn('ZeroDivisionError', job.last_error)
+                Job.objects.filter(pk=job.pk).update(run_at=self.past)
+                jobs.run_due()
+        finally:
+            del jobs.HANDLERS['fail']
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+        unknown = Job.objects.schedule('unknown', self.past)
+        jobs.run_due()
+        self.assertEqual(Job.objects.get(pk=unknown.pk).status, Job.FAILED)
+
+    def test_stalled_jobs_are_claimed_again(self):
+        """
+        A job whose worker stopped should go back to the queue once its lock expires.
+        """
+        job = Job.objects.schedule('compact_changes', self.past)
+        self.assertEqual(jobs.claim(), [job])
+        self.assertEqual(jobs.claim(), [])
+        Job.objects.filter(pk=job.pk).update(locked_until=self.past)
+        self.assertEqual(jobs.run_due(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+
+    def test_periodic_jobs_are_queued_once(self):
+        """
+        A periodic job should not be queued again while it is pending or running, whoever queues it.
+        """
+        self.assertEqual(jobs.schedule_periodic(self.past), sorted(jobs.PERIODIC))
+        self.assertEqual(jobs.schedule_periodic(self.past), [])
+        self.assertIsNone(Job.objects.schedule_once('purge_jobs'))
+        claimed = jobs.claim()
+        self.assertEqual(jobs.schedule_periodic(), [])
+        for job in claimed:
+            jobs.run_job(job)
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), len(jobs.PERIODIC))
+        self.assertEqual(jobs.schedule_periodic(), [])
+
+    def test_running_jobs_keep_their_lock(self):
+        """
+        A worker pushing the lock of its job forward should keep it from being claimed again.
+        """
+        job = Job.objects.schedule('daily_summaries', self.past)
+        job = jobs.claim()[0]
+        Job.objects.filter(pk=job.pk).update(locked_until=self.past)
+        self.assertTrue(jobs.extend_lock(job))
+        self.assertEqual(jobs.requeue_stalled(), 0)
+        self.assertEqual(jobs.claim(), [])
+        Job.objects.filter(pk=job.pk).update(locked_until=self.past)
+        self.assertEqual(jobs.requeue_stalled(), 1)
+        self.assertFalse(jobs.extend_lock(job))
+        with jobs.keeping_locked(job):
+            pass
+
+    def test_jobs_waiting_in_a_batch_past_their_lock_are_not_run_twice(self):
+        """
+        A job whose lock ran out while it waited in a batch should be left to the worker that claimed it since.
+        """
+        ran = []
+        jobs.HANDLERS['count'] = lambda n: ran.append(n)
+        try:
+            for n in range(2):
+                Job.objects.schedule('count', self.past, n=n)
+            slow = jobs.claim()
+            # The first job outlasts the timeout, meanwhile another worker gives back and claims the second.
+            jobs.run_job(slow[0])
+            Job.objects.filter(pk=slow[1].pk).update(locked_until=self.past)
+            self.assertEqual(jobs.requeue_stalled(), 1)
+            other = jobs.claim()
+            self.assertEqual(other, [slow[1]])
+            self.assertIsNone(jobs.run_job(slow[1]))
+            self.assertEqual(jobs.run_job(other[0]), Job.DONE)
+            # Past its lock but given to nobody, a waiting job still runs.
+            Job.objects.schedule('count', self.past, n=2)
+            late = jobs.claim()[0]
+            Job.objects.filter(pk=late.pk).update(locked_until=self.past)
+            self.assertEqual(jobs.run_job(late), Job.DONE)
+        finally:
+            del jobs.HANDLERS['count']
+        self.assertEqual(ran, [0, 1, 2])
+
+    def test_sessions_are_completed_and_breaks_reminded(self):
+        """
+        The background jobs should store due pomodoros and mail the user when their break is over.
+        """
+        session = create_session(self.u1, timezone.now() - pomodoro_length() - datetime.timedelta(minutes=1))
+        create_session(create_user('jane_doe'), timezone.now() - pomodoro_length())
+        Job.objects.schedule('complete_sessions', self.past)
+        call_command('run_jobs', once=True, workers=1, stdout=StringIO())
+        self.assertEqual(Pomodoro.objects.count(), 2)
+        self.assertEqual(PomodoroSession.objects.get(pk=session.pk).status, PomodoroSession.COMPLETED)
+        reminder = Job.objects.get(name='break_reminder')
+        self.assertEqual(reminder.run_at, session.end_time + datetime.timedelta(minutes=5))
+        self.assertEqual(mail.outbox, [])
+        Job.objects.filter(pk=reminder.pk).update(run_at=self.past)
+        jobs.run_due()
+        self.assertEqual([message.to for message in mail.outbox], [['john@example.com']])
+
+    def test_daily_summaries(self):
+        """
+        The daily summaries should mail the users with pomodoros on the day their counts, one job
+        per user, so a retry does not mail the others again.
+        """
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        create_pomodoro(self.u1, yesterday)
+        create_pomodoro(self.u1, yesterday)
+        jane = create_user('jane_doe')
+        jane.email = 'jane@example.com'
+        jane.save()
+        create_pomodoro(jane, yesterday)
+        create_pomodoro(create_user('jim_doe'), yesterday)
+        Job.objects.schedule('daily_summaries', self.past)
+        send_mail = jobs.send_mail
+
+        def fail_for_jane(subject, message, sender, recipients):
+            if recipients == ['jane@example.com'] and not hasattr(fail_for_jane, 'failed'):
+                fail_for_jane.failed = True
+                raise IOError('Connection refused.')
+            return send_mail(subject, message, sender, recipients)
+
+        jobs.send_mail = fail_for_jane
+        try:
+            jobs.run_due()
+            Job.objects.filter(status=Job.PENDING, name='daily_summary').update(run_at=self.past)
+            jobs.run_due()
+        finally:
+            jobs.send_mail = send_mail
+        self.assertEqual(sorted(message.to for message in mail.outbox), [['jane@example.com'], ['john@example.com']])
+        self.assertIn('You completed 2 pomodoros', [m for m in mail.outbox if m.to == ['john@example.com']][0].body)
+
+    def test_periodic_jobs_failed_as_stalled_are_queued_again(self):
+        """
+        A periodic job that stalls on its last attempt should be failed and queued for its next run.
+        """
+        Job.objects.schedule_once('compact_changes', self.past)
+        job = jobs.claim()[0]
+        Job.objects.filter(pk=job.pk).update(locked_until=self.past, attempts=3)
+        self.assertEqual(jobs.requeue_stalled(), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+        queued = Job.objects.get(name='compact_changes', status=Job.PENDING)
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertEqual(queued.unique_name, 'compact_changes')
+
+
+class PomodoroIntervalTests(TestCase):
+
+    def setUp(self):
+        self.u1 = create_user()
+        self.client.login(username='john_doe', password='john_doe')
+        self.start = datetime.datetime(2013, 10, 1, 10, 0, tzinfo=utc)
+
+    def test_sessions_of_custom_length_store_their_duration_and_break(self):
+        """
+        A 50/10 session should store a 50 minute pomodoro and a 10 minute break, every fourth break a long one.
+        """
+        self.client.post(reverse('Pymodoro:index'), {'tag': 'foo', 'minutes': 50, 'break_minutes': 10})
+        session = PomodoroSession.objects.get()
+        self.assertEqual((session.duration, session.break_duration), (50, 10))
+        session.start_time = timezone.now() - datetime.timedelta(minutes=49)
+        session.save()
+        self.assertEqual(PomodoroSession.objects.complete_due(), 0)
+        session.start_time = timezone.now() - datetime.timedelta(minutes=50)
+        session.save()
+        self.assertEqual(PomodoroSession.objects.complete_due(), 1)
+        pomodoro = Pomodoro.objects.get()
+        self.assertEqual((pomodoro.duration, pomodoro.end_time - pomodoro.start_time), (50, datetime.timedelta(minutes=50)))
+        pause = Break.objects.get()
+        self.assertEqual((pause.kind, pause.start_time, pause.minutes()), (Break.SHORT, pomodoro.end_time, 10))
+        self.assertEqual(DailyRollup.objects.get(user=self.u1).minutes, 50)
+        start = pomodoro.start_time - datetime.timedelta(minutes=1)
+        for i in range(3):
+            create_session(self.u1, start - pomodoro_length() * (i + 1)).complete()
+        self.assertEqual(Break.objects.order_by('-id')[0].kind, Break.LONG)
+        self.assertEqual(rollups.check(), [])
+
+    def test_overlaps_and_focused_minutes_in_a_window(self):
+        """
+        The interval queries should find the pomodoros running in a window and add up the minutes inside it.
+        """
+        for minutes, end in ((25, 25), (50, 90), (25, 130)):
+            Pomodoro.objects.create(user=self.u1, tag=Tag.objects.named(self.u1, 'foo'), duration=minutes,
+                                    end_time=self.start + datetime.timedelta(minutes=end))
+        at = lambda minutes: self.start + datetime.timedelta(minutes=minutes)
+        self.assertEqual(Pomodoro.objects.for_user(self.u1).overlapping(at(25), at(40)).count(), 0)
+        self.assertEqual(Pomodoro.objects.for_user(self.u1).overlapping(at(80), at(110)).count(), 2)
+        self.assertEqual(Pomodoro.objects.for_user(self.u1).focused_minutes(at(0), at(130)), 100)
+        self.assertEqual(Pomodoro.objects.for_user(self.u1).focused_minutes(at(10), at(120)), 15 + 50 + 15)
+        self.assertEqual(Pomodoro.objects.for_user(self.u1).focused_minutes(at(60), at(70)), 10)
+
+    def test_changed_durations_move_the_rollup_minutes(self):
+        """
+        Changing the length of a stored pomodoro should update its start time and the rollups.
+        """
+        p = create_pomodoro(self.u1, self.start)
+        p.duration = 45
+        p.save()
+        self.assertEqual(Pomodoro.objects.get(pk=p.pk).init_time(), self.start - datetime.timedelta(minutes=45))
+        self.assertEqual(DailyRollup.objects.get(user=self.u1).minutes, 45)
+        self.assertEqual(rollups.check(), [])
+
+    def test_api_refuses_overlapping_pomodoros_and_imports_take_minutes(self):
+        """
+        The API should not store a pomodoro over another one, and imports should keep the minutes of every row.
+        """
+        create_pomodoro(self.u1, self.start)
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % ApiToken.objects.for_user(self.u1).key}
+        response = self.client.post(reverse('Pymodoro:api_pomodoros'), json.dumps(
+            {'tag': 'foo', 'end_time': '2013-10-01T10:20:00Z', 'minutes': 30}), content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 409)
+        transfer.import_lines(self.u1, ['tag,end_time,minutes\n', 'bar,2013-10-02T10:00:00Z,50\n',
+                                        'bar,2013-10-03T10:00:00Z,\n'])
+        self.assertEqual(list(Pomodoro.objects.filter(tag__name='bar').order_by('end_time').values_list('duration', flat=True)),
+                         [50, 25])
+
+    def test_pomodoros_over_a_stored_one_are_refused_where_they_are_written(self):
+        """
+        Completed sessions, API batches, sync changes and imports should not store a pomodoro over another one.
+        """
+        stored = create_pomodoro(self.u1, self.start)
+        session = create_session(self.u1, self.start - datetime.timedelta(minutes=10))
+        self.assertFalse(session.complete())
+        self.assertEqual(PomodoroSession.objects.get(pk=session.pk).status, PomodoroSession.ABANDONED)
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % ApiToken.objects.for_user(self.u1).key}
+        response = self.client.post(reverse('Pymodoro:api_batch'), json.dumps({'pomodoros': [
+            {'tag': 'bar', 'end_time': '2013-10-01T11:00:00Z'}, {'tag': 'bar', 'end_time': '2013-10-01T10:10:00Z'}]}),
+            content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 409)
+        other = create_pomodoro(self.u1, self.start + datetime.timedelta(hours=1))
+        response = self.client.post(reverse('Pymodoro:api_sync'), json.dumps({'cursor': 0, 'changes': [
+            {'op': 'create', 'tag': 'bar', 'end_time': '2013-10-01T09:50:00Z'},
+            {'op': 'update', 'id': other.id, 'base_seq': 2, 'tag': 'bar', 'end_time': '2013-10-01T10:05:00Z'},
+        ]}), content_type='application/json', **auth)
+        self.assertEqual(json.loads(response.content)['results'], [{'result': 'conflict', 'id': None},
+                                                                   {'result': 'conflict', 'id': other.id}])
+        with self.assertRaisesRegexp(ValueError, 'overlaps'):
+            transfer.import_lines(self.u1, ['tag,end_time\n', 'bar,2013-10-02T10:00:00Z\n', 'bar,2013-10-02T10:20:00Z\n'])
+        self.assertEqual(list(Pomodoro.objects.filter(user=self.u1).order_by('end_time')), [stored, other])
+        self.assertEqual(rollups.check(), [])
+
+    def test_overlap_checks_lock_the_user_and_not_the_change_log(self):
+        """
+        Checking for overlaps should lock the user's PomodoroLock row and leave the change sequence alone.
+        """
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                self.assertFalse(Pomodoro.objects.taken(self.u1.id, self.start, self.start + pomodoro_length()))
+        self.assertTrue(PomodoroLock.objects.filter(user=self.u1).exists())
+        self.assertFalse(ChangeSequence.objects.filter(user=self.u1).exists())
+        self.assertFalse([query for query in captured.captured_queries if 'changesequence' in query['sql']])
+
+REPLICA = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+
+class PomodoroReplicaTests(TestCase):
+
+    def setUp(self):
+        # An empty replica, so reads that went to it are told apart by what they find.
+        self.settings = override_settings(DATABASES=dict(settings.DATABASES, replica=REPLICA))
+        self.settings.enable()
+        connections.databases['replica'] = dict(REPLICA)
+        call_command('syncdb', database='replica', verbosity=0, interactive=False)
+        cache.clear()
+        self.u1 = create_user()
+        self.client.login(username='john_doe', password='john_doe')
+
+    def test_tag_view_reads_from_the_replica(self):
+        """
+        The tag view should read from the replica, but from the primary right after the user wrote.
+        """
+        p = create_pomodoro(self.u1, timezone.now())
+        self.assertTrue(routers.wrote_recently(self.u1.id))
+        response = self.client.get(reverse('Pymodoro:tag', args=(p.tag.name,)))
+        self.assertEqual(response.status_code, 200)
+        cache.clear()
+        response = self.client.get(reverse('Pymodoro:tag', args=(p.tag.name,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_search_reads_from_the_replica(self):
+        """
+        Tag searches of the API should run on the replica, like the other reads.
+        """
+        create_pomodoro(self.u1, timezone.now(), 'foo')
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % ApiToken.objects.for_user(self.u1).key}
+        response = self.client.get(reverse('Pymodoro:api_search'), {'q': 'foo'}, **auth)
+        self.assertEqual([tag['name'] for tag in json.loads(response.content)['tags']], ['foo'])
+        cache.clear()
+        response = self.client.get(reverse('Pymodoro:api_search'), {'q': 'foo'}, **auth)
+        self.assertEqual(json.loads(response.content)['tags'], [])
+
+    def test_import_counts_as_a_write(self):
+        """
+        Imported pomodoros skip the save signals, the import should still keep the user on the primary.
+        """
+        transfer.import_pomodoros(self.u1, [('foo', timezone.now(), 25)])
+        self.assertTrue(routers.wrote_recently(self.u1.id))
+
+    def tearDown(self):
+        self.u1.delete()
+        connections['replica'].close()
+        del connections.databases['replica']
+        delattr(connections._connections, 'replica')
+        self.settings.disable()
+        cache.clear()
+
+class PomodoroLoadTestTests(unittest.TestCase):
+
+    def test_drive_sends_concurrent_requests_to_the_wsgi_application(self):
+        """
+        drive() should send every request through the served application and time them.
+        """
+        server = loadtest.serve(WSGIHandler())
+        try:
+            results = loadtest.drive(server, [reverse('Pymodoro:index')], concurrency=3, requests=10)
+        finally:
+            server.shutdown()
+        self.assertEqual(results['errors'], 0)
+        self.assertGreater(results['requests_per_s'], 0)
+
+    def test_compare_flags_metrics_that_got_worse(self):
+        """
+        compare() should flag slower timings and lower throughput past the threshold, and any extra query.
+        """
+        old = {'results': {'views.tag': {'p50_ms': 10.0, 'queries': 5}, 'load': {'requests_per_s': 100.0}}}
+        new = {'results': {'views.tag': {'p50_ms': 10.5, 'queries': 6}, 'load': {'requests_per_s': 80.0}}}
+        self.assertEqual(loadtest.compare(old, new, threshold=10), [
+            ('load', 'requests_per_s', 100.0, 80.0, -20.0), ('views.tag', 'queries', 5, 6, 20.0)])
+        self.assertEqual(loadtest.compare(new, old, threshold=10), [])
+
+
+class PomodoroBenchmarkTests(unittest.TestCase):
+
+    def test_every_scenario_runs_at_a_tiny_size(self):
+        """
+        Every benchmark scenario should run to the end through the management command.
+        """
+        from Pymodoro.benchmarks import SCENARIOS
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for scenario in sorted(SCENARIOS):
+            command = [sys.executable, 'manage.py', 'benchmark', scenario, '--sizes', '5', '--repeat', '1',
+                       '--users', '1', '--pomodoros', '10', '--concurrency', '2', '--requests', '4',
+                       '--output', os.path.join(directory, 'results.json')]
+            process = subprocess.Popen(command, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+            self.assertEqual(process.returncode, 0, '%s failed:\n%s' % (scenario, output.decode('utf-8', 'replace')))
+
+
+class PomodoroStartupTests(TestCase):
+    urls = 'MyProject.urls_api'
+
+    def test_api_profile_serves_the_api_alone(self):
+        """
+        The API-only URLs should keep the paths and names of the API and leave the HTML views out.
+        """
+        from MyProject import settings_api
+        self.assertFalse(set(settings_api.INSTALLED_APPS) & set(['django.contrib.admin', 'django.contrib.messages',
+                                                                  'django.contrib.staticfiles']))
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % ApiToken.objects.for_user(create_user()).key}
+        self.assertEqual(reverse('Pymodoro:api_tags'), '/pymodoro/api/tags/')
+        with override_settings(MIDDLEWARE_CLASSES=settings_api.MIDDLEWARE_CLASSES):
+            self.assertEqual(self.client.get('/pymodoro/api/tags/', **auth).status_code, 200)
+            self.assertEqual(self.client.get('/pymodoro/').status_code, 404)
+
+    @override_settings(ROOT_URLCONF='MyProject.urls')
+    def test_views_are_named_in_the_urls(self):
+        """
+        Views named by string should resolve to the same functions as before.
+        """
+        self.assertIs(resolve('/pymodoro/').func, views.index)
+        self.assertIs(resolve('/pymodoro/api/tags/').func, api.tags)
+
+    def test_api_process_does_not_import_the_html_side(self):
+        """
+        A new API-only process should answer its first request without importing the admin, the views or their forms.
+        """
+        profile = startup.run('MyProject.settings_api', '/pymodoro/api/tags/')
+        self.assertEqual(profile['status'], '401 UNAUTHORIZED')
+        self.assertIn('Pymodoro.api', profile['loaded'])
+        # Imported by api with from Pymodoro import ..., as the views would be.
+        self.assertIn('Pymodoro.caching', profile['loaded'])
+        self.assertNotIn('Pymodoro.views', profile['loaded'])
+        self.assertNotIn('Pymodoro.forms', profile['loaded'])
+        self.assertNotIn('django.contrib.admin', profile['loaded'])
+        self.assertLessEqual(profile['models_ms'], profile['first_response_ms'])
+
+    def test_modules_imported_from_their_package_are_timed(self):
+        """
+        An import of a module from its already loaded package should be timed under the module's name.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.mkdir(os.path.join(directory, 'startup_probe'))
+        for name, source in (('__init__.py', ''), ('views.py', 'import startup_probe.helpers\n'), ('helpers.py', '')):
+            with open(os.path.join(directory, 'startup_probe', name), 'w') as f:
+                f.write(source)
+        sys.path.insert(0, directory)
+        self.addCleanup(sys.path.remove, directory)
+        for name in ('startup_probe', 'startup_probe.views', 'startup_probe.helpers'):
+            self.addCleanup(sys.modules.pop, name, None)
+            self.addCleanup(startup._import_times.pop, name, None)
+        startup.timed_import('startup_probe')
+        # Nested imports go through the hook too, as in a profiled process.
+        startup.builtins.__import__ = startup.timed_import
+        try:
+            startup.timed_import('startup_probe', {}, {}, ['views'])
+        finally:
+            startup.builtins.__import__ = startup._import
+        self.assertIn('startup_probe.views', startup._import_times)
+        self.assertIn('startup_probe.helpers', startup._import_times)
+        self.assertIn('startup_probe.views', startup.loaded_modules())
+
+
+class PomodoroAssetTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        static_root = override_settings(STATIC_ROOT=self.root)
+        static_root.enable()
+        self.addCleanup(static_root.disable)
+        # The storage reads the manifest of STATIC_ROOT once.
+        staticfiles_storage._wrapped = empty
+        self.addCleanup(setattr, staticfiles_storage, '_wrapped', empty)
+
+    def serve(self, path, **headers):
+        response = {}
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO=path, **headers)
+        app = assets.StaticFilesApplication(lambda environ, start_response: ['django'])
+        body = b''.join(app(environ, lambda status, headers: response.update(status=status, headers=dict(headers))))
+        return response.get('status'), response.get('headers'), body
+
+    def test_minify_css(self):
+        """
+        minify_css() should drop comments and whitespace but not touch strings.
+        """
+        self.assertEqual(assets.minify_css('a:hover , p > b {\n  content: "a , b" ; /* note */\n  color: red;\n}\n'),
+                         'a:hover,p>b{content:"a , b";color:red}')
+
+    @override_settings(DEBUG=False)
+    def test_collectstatic_writes_hashed_optimized_files_and_a_manifest(self):
+        """
+        collectstatic should write hashed, minified and gzipped copies listed in the manifest, which the pages link.
+        """
+        call_command('collectstatic', interactive=False, verbosity=0)
+        paths = assets.read_manifest(self.root)
+        css, png = paths['Pymodoro/style.css'], paths['Pymodoro/images/tomato.png']
+        self.assertRegexpMatches(css, r'^Pymodoro/style\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.root, css)) as stylesheet:
+            minified = stylesheet.read()
+        self.assertNotIn('\n', minified)
+        self.assertIn('url("%s")' % png.split('/', 1)[1], minified)
+        with gzip.open(os.path.join(self.root, css + '.gz')) as compressed:
+            self.assertEqual(compressed.read().decode('utf-8'), minified)
+        # The name is the hash of the minified stylesheet, before its links are hashed.
+        with open(os.path.join(self.root, 'Pymodoro/style.css'), 'rb') as stylesheet:
+            self.assertEqual(css, staticfiles_storage.hashed_name('Pymodoro/style.css', ContentFile(stylesheet.read())))
+        staticfiles_storage._wrapped = empty
+        self.assertContains(self.client.get(reverse('Pymodoro:index')), '/static/%s' % css)
+
+    def test_application_serves_hashed_files_for_good(self):
+        """
+        Hashed files should be served compressed when accepted and cached for a year, the others revalidated.
+        """
+        os.makedirs(os.path.join(self.root, 'Pymodoro'))
+        for name, data in (('Pymodoro/style.css', b'a{}'), ('Pymodoro/style.0123456789ab.css', b'a{}'),
+                           ('Pymodoro/style.0123456789ab.css.gz', assets.gzipped(b'a{}')),
+                           (assets.MANIFEST_NAME, b'{"paths": {"Pymodoro/style.css": "Pymodoro/style.0123456789ab.css"}}')):
+            with open(os.path.join(self.root, name), 'wb') as collected:
+                collected.write(data)
+        status, headers, body = self.serve('/static/Pymodoro/style.0123456789ab.css', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Cache-Control'], assets.IMMUTABLE)
+        self.assertEqual((headers['Content-Encoding'], headers['Vary'], headers['Content-Type']),
+                         ('gzip', 'Accept-Encoding', 'text/css'))
+        self.assertEqual(body, assets.gzipped(b'a{}'))
+        status, headers, body = self.serve('/static/Pymodoro/style.0123456789ab.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertEqual((body, 'Content-Encoding' in headers), (b'a{}', False))
+        status, headers, body = self.serve('/static/Pymodoro/style.css')
+        self.assertEqual(headers['Cache-Control'], assets.REVALIDATE)
+        self.assertEqual(self.serve('/static/Pymodoro/style.css', HTTP_IF_NONE_MATCH=headers['ETag'])[0],
+                         '304 NOT MODIFIED')
+        self.assertEqual(self.serve('/static/../MyProject/settings.py')[0], '404 NOT FOUND')
+        self.assertEqual(self.serve('/pymodoro/')[2], b'django')
+
+
+class PomodoroSearchTests(TestCase):
+
+    def setUp(self):
+        self.u1, self.u2 = create_user(), create_user('jane_doe')
+        now = timezone.now()
+        for i, name in enumerate((u'Deep work', u'Deep work', u'Café reading', u'fÓóÖ', u'Email', u'Writing the thesis')):
+            create_pomodoro(self.u1, now - datetime.timedelta(hours=i), name)
+        create_pomodoro(self.u2, now, u'Deep dive')
+        self.client.login(username='john_doe', password='john_doe')
+
+    def names(self, query, user=None):
+        return [(result['name'], result['match']) for result in search.search_tags(user or self.u1, query)]
+
+    def test_search_matches_word_prefixes_ignoring_case_and_accents(self):
+        """
+        Every word of the query should start a word of the tag, whatever its case and accents.
+        """
+        self.assertEqual(self.names(u'DEEP wo'), [(u'Deep work', search.PREFIX)])
+        self.assertEqual(self.names(u'cafe'), [(u'Café reading', search.PREFIX)])
+        self.assertEqual(self.names(u'read'), [(u'Café reading', search.PREFIX)])
+        self.assertEqual(self.names(u'fooo'), [(u'fÓóÖ', search.PREFIX)])
+        self.assertEqual(self.names(u'deep', self.u2), [(u'Deep dive', search.PREFIX)])
+        self.assertEqual(self.names(u'  '), [])
+
+    def test_search_falls_back_to_similar_tags(self):
+        """
+        Misspelled words should find the tags with the closest words, and nothing when none is close.
+        """
+        self.assertEqual(self.names(u'emial'), [(u'Email', search.FUZZY)])
+        self.assertEqual(self.names(u'thesys'), [(u'Writing the thesis', search.FUZZY)])
+        self.assertEqual(self.names(u'zzz'), [])
+        self.assertTrue(search.one_edit_apart(u'email', u'emial'))
+        self.assertTrue(search.one_edit_apart(u'thesis', u'thesiss'))
+        self.assertFalse(search.one_edit_apart(u'email', u'mail box'))
+
+    def test_index_follows_the_tags(self):
+        """
+        Renamed and deleted tags should be searched by their new name or not at all, and rebuild_search should refill the index.
+        """
+        tag = Tag.objects.get(user=self.u1, name=u'Email')
+        tag.name = u'Inbox'
+        tag.save()
+        self.assertEqual(self.names(u'inbox'), [(u'Inbox', search.PREFIX)])
+        self.assertEqual(self.names(u'email'), [])
+        Tag.objects.filter(name=u'Café reading').delete()
+        self.assertEqual(self.names(u'cafe'), [])
+        connection.cursor().execute('DELETE FROM %s' % search.TABLE)
+        call_command('rebuild_search', stdout=StringIO())
+        self.assertEqual(self.names(u'dee'), [(u'Deep work', search.PREFIX)])
+
+    def test_tags_are_saved_and_searched_without_the_index(self):
+        """
+        Without the index, e.g. on an SQLite without FTS5, tags should still be saved and searched one by one.
+        """
+        connection.cursor().execute('DROP TABLE %s' % search.TABLE)
+        search._indexed.clear()
+        self.addCleanup(search._indexed.clear)
+        create_pomodoro(self.u1, timezone.now(), u'Inbox zero')
+        self.assertEqual(self.names(u'inb'), [(u'Inbox zero', search.PREFIX)])
+        self.assertEqual(self.names(u'thesys'), [(u'Writing the thesis', search.FUZZY)])
+
+    def test_search_endpoints_return_counts(self):
+        """
+        The search view and API should return the matching tags with their rollup counts.
+        """
+        response = self.client.get(reverse('Pymodoro:search'), {'q': u'déep'})
+        self.assertEqual(json.loads(response.content)['tags'], [
+            {'name': u'Deep work', 'count': 2, 'minutes': 50, 'match': 'prefix',
+             'url': reverse('Pymodoro:tag', args=(u'Deep work',))}])
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % ApiToken.objects.for_user(self.u2).key}
+        response = self.client.get(reverse('Pymodoro:api_search'), {'q': 'deep'}, **auth)
+        self.assertEqual(json.loads(response.content)['tags'],
+                         [{'name': u'Deep dive', 'count': 1, 'minutes': 25, 'match': 'prefix'}])
+        self.assertEqual(self.client.get(reverse('Pymodoro:api_search'), {'q': 'deep'}).status_code, 401)
@@ -0,0 +1,250 @@
+"""
+Streaming export and bulk import of a user's pomodoro history.
+
+Both formats hold one pomodoro per row with its tag, end time and minutes: CSV
+with a 'tag,end_time,minutes' header, or NDJSON (one JSON object per line).
+The minutes are optional, rows without them last POMODORO_MINUTES. Exports walk the
+history in keyset pages and imports insert with bulk_create in batches, so
+memory stays constant whatever the size of the history.
+"""
+
+from django import forms
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.core.exceptions import ValidationError
+
+from collections import Counter
+import csv, datetime, json
+
+from Pymodoro.models import (MIN_MINUTES, Pomodoro, PomodoroLock, Tag, bump_rollup, default_minutes, max_minutes,
+                             record_changes, rollup_rows, team_ids)
+from Pymodoro.pagination import keyset_page
+from Pymodoro.routers import mark_write
+
+FIELDS = ('tag', 'end_time', 'minutes')
+# Columns a CSV import needs, the other ones are optional.
+REQUIRED_FIELDS = ('tag', 'end_time')
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_PAGE_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+# The rows are checked like the start form checks a pomodoro, without importing Pymodoro.forms,
+# so processes serving the API alone leave the HTML side out.
+TAG_FIELD = forms.CharField(max_length=Tag._meta.get_field('name').max_length)
+MINUTES_FIELD = forms.IntegerField(min_value=MIN_MINUTES, max_value=max_minutes())
+
+
+class Echo(object):
+    # A file-like object for csv.writer that hands back what it is given.
+    def write(self, value):
+        return value
+
+
+def csv_line(values):
+    if six.PY2:
+        values = [force_bytes(value) for value in values]
+    return csv.writer(Echo()).writerow(values)
+
+
+def export_lines(user, format='csv'):
+    """
+    Yields the user's pomodoros from newest to oldest as lines of the given format.
+    """
+    if format == 'csv':
+        yield csv_line(FIELDS)
+    pomodoros = Pomodoro.objects.for_user(user).select_related('tag').only('end_time', 'duration', 'tag__name')
+    page = keyset_page(pomodoros, EXPORT_PAGE_SIZE)
+    while page.object_list:
+        for pomodoro in page:
+            if format == 'csv':
+                yield csv_line([pomodoro.tag.name, pomodoro.end_time.isoformat(), pomodoro.duration])
+            else:
+                yield json.dumps({'tag': pomodoro.tag.name, 'end_time': pomodoro.end_time.isoformat(),
+                                  'minutes': pomodoro.duration}) + '\n'
+        if not page.next_cursor:
+            break
+        page = keyset_page(pomodoros, EXPORT_PAGE_SIZE, after=page.next_cursor)
+
+
+def parse_lines(lines, format='csv'):
+    """
+    Yields a (line number, tag, end time, minutes) tuple with the raw values of every row,
+    minutes being None when a row has none.
+    """
+    if format == 'csv':
+        if six.PY2:
+            rows = ([force_text(value) for value in row] for row in csv.reader(lines))
+        else:
+            rows = csv.reader(force_text(line) for line in lines)
+        header = next(rows, None)
+        if header is None:
+            return
+        try:
+            columns = [header.index(field) for field in REQUIRED_FIELDS]
+        except ValueError:
+            raise ValueError('Line 1: the header must have the %s columns.' % ', '.join(REQUIRED_FIELDS))
+        minutes = header.index('minutes') if 'minutes' in header else None
+        for number, row in enumerate(rows, 2):
+            if not row:
+                continue
+            try:
+                yield (number,) + tuple(row[column] for column in columns) + (
+                    row[minutes] if minutes is not None else None,)
+            except IndexError:
+                raise ValueError('Line %d: missing columns.' % number)
+    else:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(force_text(line))
+                yield number, row['tag'], row['end_time'], row.get('minutes')
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise ValueError('Line %d: not a JSON object with %s.' % (number, ', '.join(REQUIRED_FIELDS)))
+
+
+def clean_pomodoro(tag, end_time, minutes=None):
+    """
+    Returns the tag name, aware end time and minutes of raw values, or raises ValueError.
+    """
+    try:
+        tag = TAG_FIELD.clean(tag)
+    except ValidationError:
+        raise ValueError('%r is not a valid tag.' % (tag,))
+    try:
+        value = parse_datetime(end_time or '')
+    except (ValueError, TypeError):
+        value = None
+    if value is None:
+        raise ValueError('%r is not a date and time.' % (end_time,))
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_current_timezone())
+    if minutes in (None, ''):
+        return tag, value, default_minutes()
+    try:
+        minutes = MINUTES_FIELD.clean(minutes)
+    except ValidationError:
+        raise ValueError('%r is not a valid number of minutes.' % (minutes,))
+    return tag, value, minutes
+
+
+def clean_row(number, tag, end_time, minutes=None):
+    try:
+        return clean_pomodoro(tag, end_time, minutes)
+    except ValueError as e:
+        raise ValueError('Line %d: %s' % (number, e))
+
+
+def import_pomodoros(user, pomodoros, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Stores (tag name, end time, minutes) tuples for the user with bulk inserts of batch_size rows, in
+    a single transaction, and updates the rollups, team scores and change log bulk_create
+    skips. Raises ValueError, storing nothing, if one overlaps a stored pomodoro or another one.
+    Returns the number of pomodoros stored.
+    """
+    imported = 0
+    tags = {}
+    teams = team_ids(user.id)
+    with transaction.atomic():
+        # Other writes of the user wait, so they cannot overlap the pomodoros checked here.
+        PomodoroLock.objects.lock(user.id)
+        batch = []
+        for name, end_time, minutes in pomodoros:
+            # Each tag is looked up or created once per import, not once per row.
+            if name not in tags:
+                tags[name] = Tag.objects.named(user, name)
+            batch.append(Pomodoro(user=user, tag=tags[name], end_time=end_time, duration=minutes))
+            if len(batch) >= batch_size:
+                imported += store_batch(batch, teams)
+                batch = []
+        imported += store_batch(batch, teams)
+    mark_write(user.id)
+    return imported
+
+
+def insert_batch(batch):
+    """
+    Inserts the pomodoros with bulk_create and returns their ids, which it does not hand back.
+    """
+    if connection.vendor == 'postgresql':
+        # Taken from the sequence first, bulk_create then inserts them as given.
+        cursor = connection.cursor()
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                       [connection.ops.quote_name(Pomodoro._meta.db_table), len(batch)])
+        for pomodoro, (pk,) in zip(batch, sorted(cursor.fetchall())):
+            pomodoro.pk = pk
+        Pomodoro.objects.bulk_create(batch)
+        return [pomodoro.pk for pomodoro in batch]
+    Pomodoro.objects.bulk_create(batch)
+    # SQLite numbers new rows after the greatest id, and the insert holds the write lock until the
+    # transaction ends, so the batch has the greatest ids even with other writers around.
+    return sorted(Pomodoro.objects.order_by('-id').values_list('id', flat=True)[:len(batch)])
+
+
+def overlap_runs(batch):
+    """
+    Splits the pomodoros of a batch, sorted by start time, where the next one starts more than
+    the longest pomodoro after the end of those before it, so the stored pomodoros that may
+    overlap a run are those of its own span, however the rows of the file are ordered.
+    """
+    gap = datetime.timedelta(minutes=max_minutes())
+    run, run_end = [], None
+    for pomodoro in batch:
+        if run and pomodoro.start_time > run_end + gap:
+            yield run
+            run = []
+        run_end = max(run_end, pomodoro.end_time) if run else pomodoro.end_time
+        run.append(pomodoro)
+    if run:
+        yield run
+
+
+def check_overlaps(batch):
+    """
+    Raises ValueError if a pomodoro of the batch overlaps a stored one, which includes those
+    of the earlier batches of the import, or another one of the batch. Reads the stored
+    pomodoros near those of the batch only, through the (user, end_time) index.
+    """
+    for pomodoro in batch:
+        pomodoro.set_start_time()
+    stored = Pomodoro.objects.filter(user_id=batch[0].user_id)
+    for run in overlap_runs(sorted(batch, key=lambda pomodoro: pomodoro.start_time)):
+        nearby = stored.overlapping(run[0].start_time, max(p.end_time for p in run)).values_list('start_time', 'end_time')
+        intervals = sorted([(start, end, False) for start, end in nearby] + [(p.start_time, p.end_time, True) for p in run])
+        # The interval ending last so far.
+        last_end, last_new = None, False
+        for start, end, new in intervals:
+            if last_end is not None and start < last_end and (new or last_new):
+                raise ValueError('The pomodoro ending at %s overlaps another one.' % (end if new else last_end).isoformat())
+            if last_end is None or end > last_end:
+                last_end, last_new = end, new
+
+
+def store_batch(batch, teams=()):
+    if not batch:
+        return 0
+    check_overlaps(batch)
+    # Only the pomodoros inserted here are logged, the ones saved meanwhile were logged by their signals.
+    record_changes(batch[0].user_id, insert_batch(batch))
+    # One rollup update per day and per tag of the batch, not per pomodoro.
+    counts, minutes = Counter(), Counter()
+    for pomodoro in batch:
+        rollup_key = pomodoro.rollup_key()
+        for row in rollup_rows(rollup_key, teams):
+            counts[row] += 1
+            minutes[row] += pomodoro.minutes()
+    for model, key in counts:
+        bump_rollup(model, counts[model, key], minutes[model, key], **dict(key))
+    return len(batch)
+
+
+def import_lines(user, lines, format='csv', batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports lines of the given format for the user, all or nothing. Raises ValueError
+    with the line number of the first row that is not valid.
+    """
+    rows = (clean_row(*row) for row in parse_lines(lines, format))
+    return import_pomodoros(user, rows, batch_size)
@@ -1,13 +1,22 @@
 # coding=utf-8
 
-from django.conf.urls import patterns, url
+from django.conf.urls import patterns, include, url
 
-from Pymodoro import views
-
-urlpatterns = patterns('',
+# Views are named rather than imported, a request imports only the module of its own view.
+urlpatterns = patterns('Pymodoro.views',
     #url(r'^$', views.IndexView.as_view(), name='index'),
-    url(r'^$', views.index, name='index'),
-    url(r'^(?P<pk>\d+)/$', views.DetailView.as_view(), name='detail'),
-    url(r'^tag/(?P<tag>[\w|\W]*)/$', views.tag, name='tag'),
-    url(r'^logout/$', views.logoutView, name='logout'),
-)
\ No newline at end of file
+    url(r'^$', 'index', name='index'),
+    url(r'^(?P<pk>\d+)/$', 'detail', name='detail'),
+    url(r'^session/(?P<pk>\d+)/end/$', 'end_session', name='end_session'),
+    url(r'^session/(?P<pk>\d+)/events/$', 'session_events', name='session_events'),
+    url(r'^export/$', 'export_history', name='export'),
+    url(r'^import/$', 'import_history', name='import'),
+    url(r'^stats/(?P<kind>day|week|month|tags|hours|streaks)/$', 'statistics', name='stats'),
+    url(r'^tags/autocomplete/$', 'tag_autocomplete', name='tag_autocomplete'),
+    url(r'^tags/search/$', 'search_tags', name='search'),
+    url(r'^tag/(?P<tag>[\w|\W]*)/$', 'tag', name='tag'),
+    url(r'^teams/(?P<pk>\d+)/leaderboard/(?P<period>day|week)/$', 'leaderboard', name='leaderboard'),
+    url(r'^logout/$', 'logoutView', name='logout'),
+    url(r'^metrics/$', 'metrics', name='metrics'),
+    url(r'^api/', include('Pymodoro.api_urls')),
+)
@@ -1,42 +1,73 @@
-from django.shortcuts import render, get_list_or_404
-from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
+from django.core.urlresolvers import reverse, reverse_lazy
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.http import require_POST
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.decorators import login_required
 
-import time
+import datetime, json
 
-from Pymodoro.models import Pomodoro, PomodoroManager
+from Pymodoro import caching, instrumentation, leaderboards, rollups, search, stats, transfer
+from Pymodoro.models import Pomodoro, PomodoroSession, Tag, Team, default_break_minutes, default_minutes
+from Pymodoro.pagination import keyset_page
+from Pymodoro.routers import reads_from_replica
+from Pymodoro.shortcuts import json_response, parse_day
 from Pymodoro.forms import StartForm
 from django.contrib.auth.forms import AuthenticationForm
 
 
 def index(request):
     if request.user.is_authenticated():
+        PomodoroSession.objects.complete_due(user=request.user)
+        running_session = PomodoroSession.objects.running(request.user).first()
+        error_message = None
         if request.method == 'POST':
             form = StartForm(request.POST)
             if form.is_valid():
-                time.sleep(1*1) # minutes * seconds/minute
-                pomodoro_tag = form.cleaned_data['tag']
-                new_pomodoro = Pomodoro(user=request.user, end_time=timezone.now(), tag=pomodoro_tag)
-                new_pomodoro.save()
-                return HttpResponseRedirect(reverse('Pymodoro:index'))
+                now = timezone.now()
+                minutes = form.cleaned_data['minutes'] or default_minutes()
+                break_minutes = form.cleaned_data['break_minutes'] or default_break_minutes()
+                if running_session is not None:
+                    error_message = 'You already have a pomodoro running.'
+                elif Pomodoro.objects.for_user(request.user).overlapping(
+                        now, now + datetime.timedelta(minutes=minutes)).exists():
+                    error_message = 'You already have a pomodoro stored for this time.'
+                else:
+                    # The pomodoro is stored when its session completes, the request does not wait for it.
+                    PomodoroSession.objects.create(user=request.user, tag=form.cleaned_data['tag'], start_time=now,
+                                                   duration=minutes, break_duration=break_minutes)
+                    return HttpResponseRedirect(reverse('Pymodoro:index'))
         else:
             form = StartForm()
-        pm = PomodoroManager()
-        today_pomodoro_list = pm.are_from_today(request.user)
-        return render(request, 'Pymodoro/index.html', {'form': form, 'today_pomodoro_list': today_pomodoro_list})
+        with instrumentation.span('today'):
+            # One version for both, the fragment is rendered from the list.
+            version = caching.data_version(request.user.id)
+            today_pomodoro_list = caching.today_list(request.user, version)
+        today_fragment = caching.today_fragment(request.user, lambda: render_to_string('Pymodoro/today.html', {
+            'today_pomodoro_list': today_pomodoro_list, 'today_pomodoro_count': rollups.today_count(request.user)}),
+            version)
+        return render(request, 'Pymodoro/index.html', {'form': form, 'today_pomodoro_list': today_pomodoro_list,
+                                                       'today_fragment': today_fragment,
+                                                       'running_session': running_session, 'error_message': error_message})
     else:
         if request.method == 'POST':
             form = AuthenticationForm(data=request.POST)
-            if form.is_valid():
-                username = request.POST['username']
-                password = request.POST['password']
-                access = authenticate(username=username, password=password)
-                if access is not None:
-                    if access.is_active:
-                        login(request, access)
+            # The form authenticates too, both password checks are timed.
+            with instrumentation.span('auth'):
+                valid = form.is_valid()
+                if valid:
+                    username = request.POST['username']
+                    password = request.POST['password']
+                    access = authenticate(username=username, password=password)
+                    if access is not None:
+                        if access.is_active:
+                            login(request, access)
+            if valid:
                 return HttpResponseRedirect(reverse('Pymodoro:index'))
         else:
             form = AuthenticationForm()
@@ -47,14 +78,178 @@ class DetailView(generic.DetailView):
     model = Pomodoro
     template_name = 'Pymodoro/detail.html'
 
+    @method_decorator(reads_from_replica)
+    def dispatch(self, request, *args, **kwargs):
+        return super(DetailView, self).dispatch(request, *args, **kwargs)
+
     def get_queryset(self):
         # Excludes any pomodoros from other user.
-        return Pomodoro.objects.filter(user=self.request.user)
+        return Pomodoro.objects.filter(user=self.request.user).select_related('tag')
+
+
+detail = DetailView.as_view()
+
+
+def pomodoro_json(pomodoro):
+    return {
+        'id': pomodoro.id,
+        'tag': pomodoro.tag.name,
+        'init_time': pomodoro.start_time.isoformat(),
+        'end_time': pomodoro.end_time.isoformat(),
+        'url': reverse('Pymodoro:detail', args=(pomodoro.id,)),
+    }
+
+
+def page_url(request, **params):
+    # The current url with other page parameters, keeping the rest of the query string.
+    query = request.GET.copy()
+    for key in ('after', 'before'):
+        query.pop(key, None)
+    query.update(params)
+    return '%s?%s' % (request.path, query.urlencode())
 
 
+@reads_from_replica
 def tag(request, tag):
-    pomodoro_list = get_list_or_404(Pomodoro, user=request.user, tag=tag)
-    return render(request, 'Pymodoro/tag.html', {'pomodoro_list': pomodoro_list})
+    # The name is resolved once, the pages then use the (tag, end_time) index.
+    tag = get_object_or_404(Tag, user=request.user, name=tag)
+    after, before = request.GET.get('after'), request.GET.get('before')
+    pomodoros = Pomodoro.objects.filter(tag=tag)
+    try:
+        page = keyset_page(pomodoros, getattr(settings, 'POMODORO_PAGE_SIZE', 50), after=after, before=before)
+    except ValueError:
+        raise Http404
+    if not page.object_list and not (after or before):
+        raise Http404
+    next_url = page_url(request, after=page.next_cursor) if page.next_cursor else None
+    previous_url = page_url(request, before=page.previous_cursor) if page.previous_cursor else None
+    for pomodoro in page:
+        pomodoro.tag = tag
+    pomodoro_count = rollups.tag_count(tag)
+    if request.GET.get('format') == 'json':
+        return json_response({'tag': tag.name, 'count': pomodoro_count, 'next': next_url, 'previous': previous_url,
+                              'pomodoros': [pomodoro_json(p) for p in page]})
+    return render(request, 'Pymodoro/tag.html', {'pomodoro_list': page.object_list, 'pomodoro_count': pomodoro_count,
+                                                 'next_url': next_url, 'previous_url': previous_url})
+
+
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+def tag_autocomplete(request):
+    # Suggestions for the tag field of the start form, ?q= being what has been typed so far.
+    names = Tag.objects.autocomplete(request.user, request.GET.get('q', '').strip(),
+                                     getattr(settings, 'POMODORO_AUTOCOMPLETE_SIZE', 10))
+    return json_response({'tags': names})
+
+
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+def search_tags(request):
+    # The user's tags matching ?q=, by the start of their words or, failing that, by similarity.
+    results = search.search_tags(request.user, request.GET.get('q', ''), getattr(settings, 'POMODORO_SEARCH_SIZE', 10))
+    for result in results:
+        result['url'] = reverse('Pymodoro:tag', args=(result['name'],))
+    return json_response({'tags': results})
+
+
+@require_POST
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+def end_session(request, pk):
+    # Completes the session if its time is up, otherwise the pomodoro is abandoned.
+    session = get_object_or_404(PomodoroSession, pk=pk, user=request.user)
+    if session.is_due():
+        session.complete()
+    else:
+        session.abandon()
+    return HttpResponseRedirect(reverse('Pymodoro:index'))
+
+
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+def session_events(request, pk):
+    # The state of a session as server-sent events, polled by the browser, see session_state_events.
+    session = get_object_or_404(PomodoroSession, pk=pk, user=request.user)
+    response = HttpResponse(session_state_events(session), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def server_sent_event(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+
+
+def session_state_events(session):
+    """
+    The events of the current state of a session: a tick with the seconds left, which the
+    browser counts down by itself, or its final status. This is polling with the server-sent
+    events format, not a push channel: the response ends at once and its retry field makes
+    the browser ask again once the seconds are up, or after POMODORO_STATUS_SECONDS, so a
+    session stopped from somewhere else is noticed that late at most. In exchange no worker
+    waits on a running pomodoro.
+    """
+    if session.status == PomodoroSession.RUNNING and session.is_due():
+        if not session.complete():
+            session = PomodoroSession.objects.get(pk=session.pk)
+    if session.status != PomodoroSession.RUNNING:
+        return server_sent_event(session.status, {'session': session.id})
+    remaining = (session.end_time - timezone.now()).total_seconds()
+    retry = min(remaining, getattr(settings, 'POMODORO_STATUS_SECONDS', 15))
+    return 'retry: %d\n\n%s' % (int(retry * 1000) + 1, server_sent_event('tick', {
+        'session': session.id, 'remaining': int(round(remaining)), 'end_time': session.end_time.isoformat()}))
+
+
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+def export_history(request):
+    format = request.GET.get('format', 'csv')
+    if format not in transfer.FORMATS:
+        raise Http404
+    response = StreamingHttpResponse(transfer.export_lines(request.user, format), content_type=transfer.CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename="pomodoros.%s"' % format
+    return response
+
+
+@require_POST
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+def import_history(request):
+    # Expects the history as the 'file' upload, in the 'format' given or guessed from its name.
+    upload = request.FILES.get('file')
+    if upload is None:
+        return json_response({'error': 'No file uploaded.'}, status=400)
+    format = request.POST.get('format') or ('ndjson' if upload.name.endswith(('.ndjson', '.jsonl')) else 'csv')
+    if format not in transfer.FORMATS:
+        return json_response({'error': 'Unknown format %r.' % format}, status=400)
+    try:
+        imported = transfer.import_lines(request.user, upload, format)
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    return json_response({'imported': imported})
+
+
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+@reads_from_replica
+def statistics(request, kind):
+    try:
+        since, until = parse_day(request.GET.get('since')), parse_day(request.GET.get('until'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    return json_response({'kind': kind, 'results': stats.results(request.user, kind, since, until)})
+
+
+@login_required(login_url=reverse_lazy('Pymodoro:index'))
+def leaderboard(request, pk, period):
+    # The best members of one of the user's teams today or this week, and the user's rank.
+    team = get_object_or_404(Team, pk=pk, membership__user=request.user)
+    try:
+        day = parse_day(request.GET.get('day'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    size = getattr(settings, 'POMODORO_LEADERBOARD_SIZE', 10)
+    return json_response(leaderboards.leaderboard(team, request.user, period, size, day))
+
+
+def metrics(request):
+    # The request metrics of this process for Prometheus, with the metrics token or for staff. Each
+    # worker keeps its own, a scrape through the load balancer reads whichever answers.
+    if not instrumentation.internal(request):
+        raise Http404
+    return HttpResponse(instrumentation.render_metrics(), content_type='text/plain; version=0.0.4')
 
 
 def logoutView(request):